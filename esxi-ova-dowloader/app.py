@@ -5,13 +5,23 @@ ESXi OVA Downloader - Flask Application
 Aplicación web para descargar VMs de vCenter como archivos OVA
 """
 
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
 from flask_cors import CORS
+import atexit
 import json
 import os
 import logging
+import threading
 from datetime import datetime
 from vmware_service import VMwareService
+from federation import VCenterFederation, AmbiguousVCenterError
+from compression import normalize_codec, available_codecs
+from export_queue import ExportScheduler, DuplicateExportError
+from job_store import JobStore, DEFAULT_HISTORY_DAYS
+from bandwidth import BandwidthLimiter
+from metrics import REGISTRY, CONTENT_TYPE, EXPORTS_TOTAL, observe_phase
+import tracing
+from event_bus import EventBus, format_sse, DEFAULT_KEEPALIVE_INTERVAL
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # Clave secreta para sesiones
@@ -44,10 +54,16 @@ os.makedirs(config['download_directory'], exist_ok=True)
 
 # Estado global de la aplicación
 app_state = {
-    'vmware_service': None,
-    'download_queue': [],
-    'current_download': None,
-    'download_history': []
+    'vcenters': VCenterFederation(config.get('inventory_timeout', 30)),
+    'scheduler': None,
+    'trace_writer': None,
+    'event_bus': EventBus(),
+    'bandwidth': BandwidthLimiter(
+        limit_mbps=config.get('bandwidth_limit_mbps', 0),
+        per_host_mbps=config.get('bandwidth_per_host_mbps', 0),
+        per_job_mbps=config.get('bandwidth_per_job_mbps', 0),
+        schedule=config.get('bandwidth_schedule', [])
+    )
 }
 
 
@@ -60,7 +76,7 @@ def index():
 @app.route('/api/connect', methods=['POST'])
 def connect():
     """
-    Conectar a vCenter
+    Conectar a un vCenter (se añade a los ya conectados)
     Body: {vcenter_host, username, password}
     """
     try:
@@ -80,24 +96,42 @@ def connect():
             host=vcenter_host,
             username=username,
             password=password,
-            verify_ssl=config.get('verify_ssl', False)
+            verify_ssl=config.get('verify_ssl', False),
+            inventory_ttl=config.get('inventory_cache_ttl', 30),
+            max_parallel_disks=config.get('max_parallel_disks', 4),
+            segments_per_file=config.get('segments_per_file', 1),
+            segment_min_size=config.get('segment_min_size_mb', 256) * 1024 * 1024,
+            stream_ova=config.get('stream_ova', True),
+            chunk_size=int(config.get('chunk_size_mb', 1) * 1024 * 1024),
+            recv_buffer=int(config.get('socket_recv_buffer_kb', 4096) * 1024),
+            zero_copy=config.get('zero_copy_reads', True),
+            drop_page_cache=config.get('drop_page_cache', False),
+            manifest_algorithm=config.get('manifest_algorithm', 'sha256'),
+            compression_level=config.get('compression_level'),
+            compression_threads=config.get('compression_threads'),
+            session_pool_size=config.get('vcenter_sessions', 4),
+            session_keepalive=config.get('session_keepalive_seconds', 600)
         )
         
         # Intentar conectar
         if vmware_service.connect():
             # Guardar en sesión (solo referencia, no credenciales)
             session['connected'] = True
-            session['vcenter_host'] = vcenter_host
             session['username'] = username
             
-            # Guardar servicio en estado de la app
-            app_state['vmware_service'] = vmware_service
+            # Añadir a los vCenters conectados (si ya lo estaba se conserva la
+            # conexión existente, que pueden estar usando trabajos en curso)
+            app_state['vcenters'].add(vmware_service)
             
             logger.info(f"Conectado exitosamente a vCenter: {vcenter_host}")
             
+            # Reanudar los trabajos de este vCenter interrumpidos por un reinicio
+            _resume_recovered(vcenter_host)
+            
             return jsonify({
                 'success': True,
-                'message': f'Conectado exitosamente a {vcenter_host}'
+                'message': f'Conectado exitosamente a {vcenter_host}',
+                'vcenters': app_state['vcenters'].hosts()
             })
         else:
             return jsonify({
@@ -115,19 +149,28 @@ def connect():
 
 @app.route('/api/disconnect', methods=['POST'])
 def disconnect():
-    """Desconectar de vCenter"""
+    """
+    Desconectar de vCenter
+    Body (opcional): {vcenter_host} para desconectar solo ese vCenter
+    """
     try:
-        if app_state['vmware_service']:
-            app_state['vmware_service'].disconnect()
-            app_state['vmware_service'] = None
+        data = request.get_json(silent=True) or {}
+        vcenter_host = data.get('vcenter_host')
+        
+        if vcenter_host:
+            app_state['vcenters'].remove(vcenter_host)
+        else:
+            app_state['vcenters'].clear()
         
-        session.clear()
-        app_state['download_queue'] = []
-        app_state['current_download'] = None
+        # Sin vCenters conectados la cola pendiente ya no puede ejecutarse
+        if not app_state['vcenters'].hosts():
+            session.clear()
+            app_state['scheduler'].clear_pending()
         
         return jsonify({
             'success': True,
-            'message': 'Desconectado exitosamente'
+            'message': 'Desconectado exitosamente',
+            'vcenters': app_state['vcenters'].hosts()
         })
     except Exception as e:
         logger.error(f"Error en desconexión: {str(e)}")
@@ -140,11 +183,11 @@ def disconnect():
 @app.route('/api/vms', methods=['GET'])
 def get_vms():
     """
-    Obtener lista de VMs
-    Query params: host, cluster, power_state, folder (opcionales para filtrar)
+    Obtener lista unificada de VMs de todos los vCenters conectados
+    Query params: vcenter, host, cluster, power_state, folder (opcionales para filtrar)
     """
     try:
-        if not session.get('connected') or not app_state['vmware_service']:
+        if not session.get('connected') or not app_state['vcenters'].hosts():
             return jsonify({
                 'success': False,
                 'error': 'No conectado a vCenter'
@@ -152,6 +195,7 @@ def get_vms():
         
         # Obtener parámetros de filtro
         filters = {
+            'vcenter': request.args.get('vcenter'),
             'host': request.args.get('host'),
             'cluster': request.args.get('cluster'),
             'power_state': request.args.get('power_state'),
@@ -161,17 +205,17 @@ def get_vms():
         # Remover filtros vacíos
         filters = {k: v for k, v in filters.items() if v}
         
-        # Obtener VMs
-        vms = app_state['vmware_service'].get_vms(filters)
-        
-        # Obtener valores únicos para los filtros
-        filter_options = app_state['vmware_service'].get_filter_options()
+        # Inventarios consultados en paralelo; un vCenter caído no vacía la lista
+        view = app_state['vcenters'].get_inventory_view(filters)
         
         return jsonify({
             'success': True,
-            'vms': vms,
-            'filter_options': filter_options,
-            'total': len(vms)
+            'vms': view['vms'],
+            'filter_options': view['filter_options'],
+            'facets': view['facets'],
+            'errors': view['errors'],
+            'vcenters': app_state['vcenters'].hosts(),
+            'total': len(view['vms'])
         })
         
     except Exception as e:
@@ -182,14 +226,63 @@ def get_vms():
         }), 500
 
 
+@app.route('/api/inventory', methods=['GET'])
+def get_inventory_stats():
+    """Obtener contadores de la caché de inventario y del pool de sesiones de cada vCenter"""
+    try:
+        if not session.get('connected') or not app_state['vcenters'].hosts():
+            return jsonify({
+                'success': False,
+                'error': 'No conectado a vCenter'
+            }), 401
+        
+        return jsonify({
+            'success': True,
+            'vcenters': app_state['vcenters'].get_stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error obteniendo estado del inventario: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/inventory/refresh', methods=['POST'])
+def refresh_inventory():
+    """Forzar la recarga completa del inventario de todos los vCenters"""
+    try:
+        if not session.get('connected') or not app_state['vcenters'].hosts():
+            return jsonify({
+                'success': False,
+                'error': 'No conectado a vCenter'
+            }), 401
+        
+        stats = app_state['vcenters'].refresh_inventory()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Inventario recargado',
+            'cache': stats
+        })
+        
+    except Exception as e:
+        logger.error(f"Error recargando inventario: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error recargando inventario: {str(e)}'
+        }), 500
+
+
 @app.route('/api/poweroff', methods=['POST'])
 def poweroff_vm():
     """
     Apagar una VM
-    Body: {vm_name}
+    Body: {vm_name, vcenter (opcional si el nombre es único)}
     """
     try:
-        if not session.get('connected') or not app_state['vmware_service']:
+        if not session.get('connected') or not app_state['vcenters'].hosts():
             return jsonify({
                 'success': False,
                 'error': 'No conectado a vCenter'
@@ -204,7 +297,22 @@ def poweroff_vm():
                 'error': 'Nombre de VM requerido'
             }), 400
         
-        result = app_state['vmware_service'].poweroff_vm(vm_name)
+        try:
+            vcenter = data.get('vcenter') or app_state['vcenters'].resolve_vcenter(vm_name)
+        except AmbiguousVCenterError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        vmware_service = app_state['vcenters'].get(vcenter)
+        if not vmware_service:
+            return jsonify({
+                'success': False,
+                'error': f'VM no encontrada: {vm_name}'
+            }), 404
+        
+        result = vmware_service.poweroff_vm(vm_name)
         
         if result['success']:
             logger.info(f"VM apagada exitosamente: {vm_name}")
@@ -224,25 +332,37 @@ def poweroff_vm():
 def export_vms():
     """
     Exportar VMs seleccionadas como OVA
-    Body: {vm_names: [list], poweroff_before_export: bool}
+    Body: {vms: [{vm_name, vcenter}], poweroff_before_export: bool, compression}
+    (vm_names: [list] sigue aceptándose; el vCenter se busca en el inventario)
     """
     try:
-        if not session.get('connected') or not app_state['vmware_service']:
+        if not session.get('connected') or not app_state['vcenters'].hosts():
             return jsonify({
                 'success': False,
                 'error': 'No conectado a vCenter'
             }), 401
         
         data = request.get_json()
-        vm_names = data.get('vm_names', [])
+        selected = [(vm['vm_name'], vm.get('vcenter')) for vm in data.get('vms', [])]
+        selected += [(vm_name, None) for vm_name in data.get('vm_names', [])]
+        selected = list(dict.fromkeys(selected))
         poweroff_before = data.get('poweroff_before_export', True)
         
-        if not vm_names:
+        if not selected:
             return jsonify({
                 'success': False,
                 'error': 'No se seleccionaron VMs'
             }), 400
         
+        # Compresión al vuelo elegida por petición (por defecto la de config)
+        try:
+            compression = normalize_codec(data.get('compression', config.get('compression', 'none')))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
         # Agregar a la cola de descarga
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         download_dir = os.path.join(
@@ -251,26 +371,74 @@ def export_vms():
         )
         os.makedirs(download_dir, exist_ok=True)
         
-        for vm_name in vm_names:
-            app_state['download_queue'].append({
+        # vCenter, host y datastores de cada VM para repartir la carga
+        vm_list, _ = app_state['vcenters'].get_vm_list()
+        placement = {}
+        for vm in vm_list:
+            placement[(vm['vcenter'], vm['name'])] = vm
+            placement[(vm['vcenter'], vm['moref'])] = vm
+        
+        items = []
+        for vm_name, vcenter in selected:
+            try:
+                vcenter = vcenter or app_state['vcenters'].resolve_vcenter(vm_name, vm_list)
+            except AmbiguousVCenterError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            
+            if not vcenter:
+                return jsonify({
+                    'success': False,
+                    'error': f'VM no encontrada en ningún vCenter: {vm_name}'
+                }), 400
+            
+            vm_info = placement.get((vcenter, vm_name), {})
+            items.append({
                 'vm_name': vm_name,
-                'status': 'pending',
-                'progress': 0,
+                'vcenter': vcenter,
+                'moref': vm_info.get('moref'),
                 'poweroff_before': poweroff_before,
+                'compression': compression,
                 'download_dir': download_dir,
-                'timestamp': timestamp
+                'timestamp': timestamp,
+                'host': vm_info.get('host'),
+                'datastores': vm_info.get('datastores', [])
             })
         
-        logger.info(f"Agregadas {len(vm_names)} VMs a la cola de descarga")
+        # Encolar: los workers de fondo procesan las exportaciones. Si hay que
+        # apagar, los trabajos quedan retenidos hasta que su VM esté apagada
+        try:
+            job_ids = app_state['scheduler'].submit(items, hold=poweroff_before)
+        except DuplicateExportError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'job_ids': [job_id for _, _, job_id in e.duplicates if job_id]
+            }), 409
         
-        # Iniciar descarga si no hay una en progreso
-        if not app_state['current_download']:
-            _process_next_download()
+        if poweroff_before:
+            # Un apagado por vCenter en paralelo: uno lento no retrasa al resto
+            batches = {}
+            for item, job_id in zip(items, job_ids):
+                batches.setdefault(item['vcenter'], {})[item['vm_name']] = job_id
+            
+            for vcenter, jobs_by_vm in batches.items():
+                threading.Thread(
+                    target=_batch_poweroff,
+                    args=(vcenter, jobs_by_vm),
+                    name=f'batch-poweroff-{vcenter}',
+                    daemon=True
+                ).start()
+        
+        logger.info(f"Agregadas {len(items)} VMs a la cola de descarga")
         
         return jsonify({
             'success': True,
-            'message': f'{len(vm_names)} VM(s) agregadas a la cola',
-            'queue_size': len(app_state['download_queue'])
+            'message': f'{len(items)} VM(s) agregadas a la cola',
+            'job_ids': job_ids,
+            'queue_size': len(app_state['scheduler'].snapshot()['queue'])
         })
         
     except Exception as e:
@@ -285,29 +453,178 @@ def export_vms():
 def get_status():
     """Obtener estado de descarga actual y cola"""
     try:
+        return jsonify(_status_payload())
+    except Exception as e:
+        logger.error(f"Error obteniendo estado: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    """
+    Buscar trabajos en la cola y el historial
+    Query params opcionales: status, vm, since, until (fechas ISO), limit
+    """
+    try:
+        jobs = app_state['scheduler'].query(
+            status=request.args.get('status'),
+            vm_name=request.args.get('vm'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            limit=request.args.get('limit', 100, type=int)
+        )
+        
         return jsonify({
             'success': True,
-            'current_download': app_state['current_download'],
-            'queue': app_state['download_queue'],
-            'queue_size': len(app_state['download_queue']),
-            'history': app_state['download_history'][-10:]  # Últimas 10
+            'jobs': jobs,
+            'total': len(jobs)
         })
     except Exception as e:
-        logger.error(f"Error obteniendo estado: {str(e)}")
+        logger.error(f"Error consultando trabajos: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/jobs/<job_id>/trace', methods=['GET'])
+def get_job_trace(job_id):
+    """
+    Spans de un trabajo en formato JSON de OTLP (OpenTelemetry)
+    Se puede enviar tal cual a un receptor OTLP/HTTP (POST /v1/traces)
+    """
+    try:
+        job = app_state['scheduler'].get(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': f'Trabajo no encontrado: {job_id}'
+            }), 404
+        
+        return jsonify(tracing.to_otlp(job.get('trace_id') or '', job.get('spans') or [], {
+            'vm.name': job['vm_name'],
+            'vcenter': job.get('vcenter'),
+            'job.id': job['id'],
+            'job.status': job['status']
+        }))
+    except Exception as e:
+        logger.error(f"Error obteniendo la traza de {job_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/bandwidth', methods=['GET', 'POST'])
+def bandwidth_limits():
+    """
+    Consultar o cambiar en caliente los límites de ancho de banda
+    Body (POST, todo opcional): {limit_mbps, per_host_mbps, per_job_mbps,
+    schedule: [{start, end, limit_mbps}], jobs: {job_id: mbps o null}}
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            
+            try:
+                app_state['bandwidth'].configure(
+                    limit_mbps=data.get('limit_mbps'),
+                    per_host_mbps=data.get('per_host_mbps'),
+                    per_job_mbps=data.get('per_job_mbps'),
+                    schedule=data.get('schedule'),
+                    job_limits=data.get('jobs')
+                )
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            
+            logger.info(f"Límites de ancho de banda actualizados: {data}")
+        
+        return jsonify({
+            'success': True,
+            'bandwidth': app_state['bandwidth'].get_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error en límites de ancho de banda: {str(e)}")
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
 
+@app.route('/metrics')
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/api/events')
+def stream_events():
+    """
+    Stream SSE con los cambios de las exportaciones
+    
+    El primer evento ('snapshot') trae el estado completo; después solo se
+    envían deltas (job_queued, job_started, job_updated, job_progress,
+    job_finished, queue_cleared). Si el cliente se retrasa y su cola se
+    desborda, se le reenvía un snapshot completo.
+    """
+    subscription = app_state['event_bus'].subscribe()
+    
+    def generate():
+        try:
+            yield format_sse('snapshot', _status_payload())
+            
+            while True:
+                event = subscription.get(timeout=DEFAULT_KEEPALIVE_INTERVAL)
+                
+                if subscription.overflowed:
+                    subscription.resync()
+                    yield format_sse('snapshot', _status_payload())
+                elif event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield format_sse(event['event'], event['data'], event['id'])
+        finally:
+            subscription.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/cancel', methods=['POST'])
 def cancel_download():
-    """Cancelar descarga actual y limpiar cola"""
+    """
+    Cancelar descargas
+    Body (opcional): {job_id} para cancelar solo ese trabajo; sin él se
+    cancelan las descargas en curso y se vacía la cola
+    """
     try:
-        app_state['download_queue'] = []
+        data = request.get_json(silent=True) or {}
+        job_id = data.get('job_id')
+        
+        if job_id:
+            if not app_state['scheduler'].cancel(job_id):
+                return jsonify({
+                    'success': False,
+                    'error': 'Trabajo no encontrado o ya terminado'
+                }), 404
+            
+            logger.info(f"Trabajo {job_id} cancelado")
+            
+            return jsonify({
+                'success': True,
+                'message': 'Descarga cancelada'
+            })
         
-        if app_state['current_download']:
-            app_state['current_download']['status'] = 'cancelled'
+        app_state['scheduler'].cancel_all()
         
         logger.info("Cola de descargas cancelada")
         
@@ -323,71 +640,255 @@ def cancel_download():
         }), 500
 
 
-def _process_next_download():
-    """Procesar siguiente descarga en la cola"""
-    if not app_state['download_queue']:
-        app_state['current_download'] = None
+def _status_payload():
+    """Estado de descargas en curso, cola e historial (para /api/status y SSE)"""
+    state = app_state['scheduler'].snapshot(history_limit=10)  # Últimas 10
+    
+    return {
+        'success': True,
+        'current_download': state['active'][0] if state['active'] else None,
+        'active': state['active'],
+        'queue': state['queue'],
+        'queue_size': len(state['queue']),
+        'history': state['history'],
+        'workers': state['workers'],
+        'scheduling': state['scheduling'],
+        'vcenters': app_state['vcenters'].hosts(),
+        'compression_codecs': available_codecs()
+    }
+
+
+def _on_scheduler_event(event_type, data):
+    """Publicar un cambio de la cola en el bus de eventos y registrar sus métricas"""
+    if event_type == 'job_started':
+        job = data['job']
+        started = datetime.fromisoformat(job['started_at'])
+        observe_phase('queue_wait', (started - datetime.fromisoformat(job['submitted_at'])).total_seconds())
+    elif event_type == 'job_finished':
+        EXPORTS_TOTAL.inc(status=data['status'])
+        # El archivo de la traza lo escribe un hilo aparte (aquí el lock del planificador está tomado)
+        if app_state['trace_writer']:
+            app_state['trace_writer'].submit(data)
+    
+    app_state['event_bus'].publish(event_type, data)
+
+
+def _collect_metrics():
+    """Métricas de cola, workers y throughput calculadas en cada petición a /metrics"""
+    state = app_state['scheduler'].snapshot(history_limit=0)
+    bandwidth = app_state['bandwidth'].get_stats()
+    active = state['active']
+    
+    def mbytes(stats):
+        return round(stats['throughput_mbps'] / 8, 3)
+    
+    job_throughput = [
+        ({'job_id': job['id'], 'vm_name': job['vm_name']}, mbytes(bandwidth['jobs'][job['id']]))
+        for job in active if job['id'] in bandwidth['jobs']
+    ]
+    
+    return [
+        ('ova_queue_depth', 'gauge', 'Trabajos en cola (incluidos los retenidos)',
+         [({}, len(state['queue']))]),
+        ('ova_active_exports', 'gauge', 'Exportaciones en curso', [({}, len(active))]),
+        ('ova_workers', 'gauge', 'Workers de exportación', [({}, state['workers'])]),
+        ('ova_worker_utilization', 'gauge', 'Fracción de workers ocupados',
+         [({}, round(len(active) / state['workers'], 3))]),
+        ('ova_throughput_mbytes_per_second', 'gauge', 'Throughput agregado de todas las descargas (MB/s)',
+         [({}, mbytes(bandwidth['global']))]),
+        ('ova_job_throughput_mbytes_per_second', 'gauge', 'Throughput de cada exportación en curso (MB/s)',
+         job_throughput)
+    ]
+
+
+REGISTRY.add_collector(_collect_metrics)
+
+
+def _resume_recovered(vcenter):
+    """
+    Reanudar los trabajos de un vCenter interrumpidos por un reinicio
+    
+    Args:
+        vcenter: Host del vCenter recién conectado
+    """
+    jobs = app_state['scheduler'].resume_recovered(vcenter)
+    if not jobs:
         return
     
-    # Obtener siguiente descarga
-    download_item = app_state['download_queue'].pop(0)
-    app_state['current_download'] = download_item
-    download_item['status'] = 'processing'
+    logger.info(f"Reanudando {len(jobs)} trabajos interrumpidos de {vcenter}")
     
-    try:
-        vm_name = download_item['vm_name']
-        download_dir = download_item['download_dir']
-        poweroff_before = download_item['poweroff_before']
-        
-        logger.info(f"Iniciando descarga de: {vm_name}")
-        
-        # Apagar VM si es necesario
-        if poweroff_before:
-            download_item['status'] = 'powering_off'
-            poweroff_result = app_state['vmware_service'].poweroff_vm(vm_name)
-            
-            if not poweroff_result['success']:
-                raise Exception(f"Error apagando VM: {poweroff_result.get('error')}")
-        
-        # Exportar VM
-        download_item['status'] = 'downloading'
-        
-        def progress_callback(progress, message):
-            """Callback para actualizar progreso"""
-            download_item['progress'] = progress
-            download_item['message'] = message
+    jobs_by_vm = {job['vm_name']: job['id'] for job in jobs if job.get('poweroff_before')}
+    if jobs_by_vm:
+        threading.Thread(
+            target=_batch_poweroff,
+            args=(vcenter, jobs_by_vm),
+            name=f'batch-poweroff-{vcenter}',
+            daemon=True
+        ).start()
+
+
+def _batch_poweroff(vcenter, jobs_by_vm):
+    """
+    Apagar a la vez las VMs de un lote y liberar cada trabajo en cuanto su VM
+    esté apagada (se ejecuta en un hilo de fondo)
+    
+    Args:
+        vcenter: Host del vCenter de las VMs
+        jobs_by_vm: Dict nombre de VM -> ID del trabajo retenido
+    """
+    scheduler = app_state['scheduler']
+    vmware_service = app_state['vcenters'].get(vcenter)
+    
+    if not vmware_service:
+        for job_id in jobs_by_vm.values():
+            scheduler.fail(job_id, 'No conectado a vCenter')
+        return
+    
+    # Traza del lote: cada trabajo se lleva los spans de su VM
+    trace = tracing.Trace()
+    
+    def on_powered_off(vm_name):
+        """La exportación de la VM arranca sin esperar al resto del lote"""
+        scheduler.release(jobs_by_vm[vm_name], spans=trace.spans(vm_name=vm_name))
+    
+    with tracing.activate(trace, 'poweroff_batch', vcenter=vcenter, vms=len(jobs_by_vm)):
+        results = vmware_service.poweroff_vms(
+            list(jobs_by_vm),
+            timeout=config.get('poweroff_timeout', 120),
+            on_powered_off=on_powered_off
+        )
+    
+    for vm_name, job_id in jobs_by_vm.items():
+        result = results.get(vm_name, {'success': False, 'error': 'Sin resultado'})
+        if not result['success']:
+            logger.error(f"Error apagando {vm_name}: {result.get('error')}")
+            scheduler.fail(
+                job_id, f"Error apagando VM: {result.get('error')}",
+                spans=trace.spans(vm_name=vm_name)
+            )
+
+
+def _run_export(download_item, update, cancel_token):
+    """
+    Procesar una descarga (se ejecuta en un worker del planificador)
+    
+    Args:
+        download_item: Copia del trabajo (vm_name, download_dir, poweroff_before...)
+        update: Callable(**campos) para actualizar el estado del trabajo
+        cancel_token: CancelToken que se activa al cancelar el trabajo
+    """
+    vm_name = download_item['vm_name']
+    download_dir = download_item['download_dir']
+    vmware_service = app_state['vcenters'].get(download_item.get('vcenter'))
+    
+    if not vmware_service:
+        update(status='failed', error='No conectado a vCenter')
+        return
+    
+    # Con poweroff_before la VM ya está apagada: el trabajo se liberó al apagarse
+    logger.info(f"Iniciando descarga de: {vm_name}")
+    
+    # Exportar VM
+    update(status='downloading')
+    
+    last_logged = {'progress': None}
+    
+    def progress_callback(progress, message):
+        """Callback para actualizar progreso (solo se registra al cambiar el porcentaje)"""
+        update(progress=progress, message=message)
+        if progress != last_logged['progress']:
+            last_logged['progress'] = progress
             logger.info(f"{vm_name}: {progress}% - {message}")
-        
-        result = app_state['vmware_service'].export_vm_as_ova(
-            vm_name=vm_name,
-            download_dir=download_dir,
-            progress_callback=progress_callback
+    
+    # Traza del trabajo: sigue a los spans del apagado y se publica al cerrar cada span
+    trace = tracing.Trace(
+        trace_id=download_item.get('trace_id'),
+        spans=download_item.get('spans'),
+        on_change=lambda spans: update(spans=spans)
+    )
+    update(trace_id=trace.trace_id)
+    trace.add_span(
+        'queued',
+        int(datetime.fromisoformat(download_item['submitted_at']).timestamp() * 1e9),
+        int(datetime.fromisoformat(download_item['started_at']).timestamp() * 1e9)
+    )
+    
+    root_attributes = {
+        'vm_name': vm_name,
+        'vcenter': download_item.get('vcenter'),
+        'compression': download_item.get('compression') or 'none'
+    }
+    
+    with tracing.activate(trace, 'export', **root_attributes) as root:
+        # Los streams del trabajo comparten los límites global, por host y por trabajo
+        with app_state['bandwidth'].job(download_item['id'], cancel_token) as bandwidth:
+            result = vmware_service.export_vm_as_ova(
+                vm_name=vm_name,
+                download_dir=download_dir,
+                progress_callback=progress_callback,
+                compression=download_item.get('compression'),
+                cancel_token=cancel_token,
+                bandwidth=bandwidth,
+                # Los trabajos anteriores al MoRef (recuperados) se buscan por nombre
+                moref=download_item.get('moref')
+            )
+        
+        if result.get('cancelled'):
+            root.set_attribute('cancelled', True)
+        elif not result['success']:
+            root.record_error(result.get('error'))
+    
+    if result['success']:
+        update(
+            status='completed',
+            progress=100,
+            file_path=result.get('file_path'),
+            checksums=result.get('checksums', {}),
+            compression=result.get('compression'),
+            timings=result.get('timings'),
+            message='Descarga completada'
         )
-        
-        if result['success']:
-            download_item['status'] = 'completed'
-            download_item['progress'] = 100
-            download_item['file_path'] = result.get('file_path')
-            download_item['message'] = 'Descarga completada'
-            logger.info(f"Descarga completada: {vm_name}")
-        else:
-            download_item['status'] = 'failed'
-            download_item['error'] = result.get('error')
-            logger.error(f"Error descargando {vm_name}: {result.get('error')}")
-        
-    except Exception as e:
-        download_item['status'] = 'failed'
-        download_item['error'] = str(e)
-        logger.error(f"Error procesando descarga de {download_item['vm_name']}: {str(e)}")
+        logger.info(f"Descarga completada: {vm_name}")
+    elif result.get('cancelled'):
+        logger.info(f"Descarga cancelada: {vm_name}")
+    else:
+        update(status='failed', error=result.get('error'))
+        logger.error(f"Error descargando {vm_name}: {result.get('error')}")
+
+
+def init_scheduler():
+    """
+    Abrir el JobStore, crear el planificador y recuperar los trabajos interrumpidos
     
-    finally:
-        # Mover a historial
-        app_state['download_history'].append(download_item)
-        
-        # Procesar siguiente
-        app_state['current_download'] = None
-        if app_state['download_queue']:
-            _process_next_download()
+    Se llama una sola vez al arrancar el servidor (no al importar el módulo):
+    recover() marca como interrumpidos los trabajos que estaban en curso, y
+    un segundo proceso sobre la misma base de datos los daría por perdidos.
+    """
+    # Trazas OTLP de los trabajos terminados (trace_export_dir vacío = no se guardan)
+    if config.get('trace_export_dir'):
+        app_state['trace_writer'] = tracing.OtlpFileWriter(config['trace_export_dir'])
+    
+    # Cola e historial persistentes (job_store vacío = solo en memoria)
+    job_store = None
+    if config.get('job_store', 'jobs.db'):
+        job_store = JobStore(config.get('job_store', 'jobs.db'))
+        job_store.prune(config.get('job_history_days', DEFAULT_HISTORY_DAYS))
+    
+    # Planificador de exportaciones con workers de fondo
+    app_state['scheduler'] = ExportScheduler(
+        run_job=_run_export,
+        max_workers=config.get('max_concurrent_downloads', 1),
+        max_per_host=config.get('max_exports_per_host', 2),
+        max_per_datastore=config.get('max_exports_per_datastore', 2),
+        max_per_vcenter=config.get('max_exports_per_vcenter', 0),
+        on_event=_on_scheduler_event,
+        store=job_store
+    )
+    # Al desconectar un vCenter se cancelan sus trabajos antes de cerrar la conexión
+    app_state['vcenters'].drain = app_state['scheduler'].cancel_vcenter
+    app_state['scheduler'].recover()
+    # Las escrituras del JobStore van por un hilo de fondo: vaciarlas al salir
+    atexit.register(app_state['scheduler'].flush, 5)
 
 
 if __name__ == '__main__':
@@ -398,4 +899,8 @@ if __name__ == '__main__':
     print(f"Accede a la aplicación en: http://localhost:5000")
     print("=" * 60)
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    init_scheduler()
+    
+    # Sin debug: el reloader de Werkzeug importaría el módulo en un segundo
+    # proceso con sus propios workers sobre el mismo JobStore
+    app.run(debug=False, host='0.0.0.0', port=5000)
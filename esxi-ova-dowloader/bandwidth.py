@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bandwidth - Limitación de ancho de banda de las exportaciones
+Token buckets compartidos por todos los streams de descarga: un límite
+global (con franjas horarias, ej: sin límite por la noche) y límites
+opcionales por host ESXi y por trabajo, modificables en caliente
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Segundos de tráfico que un bucket acumula como ráfaga
+BURST_SECONDS = 1.0
+
+# Deuda máxima de un bucket en segundos de tráfico al límite vigente: un chunk
+# grande con un límite muy bajo no deja al stream dormido durante segundos y
+# un límite bajado en caliente no se aplica sobre la deuda del límite anterior
+MAX_DEBT_SECONDS = 1.0
+
+# Espera máxima de cada iteración: los cambios de límite y las cancelaciones
+# se notan en como mucho este tiempo
+MAX_SLEEP_SLICE = 0.25
+
+# Segundos entre comprobaciones de la franja horaria vigente
+SCHEDULE_CHECK_INTERVAL = 1.0
+
+# Segundos de la ventana de medida del throughput
+METER_WINDOW = 2.0
+
+
+def mbps_to_bytes(mbps):
+    """Convertir megabits por segundo en bytes por segundo (0/None = sin límite)"""
+    return int(float(mbps or 0) * 1000 * 1000 / 8)
+
+
+def bytes_to_mbps(rate):
+    """Convertir bytes por segundo en megabits por segundo"""
+    return round(rate * 8 / (1000 * 1000), 2)
+
+
+def _parse_time(value):
+    """Convertir 'HH:MM' en minutos desde medianoche"""
+    hours, minutes = str(value).split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Hora fuera de rango: {value}")
+    return hours * 60 + minutes
+
+
+def parse_schedule(schedule):
+    """
+    Validar franjas horarias del límite global
+    
+    Args:
+        schedule: Lista de dicts {start: 'HH:MM', end: 'HH:MM', limit_mbps}; una
+                  franja con end anterior a start cruza la medianoche y
+                  limit_mbps 0 es sin límite
+    
+    Returns:
+        Lista de tuplas (inicio, fin, bytes/s, entrada original)
+    
+    Raises:
+        ValueError: Si alguna franja no es válida
+    """
+    parsed = []
+    for entry in schedule or []:
+        try:
+            start = _parse_time(entry['start'])
+            end = _parse_time(entry['end'])
+            rate = mbps_to_bytes(entry.get('limit_mbps', 0))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Franja horaria no válida {entry}: {str(e)}")
+        
+        if rate < 0:
+            raise ValueError(f"Límite negativo en la franja {entry}")
+        
+        parsed.append((start, end, rate, dict(entry)))
+    
+    return parsed
+
+
+def schedule_rate(schedule, default_rate, now=None):
+    """
+    Límite global vigente según las franjas horarias
+    
+    Args:
+        schedule: Franjas ya validadas (parse_schedule)
+        default_rate: Límite fuera de las franjas (bytes/s)
+        now: datetime a evaluar (por defecto la hora local actual)
+    
+    Returns:
+        Tupla (bytes/s, franja aplicada o None); gana la primera franja que coincide
+    """
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    
+    for start, end, rate, entry in schedule:
+        if start <= end:
+            active = start <= minute < end
+        else:
+            active = minute >= start or minute < end
+        
+        if active:
+            return rate, entry
+    
+    return default_rate, None
+
+
+class TokenBucket:
+    """
+    Token bucket en bytes (thread-safe)
+    
+    consume() descuenta los bytes aunque el saldo quede negativo (deuda) y
+    deficit() indica cuánto falta para saldarla: cada stream espera lo justo
+    y el reparto entre streams concurrentes es proporcional a su tráfico.
+    La deuda se limita a MAX_DEBT_SECONDS de tráfico al límite vigente.
+    """
+    
+    def __init__(self, rate=0):
+        """
+        Args:
+            rate: Bytes por segundo (0 = sin límite)
+        """
+        self._lock = threading.Lock()
+        self.rate = 0
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.bytes_total = 0
+        self._meter_start = self._last
+        self._meter_bytes = 0
+        self.throughput = 0.0
+        self.set_rate(rate)
+    
+    def set_rate(self, rate):
+        """Cambiar el límite (bytes/s, 0 = sin límite) conservando la deuda pendiente"""
+        with self._lock:
+            self._refill()
+            self.rate = max(0, int(rate or 0))
+            if not self.rate:
+                self._tokens = 0.0
+            else:
+                self._tokens = min(
+                    max(self._tokens, -self.rate * MAX_DEBT_SECONDS),
+                    self.rate * BURST_SECONDS
+                )
+    
+    def _refill(self):
+        """Sumar los tokens generados desde la última vez (con el lock tomado)"""
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(
+                self._tokens + (now - self._last) * self.rate,
+                self.rate * BURST_SECONDS
+            )
+        self._last = now
+    
+    def consume(self, nbytes):
+        """Descontar bytes transferidos (y contabilizarlos para el throughput)"""
+        with self._lock:
+            self._refill()
+            if self.rate:
+                self._tokens = max(self._tokens - nbytes, -self.rate * MAX_DEBT_SECONDS)
+            
+            self.bytes_total += nbytes
+            self._meter_bytes += nbytes
+            elapsed = self._last - self._meter_start
+            if elapsed >= METER_WINDOW:
+                self.throughput = self._meter_bytes / elapsed
+                self._meter_start = self._last
+                self._meter_bytes = 0
+    
+    def deficit(self):
+        """Segundos de espera hasta saldar la deuda (0 si no hay)"""
+        with self._lock:
+            self._refill()
+            if not self.rate or self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+    
+    def stats(self):
+        """Límite, bytes y throughput medido"""
+        with self._lock:
+            # Sin tráfico reciente la última medida ya no es válida
+            idle = time.monotonic() - self._meter_start >= 2 * METER_WINDOW
+            return {
+                'limit_mbps': bytes_to_mbps(self.rate),
+                'throughput_mbps': 0.0 if idle else bytes_to_mbps(self.throughput),
+                'bytes': self.bytes_total
+            }
+
+
+class JobBandwidth:
+    """Límite de ancho de banda visto desde las descargas de un trabajo"""
+    
+    def __init__(self, limiter, job_id, cancel_token=None):
+        self.limiter = limiter
+        self.job_id = job_id
+        self.cancel_token = cancel_token
+        # Las esperas del límite duermen sobre este evento para poder despertarlas
+        self.wakeup = threading.Event()
+    
+    def throttle(self, nbytes, host=None):
+        """
+        Contabilizar bytes descargados y esperar si algún límite se ha superado
+        
+        Args:
+            nbytes: Bytes recién leídos de la red
+            host: Host ESXi del que vienen (para su límite propio)
+        
+        Raises:
+            ExportCancelled: Si el trabajo se cancela durante la espera
+        """
+        self.limiter.throttle(nbytes, self.job_id, host, self.cancel_token, self.wakeup)
+
+
+class BandwidthLimiter:
+    """
+    Límites de ancho de banda compartidos por todas las exportaciones (thread-safe)
+    
+    Cada chunk descargado pasa por el bucket global, el de su host ESXi y el
+    de su trabajo; el stream espera hasta que los tres tienen saldo. Los
+    buckets por host y por trabajo se crean al primer uso.
+    """
+    
+    def __init__(self, limit_mbps=0, per_host_mbps=0, per_job_mbps=0, schedule=None):
+        """
+        Args:
+            limit_mbps: Límite global en megabits/s (0 = sin límite)
+            per_host_mbps: Límite por host ESXi en megabits/s (0 = sin límite)
+            per_job_mbps: Límite por trabajo en megabits/s (0 = sin límite)
+            schedule: Franjas horarias del límite global (ver parse_schedule)
+        """
+        self._lock = threading.Lock()
+        self.limit = mbps_to_bytes(limit_mbps)
+        self.per_host = mbps_to_bytes(per_host_mbps)
+        self.per_job = mbps_to_bytes(per_job_mbps)
+        self._schedule = parse_schedule(schedule)
+        self._active_entry = None
+        self._global = TokenBucket()
+        self._hosts = {}
+        self._jobs = {}
+        self._job_overrides = {}
+        self._schedule_checked = 0.0
+        self._apply_schedule(force=True)
+    
+    def _apply_schedule(self, force=False):
+        """Ajustar el bucket global a la franja horaria vigente"""
+        now = time.monotonic()
+        if not force and now - self._schedule_checked < SCHEDULE_CHECK_INTERVAL:
+            return
+        self._schedule_checked = now
+        
+        rate, entry = schedule_rate(self._schedule, self.limit)
+        if entry != self._active_entry:
+            if entry:
+                logger.info(f"Franja de ancho de banda {entry['start']}-{entry['end']}: {bytes_to_mbps(rate)} Mbps")
+            elif self._active_entry:
+                logger.info(f"Fin de la franja de ancho de banda: {bytes_to_mbps(rate)} Mbps")
+            self._active_entry = entry
+        
+        if rate != self._global.rate:
+            self._global.set_rate(rate)
+    
+    def _bucket(self, buckets, key, rate):
+        """Obtener (o crear) el bucket de un host o trabajo (con el lock tomado)"""
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate)
+        return bucket
+    
+    def throttle(self, nbytes, job_id=None, host=None, cancel_token=None, wakeup=None):
+        """
+        Contabilizar bytes y esperar hasta que los límites aplicables tengan saldo
+        
+        Args:
+            nbytes: Bytes transferidos
+            job_id: Trabajo al que pertenecen (opcional)
+            host: Host ESXi del que vienen (opcional)
+            cancel_token: CancelToken del trabajo, comprobado en cada tramo de espera (opcional)
+            wakeup: threading.Event que interrumpe la espera en curso (opcional)
+        
+        Raises:
+            ExportCancelled: Si el trabajo se cancela durante la espera
+        """
+        with self._lock:
+            self._apply_schedule()
+            buckets = [self._global]
+            if host:
+                buckets.append(self._bucket(self._hosts, host, self.per_host))
+            if job_id:
+                rate = self._job_overrides.get(job_id, self.per_job)
+                buckets.append(self._bucket(self._jobs, job_id, rate))
+        
+        for bucket in buckets:
+            bucket.consume(nbytes)
+        
+        if wakeup is None:
+            wakeup = threading.Event()
+        
+        # Esperar por tramos: un límite subido en caliente o una cancelación se
+        # notan enseguida
+        while True:
+            if cancel_token:
+                cancel_token.check()
+            
+            wait = max(bucket.deficit() for bucket in buckets)
+            if wait <= 0:
+                return
+            wakeup.wait(min(wait, MAX_SLEEP_SLICE))
+    
+    @contextmanager
+    def job(self, job_id, cancel_token=None):
+        """
+        Límite de un trabajo durante su exportación
+        
+        Args:
+            job_id: ID del trabajo
+            cancel_token: CancelToken del trabajo (las esperas lo comprueban)
+        
+        Yields:
+            JobBandwidth para pasar a la exportación
+        """
+        bandwidth = JobBandwidth(self, job_id, cancel_token)
+        
+        # Cancelar el trabajo despierta en el acto a los streams que esperan saldo
+        handle = cancel_token.on_cancel(bandwidth.wakeup.set) if cancel_token else None
+        try:
+            yield bandwidth
+        finally:
+            if handle:
+                cancel_token.remove(handle)
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                self._job_overrides.pop(job_id, None)
+    
+    def configure(self, limit_mbps=None, per_host_mbps=None, per_job_mbps=None, schedule=None,
+                  job_limits=None):
+        """
+        Cambiar límites en caliente (los argumentos None no se tocan)
+        
+        Args:
+            limit_mbps: Límite global fuera de franjas
+            per_host_mbps: Límite por host ESXi
+            per_job_mbps: Límite por defecto de cada trabajo
+            schedule: Nuevas franjas horarias (lista vacía = ninguna)
+            job_limits: Dict ID de trabajo -> megabits/s (None = volver al límite por defecto)
+        
+        Raises:
+            ValueError: Si algún valor no es válido
+        """
+        values = {
+            'limit_mbps': limit_mbps,
+            'per_host_mbps': per_host_mbps,
+            'per_job_mbps': per_job_mbps
+        }
+        values.update({f'job {job_id}': mbps for job_id, mbps in (job_limits or {}).items()})
+        for name, value in values.items():
+            if value is not None and mbps_to_bytes(value) < 0:
+                raise ValueError(f"Límite negativo: {name}")
+        
+        parsed_schedule = parse_schedule(schedule) if schedule is not None else None
+        
+        with self._lock:
+            if limit_mbps is not None:
+                self.limit = mbps_to_bytes(limit_mbps)
+            if parsed_schedule is not None:
+                self._schedule = parsed_schedule
+            self._apply_schedule(force=True)
+            
+            if per_host_mbps is not None:
+                self.per_host = mbps_to_bytes(per_host_mbps)
+                for bucket in self._hosts.values():
+                    bucket.set_rate(self.per_host)
+            
+            if per_job_mbps is not None:
+                self.per_job = mbps_to_bytes(per_job_mbps)
+            
+            for job_id, mbps in (job_limits or {}).items():
+                if mbps is None:
+                    self._job_overrides.pop(job_id, None)
+                else:
+                    self._job_overrides[job_id] = mbps_to_bytes(mbps)
+            
+            for job_id, bucket in self._jobs.items():
+                bucket.set_rate(self._job_overrides.get(job_id, self.per_job))
+    
+    def get_stats(self):
+        """
+        Límites configurados, límite vigente y throughput medido
+        
+        Returns:
+            Dict con limits, schedule, active_schedule, global, hosts y jobs
+        """
+        with self._lock:
+            self._apply_schedule()
+            return {
+                'limits': {
+                    'limit_mbps': bytes_to_mbps(self.limit),
+                    'per_host_mbps': bytes_to_mbps(self.per_host),
+                    'per_job_mbps': bytes_to_mbps(self.per_job)
+                },
+                'schedule': [entry for _, _, _, entry in self._schedule],
+                'active_schedule': self._active_entry,
+                'global': self._global.stats(),
+                'hosts': {host: bucket.stats() for host, bucket in self._hosts.items()},
+                'jobs': {job_id: bucket.stats() for job_id, bucket in self._jobs.items()}
+            }
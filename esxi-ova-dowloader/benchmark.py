@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark - Rendimiento de la ruta de descarga
+Descarga un archivo servido en local con la misma ruta que una exportación
+(VMwareService._download_file) y compara el throughput y el tiempo de CPU:
+- Reportes de progreso: sin reportes, limitados y uno por chunk
+- Ruta de escritura: readinto sobre buffer reutilizado, iter_content y
+  readinto con liberación de la caché de páginas
+
+Uso:
+    python benchmark.py --size-mb 512 --repeat 3 --lease-rtt-ms 20
+"""
+
+import argparse
+import logging
+import math
+import os
+import statistics
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from vmware_service import VMwareService, ExportProgress
+
+BLOCK = os.urandom(1024 * 1024)
+
+
+class _PayloadHandler(BaseHTTPRequestHandler):
+    """Sirve size_mb MB generados en memoria"""
+    
+    size_mb = 0
+    
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(self.size_mb * len(BLOCK)))
+        self.end_headers()
+        for _ in range(self.size_mb):
+            self.wfile.write(BLOCK)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeLease:
+    """Lease simulado: cada HttpNfcLeaseProgress cuesta un round-trip SOAP"""
+    
+    def __init__(self, rtt):
+        self.rtt = rtt
+    
+    def HttpNfcLeaseProgress(self, percent):
+        time.sleep(self.rtt)
+
+
+def run_case(service, url, size, progress_factory, target_dir):
+    """
+    Descargar el archivo una vez
+    
+    Returns:
+        Tupla (MB/s, segundos de CPU, keep-alives del lease, callbacks)
+    """
+    local_path = os.path.join(target_dir, 'payload.bin')
+    progress = progress_factory(size)
+    
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    service._download_file(url, local_path, size, progress)
+    progress.flush()
+    cpu = time.process_time() - cpu_start
+    elapsed = time.perf_counter() - start
+    
+    os.remove(local_path)
+    return size / (1024 * 1024) / elapsed, cpu, progress.lease_updates, progress.callbacks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la ruta de descarga')
+    parser.add_argument('--size-mb', type=int, default=512, help='Tamaño del archivo en MB')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeticiones por caso')
+    parser.add_argument('--lease-rtt-ms', type=float, default=20,
+                        help='Latencia simulada de HttpNfcLeaseProgress en ms')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING)
+    
+    _PayloadHandler.size_mb = args.size_mb
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _PayloadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/payload'
+    
+    lease = FakeLease(args.lease_rtt_ms / 1000)
+    readinto = VMwareService('127.0.0.1', 'benchmark', 'benchmark')
+    iter_content = VMwareService('127.0.0.1', 'benchmark', 'benchmark', zero_copy=False)
+    fadvise = VMwareService('127.0.0.1', 'benchmark', 'benchmark', drop_page_cache=True)
+    
+    def callback(progress, message):
+        pass
+    
+    def throttled(size):
+        return ExportProgress(lease, size, callback)
+    
+    cases = [
+        ('sin reportes', readinto, lambda size: ExportProgress(
+            lease, size, None, lease_interval=math.inf)),
+        ('limitado', readinto, throttled),
+        ('por chunk', readinto, lambda size: ExportProgress(
+            lease, size, callback, lease_interval=0, callback_interval=0)),
+        ('iter_content', iter_content, throttled),
+        ('fadvise', fadvise, throttled),
+    ]
+    
+    print(f"Archivo: {args.size_mb} MB, RTT del lease: {args.lease_rtt_ms} ms, "
+          f"{args.repeat} repeticiones")
+    print(f"{'caso':<14}{'MB/s (mediana)':>16}{'min':>10}{'max':>10}"
+          f"{'CPU s':>8}{'lease':>8}{'callbacks':>11}")
+    
+    with tempfile.TemporaryDirectory() as target_dir:
+        for name, service, factory in cases:
+            results = [
+                run_case(service, url, args.size_mb * len(BLOCK), factory, target_dir)
+                for _ in range(args.repeat)
+            ]
+            rates = [rate for rate, _, _, _ in results]
+            cpu = statistics.median(cpu for _, cpu, _, _ in results)
+            _, _, lease_updates, callbacks = results[-1]
+            
+            print(f"{name:<14}{statistics.median(rates):>16.1f}{min(rates):>10.1f}"
+                  f"{max(rates):>10.1f}{cpu:>8.2f}{lease_updates:>8}{callbacks:>11}")
+    
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
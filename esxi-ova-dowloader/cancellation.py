@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cancellation - Cancelación cooperativa de exportaciones
+Un CancelToken por trabajo: las descargas lo comprueban entre chunks y,
+al cancelarlo, sus callbacks cierran los sockets abiertos y abortan el
+lease NFC para que la exportación se detenga aunque esté bloqueada en red
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Motivo por defecto de una cancelación
+DEFAULT_CANCEL_REASON = 'Exportación cancelada por el usuario'
+
+
+class ExportCancelled(Exception):
+    """La exportación se canceló mediante su CancelToken"""
+    pass
+
+
+class CancelToken:
+    """
+    Señal de cancelación de un trabajo (thread-safe)
+    
+    Los callbacks registrados con on_cancel() se ejecutan una sola vez, en
+    el hilo que cancela; sirven para desbloquear lecturas de red o esperas
+    de vCenter que no volverían a comprobar el token.
+    """
+    
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._next_handle = 0
+        self.reason = None
+    
+    @property
+    def cancelled(self):
+        """True si se ha pedido la cancelación"""
+        return self._event.is_set()
+    
+    def cancel(self, reason=DEFAULT_CANCEL_REASON):
+        """
+        Pedir la cancelación y ejecutar los callbacks registrados
+        
+        Args:
+            reason: Motivo (mensaje de ExportCancelled)
+        
+        Returns:
+            bool: False si ya estaba cancelado
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        
+        for callback in callbacks:
+            self._run(callback)
+        
+        return True
+    
+    def _run(self, callback):
+        """Ejecutar un callback sin propagar sus errores"""
+        try:
+            callback()
+        except Exception as e:
+            logger.debug(f"Error en callback de cancelación: {str(e)}")
+    
+    def on_cancel(self, callback):
+        """
+        Registrar un callback de cancelación
+        
+        Si el token ya está cancelado el callback se ejecuta en el acto.
+        
+        Args:
+            callback: Callable sin argumentos
+        
+        Returns:
+            Identificador para remove()
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._next_handle += 1
+                self._callbacks[self._next_handle] = callback
+                return self._next_handle
+        
+        self._run(callback)
+        return None
+    
+    def remove(self, handle):
+        """Quitar un callback que ya no hace falta (ej: respuesta cerrada)"""
+        with self._lock:
+            self._callbacks.pop(handle, None)
+    
+    def check(self):
+        """
+        Comprobar el token entre chunks u operaciones
+        
+        Raises:
+            ExportCancelled: Si se ha pedido la cancelación
+        """
+        if self._event.is_set():
+            raise ExportCancelled(self.reason)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checksums - Digests incrementales y manifiesto OVF (.mf)
+Calcula los hashes de cada archivo mientras se descarga, de modo que el
+manifiesto del OVA no requiere volver a leer los datos
+"""
+
+import hashlib
+import threading
+
+# Algoritmos admitidos en el manifiesto y su etiqueta en el formato OVF
+MANIFEST_LABELS = {
+    'sha256': 'SHA256',
+    'sha1': 'SHA1',
+}
+
+# Algoritmo por defecto del manifiesto (sha1 para herramientas OVF antiguas)
+DEFAULT_MANIFEST_ALGORITHM = 'sha256'
+
+# Tamaño de lectura al recuperar datos ya escritos
+READ_BACK_SIZE = 1024 * 1024  # 1 MB
+
+
+def digest_algorithms(manifest_algorithm):
+    """
+    Algoritmos a calcular para un algoritmo de manifiesto
+    
+    SHA-256 se calcula siempre que haya manifiesto; SHA-1 se añade si el
+    manifiesto lo usa.
+    
+    Args:
+        manifest_algorithm: 'sha256', 'sha1' o None/'none' (sin checksums)
+    
+    Returns:
+        Lista de nombres de algoritmo de hashlib
+    """
+    if not manifest_algorithm or manifest_algorithm == 'none':
+        return []
+    
+    if manifest_algorithm not in MANIFEST_LABELS:
+        raise ValueError(f"Algoritmo de manifiesto no soportado: {manifest_algorithm}")
+    
+    algorithms = ['sha256']
+    if manifest_algorithm != 'sha256':
+        algorithms.append(manifest_algorithm)
+    
+    return algorithms
+
+
+def manifest_line(algorithm, file_name, hexdigest):
+    """Línea del manifiesto OVF para un archivo"""
+    return f"{MANIFEST_LABELS[algorithm]}({file_name})= {hexdigest}\n"
+
+
+def manifest_size(algorithm, file_names):
+    """
+    Tamaño exacto del manifiesto antes de conocer los digests
+    
+    Args:
+        algorithm: Algoritmo del manifiesto
+        file_names: Nombres de los archivos que incluirá
+    
+    Returns:
+        int: Tamaño en bytes
+    """
+    placeholder = '0' * (hashlib.new(algorithm).digest_size * 2)
+    return sum(
+        len(manifest_line(algorithm, name, placeholder).encode('utf-8'))
+        for name in file_names
+    )
+
+
+def build_manifest(algorithm, digests):
+    """
+    Generar el contenido del manifiesto
+    
+    Args:
+        algorithm: Algoritmo del manifiesto
+        digests: Lista de tuplas (nombre, dict algoritmo -> hexdigest) en orden
+    
+    Returns:
+        bytes con el manifiesto
+    """
+    return ''.join(
+        manifest_line(algorithm, name, file_digests[algorithm])
+        for name, file_digests in digests
+    ).encode('utf-8')
+
+
+def digest_bytes(data, algorithms):
+    """Digests de un contenido en memoria (descriptor OVF)"""
+    return {algorithm: hashlib.new(algorithm, data).hexdigest() for algorithm in algorithms}
+
+
+class FileDigest:
+    """
+    Digest incremental de un archivo que se escribe en orden
+    
+    Los datos se incorporan en orden de posición: la descarga que empieza en
+    la posición ya cubierta los aporta en línea con update(); lo que se
+    escribió por otra vía (rangos paralelos, bytes de un intento anterior)
+    se recupera leyéndolo del disco con catch_up().
+    """
+    
+    def __init__(self, algorithms):
+        """
+        Args:
+            algorithms: Nombres de algoritmo de hashlib
+        """
+        self._hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+        self._lock = threading.Lock()
+        self.position = 0  # Bytes ya incorporados al digest
+        self.read_back = 0  # Bytes recuperados leyendo del disco
+    
+    def update(self, data):
+        """
+        Incorporar datos contiguos a los ya procesados
+        
+        Args:
+            data: bytes, bytearray o memoryview
+        """
+        with self._lock:
+            for h in self._hashes:
+                h.update(data)
+            self.position += len(data)
+    
+    def catch_up(self, path, base_offset, upto):
+        """
+        Incorporar los bytes [position, upto) leyéndolos del archivo local
+        
+        Args:
+            path: Archivo donde están los datos
+            base_offset: Posición del archivo dentro de path (miembro del OVA)
+            upto: Posición (relativa al archivo) hasta la que completar
+        """
+        if upto <= self.position:
+            return
+        
+        buffer = bytearray(READ_BACK_SIZE)
+        view = memoryview(buffer)
+        
+        with open(path, 'rb') as f:
+            f.seek(base_offset + self.position)
+            
+            while self.position < upto:
+                wanted = min(len(buffer), upto - self.position)
+                n = f.readinto(view[:wanted])
+                if not n:
+                    raise IOError(
+                        f"Fin de archivo inesperado en {path} al calcular checksum "
+                        f"({self.position}/{upto} bytes)"
+                    )
+                
+                self.update(view[:n])
+                self.read_back += n
+    
+    def hexdigests(self):
+        """
+        Returns:
+            Dict algoritmo -> hexdigest
+        """
+        with self._lock:
+            return {h.name: h.hexdigest() for h in self._hashes}
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compression - Compresión en paralelo del OVA mientras se descarga
+Divide el stream en bloques que se comprimen en varios hilos como frames
+independientes (miembros gzip o frames zstd concatenados, ambos válidos
+para gunzip/zstd -d) y los escribe en orden
+"""
+
+import gzip
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # Dependencia opcional: solo necesaria para zstd
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Codecs disponibles: extensión del archivo y nivel por defecto
+CODECS = {
+    'gzip': {'extension': '.gz', 'level': 6},
+    'zstd': {'extension': '.zst', 'level': 3},
+}
+
+# Tamaño de los bloques comprimidos de forma independiente
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024  # 4 MB
+
+
+def available_codecs():
+    """
+    Codecs utilizables en este entorno
+    
+    Returns:
+        Lista de nombres de codec
+    """
+    return [name for name in CODECS if name != 'zstd' or zstandard is not None]
+
+
+def normalize_codec(codec):
+    """
+    Validar el codec pedido para una exportación
+    
+    Args:
+        codec: 'gzip', 'zstd', 'none' o None
+    
+    Returns:
+        Nombre del codec o None si no se comprime
+    
+    Raises:
+        ValueError: Si el codec no existe o no está instalado
+    """
+    if not codec or codec == 'none':
+        return None
+    
+    if codec not in CODECS:
+        raise ValueError(f"Codec de compresión no soportado: {codec}")
+    
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError("Compresión zstd no disponible: instala el paquete 'zstandard'")
+    
+    return codec
+
+
+class ParallelCompressedWriter:
+    """
+    Archivo comprimido escrito a partir de un stream secuencial
+    
+    write() acumula datos en un bloque; cada bloque lleno se comprime en el
+    pool (zlib y zstandard liberan el GIL) y los resultados se escriben en
+    el orden original. El número de bloques en vuelo está acotado para no
+    acumular memoria si el disco es más lento que la red.
+    """
+    
+    def __init__(self, path, codec, level=None, threads=None, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Args:
+            path: Ruta del archivo comprimido
+            codec: 'gzip' o 'zstd'
+            level: Nivel de compresión (por defecto el del codec)
+            threads: Hilos de compresión (por defecto el número de CPUs)
+            block_size: Tamaño de bloque en bytes
+        """
+        self.path = path
+        self.codec = codec
+        self.level = level if level is not None else CODECS[codec]['level']
+        self.threads = max(1, threads or os.cpu_count() or 1)
+        self.block_size = block_size
+        self.input_bytes = 0
+        self.output_bytes = 0
+        
+        self._file = open(path, 'wb')
+        self._block = bytearray()
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.threads, thread_name_prefix='compress'
+        )
+        self._started = time.monotonic()
+        self._finished = None
+        
+        # ZstdCompressor no es thread-safe: uno por hilo del pool
+        self._local = threading.local()
+    
+    def _compress_block(self, block):
+        """Comprimir un bloque como frame independiente (en un hilo del pool)"""
+        if self.codec == 'gzip':
+            return gzip.compress(block, compresslevel=self.level, mtime=0)
+        
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(level=self.level)
+            self._local.compressor = compressor
+        return compressor.compress(block)
+    
+    def _submit(self, block):
+        """Encolar un bloque y escribir los ya comprimidos si hay demasiados en vuelo"""
+        self._pending.append(self._executor.submit(self._compress_block, block))
+        
+        while len(self._pending) > self.threads * 2:
+            self._write_result(self._pending.popleft())
+    
+    def _write_result(self, future):
+        data = future.result()
+        self._file.write(data)
+        self.output_bytes += len(data)
+    
+    def write(self, data):
+        """
+        Añadir datos al stream
+        
+        Args:
+            data: bytes, bytearray o memoryview (se copian)
+        """
+        view = memoryview(data)
+        self.input_bytes += len(view)
+        
+        while view:
+            room = self.block_size - len(self._block)
+            self._block += view[:room]
+            view = view[room:]
+            
+            if len(self._block) >= self.block_size:
+                # El bloque pasa al pool tal cual; se empieza uno nuevo
+                self._submit(self._block)
+                self._block = bytearray()
+    
+    def close(self):
+        """Comprimir el último bloque, escribir lo pendiente y cerrar el archivo"""
+        if self._file is None:
+            return
+        
+        try:
+            if self._block:
+                self._submit(self._block)
+                self._block = bytearray()
+            
+            while self._pending:
+                self._write_result(self._pending.popleft())
+            
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._finished = time.monotonic()
+        finally:
+            self._executor.shutdown(wait=True)
+            self._file.close()
+            self._file = None
+    
+    def abort(self):
+        """Descartar el trabajo pendiente y cerrar el archivo sin terminarlo"""
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+        
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def stats(self):
+        """
+        Métricas de la compresión
+        
+        Returns:
+            Dict con codec, bytes de entrada/salida, ratio y throughput (MB/s de entrada)
+        """
+        elapsed = max((self._finished or time.monotonic()) - self._started, 1e-6)
+        return {
+            'codec': self.codec,
+            'level': self.level,
+            'threads': self.threads,
+            'input_bytes': self.input_bytes,
+            'output_bytes': self.output_bytes,
+            'ratio': round(self.input_bytes / self.output_bytes, 2) if self.output_bytes else None,
+            'throughput_mb_s': round(self.input_bytes / (1024 * 1024) / elapsed, 1)
+        }
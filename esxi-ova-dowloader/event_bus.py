@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Event Bus - Difusión de eventos de exportación a suscriptores SSE
+Cada suscriptor tiene su propia cola acotada; publicar nunca bloquea, de
+modo que un navegador lento no frena a los workers de exportación
+"""
+
+import itertools
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Eventos pendientes como máximo por suscriptor antes de marcarlo desbordado
+DEFAULT_SUBSCRIBER_QUEUE_SIZE = 256
+
+# Segundos entre comentarios keep-alive en el stream SSE
+DEFAULT_KEEPALIVE_INTERVAL = 15
+
+
+class Subscription:
+    """
+    Suscripción a un EventBus
+    
+    Si la cola se llena el suscriptor queda marcado como desbordado: se
+    descartan sus eventos pendientes y el consumidor debe resincronizar con
+    un snapshot completo en lugar de aplicar deltas incompletos.
+    """
+    
+    def __init__(self, bus, maxsize):
+        self._bus = bus
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+    
+    def _offer(self, event):
+        """Encolar un evento sin bloquear (llamado por el bus)"""
+        if self.overflowed:
+            return
+        
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+            # Vaciar: los deltas ya no son aplicables sin un snapshot
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            # Despertar al consumidor para que resincronice sin esperar al keep-alive
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+    
+    def get(self, timeout=None):
+        """
+        Obtener el siguiente evento
+        
+        Args:
+            timeout: Segundos de espera máxima
+        
+        Returns:
+            Dict del evento o None si venció el timeout (o la cola se desbordó)
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+    
+    def resync(self):
+        """Limpiar la marca de desbordamiento tras enviar un snapshot"""
+        self.overflowed = False
+    
+    def close(self):
+        """Cancelar la suscripción"""
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    """Bus de eventos con fan-out no bloqueante (thread-safe)"""
+    
+    def __init__(self, subscriber_queue_size=DEFAULT_SUBSCRIBER_QUEUE_SIZE):
+        """
+        Args:
+            subscriber_queue_size: Tamaño de la cola de cada suscriptor
+        """
+        self.subscriber_queue_size = subscriber_queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+    
+    def subscribe(self):
+        """
+        Crear una suscripción nueva
+        
+        Returns:
+            Subscription
+        """
+        subscription = Subscription(self, self.subscriber_queue_size)
+        
+        with self._lock:
+            self._subscribers.add(subscription)
+        
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        """Eliminar una suscripción"""
+        with self._lock:
+            self._subscribers.discard(subscription)
+    
+    def subscriber_count(self):
+        """Número de suscriptores conectados"""
+        with self._lock:
+            return len(self._subscribers)
+    
+    def publish(self, event_type, data):
+        """
+        Publicar un evento a todos los suscriptores
+        
+        Args:
+            event_type: Nombre del evento SSE (ej: job_started)
+            data: Contenido serializable a JSON
+        """
+        event = {'id': next(self._ids), 'event': event_type, 'data': data}
+        
+        with self._lock:
+            subscribers = list(self._subscribers)
+        
+        for subscription in subscribers:
+            subscription._offer(event)
+
+
+def format_sse(event_type, data, event_id=None):
+    """
+    Serializar un evento en formato text/event-stream
+    
+    Args:
+        event_type: Nombre del evento
+        data: Contenido serializable a JSON
+        event_id: ID opcional del evento
+    
+    Returns:
+        str con el bloque SSE terminado en línea en blanco
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
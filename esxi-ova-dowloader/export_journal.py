@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export Journal - Checkpoints de exportaciones en disco
+Registra, por archivo del lease, los rangos de bytes ya descargados para que
+un reintento de la exportación pida solo los rangos que faltan
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Nombre del journal dentro del directorio temporal de la exportación
+JOURNAL_FILENAME = 'export_journal.json'
+
+# Segundos mínimos entre escrituras del journal a disco
+DEFAULT_FLUSH_INTERVAL = 5
+
+
+def split_byte_ranges(size, segments):
+    """
+    Dividir un tamaño en rangos de bytes contiguos
+    
+    Args:
+        size: Tamaño total en bytes
+        segments: Número de rangos deseado
+    
+    Returns:
+        Lista de tuplas (inicio, fin) inclusivas
+    """
+    segments = max(1, min(segments, size))
+    segment_size = size // segments
+    
+    ranges = []
+    start = 0
+    for i in range(segments):
+        end = size - 1 if i == segments - 1 else start + segment_size - 1
+        ranges.append((start, end))
+        start = end + 1
+    
+    return ranges
+
+
+class ExportJournal:
+    """
+    Journal de progreso de una exportación (thread-safe)
+    
+    Cada archivo se describe como una lista de rangos [inicio, fin, hechos]
+    donde fin es None si el tamaño no se conoce. Antes de escribir el journal
+    se sincronizan a disco los archivos de datos, de forma que los bytes que
+    figuran como hechos nunca van por delante de los datos persistidos.
+    """
+    
+    def __init__(self, path=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        Args:
+            path: Ruta del journal (None = solo en memoria)
+            flush_interval: Segundos mínimos entre escrituras a disco
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = 0
+        self._dirty = set()
+        self.files = {}
+        self.layout = None
+        
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                self.files = state.get('files', {})
+                self.layout = state.get('layout')
+                logger.info(f"Journal de exportación cargado: {path} ({len(self.files)} archivos)")
+            except Exception as e:
+                logger.warning(f"Journal ilegible, se descarta: {path} ({str(e)})")
+                self.files = {}
+                self.layout = None
+    
+    def use_layout(self, layout):
+        """
+        Fijar la disposición del OVA en construcción
+        
+        Si difiere de la registrada el progreso previo no es reutilizable
+        (los desplazamientos cambian) y se descarta.
+        
+        Args:
+            layout: Disposición serializable (ver StreamingOvaWriter.layout)
+        
+        Returns:
+            bool: True si el progreso previo sigue siendo válido
+        """
+        with self._lock:
+            if self.layout == layout:
+                return True
+            
+            self.files = {}
+            self.layout = layout
+            self._dirty.add(None)
+            return False
+    
+    def plan_file(self, file_name, local_path, file_size, segments=1):
+        """
+        Obtener los rangos de un archivo, reutilizando el progreso previo
+        
+        El progreso previo solo se reutiliza si el tamaño coincide y el
+        archivo local sigue existiendo.
+        
+        Args:
+            file_name: Nombre del archivo en el lease
+            local_path: Ruta local del archivo
+            file_size: Tamaño anunciado por el lease (0 si se desconoce)
+            segments: Rangos en los que dividir el archivo si es nuevo
+        
+        Returns:
+            Lista de rangos [inicio, fin, hechos]
+        """
+        with self._lock:
+            entry = self.files.get(file_name)
+            
+            if (entry and entry['size'] == file_size and entry['local_path'] == local_path
+                    and os.path.exists(local_path)):
+                return [list(r) for r in entry['ranges']]
+            
+            return self._reset(file_name, local_path, file_size, segments)
+    
+    def reset_file(self, file_name, local_path, file_size, segments=1):
+        """
+        Descartar el progreso de un archivo y planificarlo desde cero
+        
+        Returns:
+            Lista de rangos [inicio, fin, hechos]
+        """
+        with self._lock:
+            return self._reset(file_name, local_path, file_size, segments)
+    
+    def _reset(self, file_name, local_path, file_size, segments):
+        if file_size:
+            ranges = [[start, end, 0] for start, end in split_byte_ranges(file_size, segments)]
+        else:
+            ranges = [[0, None, 0]]
+        
+        self.files[file_name] = {
+            'size': file_size,
+            'local_path': local_path,
+            'completed': False,
+            'ranges': ranges
+        }
+        self._dirty.add(file_name)
+        
+        return [list(r) for r in ranges]
+    
+    def is_complete(self, file_name):
+        """Comprobar si un archivo figura como descargado por completo"""
+        with self._lock:
+            entry = self.files.get(file_name)
+            return bool(entry and entry['completed'])
+    
+    def done_bytes(self, file_name):
+        """Bytes ya descargados de un archivo según el journal"""
+        with self._lock:
+            entry = self.files.get(file_name)
+            if not entry:
+                return 0
+            return sum(r[2] for r in entry['ranges'])
+    
+    def advance(self, file_name, range_index, nbytes):
+        """
+        Registrar bytes escritos en un rango
+        
+        Args:
+            file_name: Nombre del archivo
+            range_index: Índice del rango
+            nbytes: Bytes escritos
+        """
+        with self._lock:
+            self.files[file_name]['ranges'][range_index][2] += nbytes
+            self._dirty.add(file_name)
+            due = time.time() - self._last_flush >= self.flush_interval
+            if due:
+                self._last_flush = time.time()
+        
+        if due:
+            self.flush()
+    
+    def complete_file(self, file_name):
+        """Marcar un archivo como descargado por completo"""
+        with self._lock:
+            self.files[file_name]['completed'] = True
+            self._dirty.add(file_name)
+        
+        self.flush()
+    
+    def flush(self):
+        """Sincronizar los archivos de datos y escribir el journal de forma atómica"""
+        if not self.path:
+            return
+        
+        with self._flush_lock:
+            with self._lock:
+                self._last_flush = time.time()
+                dirty = self._dirty
+                self._dirty = set()
+                state = json.dumps({'layout': self.layout, 'files': self.files}, indent=2)
+                data_paths = [self.files[name]['local_path'] for name in dirty if name in self.files]
+            
+            # Los datos deben estar en disco antes que el journal que los declara
+            for data_path in data_paths:
+                try:
+                    fd = os.open(data_path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError as e:
+                    logger.debug(f"No se pudo sincronizar {data_path}: {str(e)}")
+            
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(state)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+    
+    def discard(self):
+        """Eliminar el journal de disco"""
+        if self.path:
+            for path in (self.path, self.path + '.tmp'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
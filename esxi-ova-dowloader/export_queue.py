@@ -0,0 +1,818 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export Queue - Cola de exportaciones con pool de workers
+Procesa las exportaciones en hilos de fondo para que las peticiones HTTP
+vuelvan inmediatamente con los IDs de los trabajos, repartiendo la carga
+entre hosts ESXi y datastores. Con un JobStore los trabajos sobreviven a un
+reinicio: los interrumpidos se recuperan al arrancar
+"""
+
+import copy
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from cancellation import CancelToken
+
+logger = logging.getLogger(__name__)
+
+# Exportaciones simultáneas por vCenter, host ESXi y datastore (0 = sin límite)
+DEFAULT_MAX_PER_VCENTER = 0
+DEFAULT_MAX_PER_HOST = 2
+DEFAULT_MAX_PER_DATASTORE = 2
+
+# Decisiones de planificación que se conservan para /api/status
+DECISION_LOG_SIZE = 50
+
+# Valor de vCenter/host/datastore desconocido en el inventario
+UNKNOWN_PLACEMENT = 'N/A'
+
+# Segundos mínimos entre eventos de progreso de un mismo trabajo
+PROGRESS_EVENT_INTERVAL = 1.0
+
+# Trabajos terminados que se conservan en memoria (sin JobStore)
+HISTORY_SIZE = 100
+
+# Estados finales de un trabajo
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+# Estado de los trabajos interrumpidos por un reinicio
+INTERRUPTED_STATUS = 'interrupted'
+
+
+class DuplicateExportError(Exception):
+    """La VM ya tiene una exportación en cola o en curso"""
+    
+    def __init__(self, duplicates):
+        """
+        Args:
+            duplicates: Lista de tuplas (nombre de VM, vCenter, ID del trabajo existente
+                        o None si la VM se repite en la misma petición)
+        """
+        self.duplicates = duplicates
+        details = [
+            f"{vm_name} ({vcenter}, trabajo {job_id})" if job_id else f"{vm_name} ({vcenter}, repetida)"
+            for vm_name, vcenter, job_id in duplicates
+        ]
+        super().__init__(f"Exportación ya en cola o en curso: {', '.join(details)}")
+
+
+class ExportScheduler:
+    """
+    Planificador de exportaciones (thread-safe)
+    
+    Los trabajos son dicts con el mismo formato que la cola original
+    (vm_name, status, progress, message...) más un 'id'. Todo acceso al
+    estado pasa por el lock del planificador; hacia fuera solo se entregan
+    copias.
+    
+    Si un trabajo trae 'vcenter', 'host' y 'datastores' (del inventario), no
+    se arranca mientras su vCenter, su host o alguno de sus datastores esté
+    al límite, y entre los trabajos elegibles se elige el del vCenter y host
+    menos cargados, de modo que las exportaciones se intercalan entre
+    vCenters y hosts en lugar de saturar uno solo. Hosts y datastores se
+    contabilizan por vCenter (sus nombres pueden repetirse entre vCenters).
+    
+    Los cambios se notifican como deltas a on_event (transiciones de estado
+    y progreso limitado a un evento por PROGRESS_EVENT_INTERVAL y trabajo).
+    
+    Con store (JobStore) cada cambio notificado se guarda también en disco y
+    el historial de snapshot() se lee de la base de datos; sin él solo se
+    conservan en memoria los últimos HISTORY_SIZE trabajos terminados. Las
+    escrituras las hace un único hilo en el orden en que se encolaron, para
+    no hacer E/S con el lock tomado.
+    """
+    
+    def __init__(self, run_job, max_workers=1, max_per_host=DEFAULT_MAX_PER_HOST,
+                 max_per_datastore=DEFAULT_MAX_PER_DATASTORE,
+                 max_per_vcenter=DEFAULT_MAX_PER_VCENTER, on_event=None, store=None):
+        """
+        Args:
+            run_job: Callable(job, update, cancel_token) que ejecuta un trabajo;
+                     update(**campos) actualiza el estado del trabajo de forma
+                     segura y cancel_token (CancelToken) se activa si se cancela
+            max_workers: Número de exportaciones simultáneas
+            max_per_host: Exportaciones simultáneas por host ESXi (0 = sin límite)
+            max_per_datastore: Exportaciones simultáneas por datastore (0 = sin límite)
+            max_per_vcenter: Exportaciones simultáneas por vCenter (0 = sin límite)
+            on_event: Callable(tipo, datos) no bloqueante que recibe los cambios
+            store: JobStore donde persistir los trabajos (opcional)
+        """
+        self._run_job = run_job
+        self.max_workers = max(1, int(max_workers))
+        self.max_per_host = max(0, int(max_per_host))
+        self.max_per_datastore = max(0, int(max_per_datastore))
+        self.max_per_vcenter = max(0, int(max_per_vcenter))
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = deque()
+        self._active = {}
+        self._cancel_tokens = {}
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._workers = []
+        self._vcenter_load = {}
+        self._host_load = {}
+        self._datastore_load = {}
+        self._decisions = deque(maxlen=DECISION_LOG_SIZE)
+        self._on_event = on_event
+        self._last_progress_event = {}
+        self._store = store
+        self._writes = queue.Queue()
+        self._writes_queued = 0
+        self._writes_done = 0
+        self._written = threading.Condition()
+        
+        if store:
+            threading.Thread(target=self._writer_loop, name='job-store-writer', daemon=True).start()
+    
+    def _queue_write(self, operation, arg):
+        """Encolar una escritura del JobStore (con el lock tomado, para conservar el orden)"""
+        self._writes_queued += 1
+        self._writes.put((operation, arg))
+    
+    def _persist(self, job):
+        """Guardar una copia del trabajo en el JobStore (con el lock tomado)"""
+        if self._store:
+            self._queue_write('save', copy.deepcopy(job))
+    
+    def _forget(self, job_ids):
+        """Borrar del JobStore trabajos descartados de la cola (con el lock tomado)"""
+        if self._store:
+            self._queue_write('delete', list(job_ids))
+    
+    def _writer_loop(self):
+        """Hilo escritor: aplica las escrituras del JobStore en orden"""
+        while True:
+            operation, arg = self._writes.get()
+            try:
+                if operation == 'save':
+                    self._store.save(arg)
+                else:
+                    self._store.delete(arg)
+            except Exception as e:
+                target = arg['id'] if operation == 'save' else ', '.join(arg)
+                logger.warning(f"Error en el JobStore ({operation} {target}): {str(e)}")
+            
+            with self._written:
+                self._writes_done += 1
+                self._written.notify_all()
+    
+    def flush(self, timeout=None):
+        """
+        Esperar a que el JobStore tenga todos los cambios hechos hasta ahora
+        
+        Args:
+            timeout: Segundos máximos de espera (None = sin límite)
+        
+        Returns:
+            bool: False si vence el timeout con escrituras pendientes
+        """
+        if not self._store:
+            return True
+        
+        with self._lock:
+            target = self._writes_queued
+        
+        with self._written:
+            return self._written.wait_for(lambda: self._writes_done >= target, timeout)
+    
+    def _emit(self, event_type, data):
+        """Notificar un cambio (con el lock tomado, para conservar el orden)"""
+        if not self._on_event:
+            return
+        
+        try:
+            self._on_event(event_type, copy.deepcopy(data))
+        except Exception as e:
+            logger.warning(f"Error notificando evento {event_type}: {str(e)}")
+    
+    def _ensure_workers(self):
+        """Arrancar los hilos de trabajo que falten (con el lock tomado)"""
+        self._workers = [w for w in self._workers if w.is_alive()]
+        
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f'export-worker-{len(self._workers) + 1}',
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+    
+    @staticmethod
+    def _vm_key(job):
+        """Identidad de la VM de un trabajo: vCenter y MoRef (o nombre si no se conoce)"""
+        return (job.get('vcenter') or UNKNOWN_PLACEMENT, job.get('moref') or job['vm_name'])
+    
+    def submit(self, items, hold=False):
+        """
+        Encolar trabajos de exportación
+        
+        Una VM solo puede tener un trabajo sin terminar: dos exportaciones
+        simultáneas compartirían directorio temporal y journal. Si alguna VM ya
+        está en cola o en curso no se encola ningún trabajo.
+        
+        Args:
+            items: Lista de dicts con vm_name, poweroff_before, download_dir y timestamp,
+                   y opcionalmente vcenter, moref, host y datastores de la VM
+            hold: Encolar los trabajos retenidos (estado 'powering_off') hasta
+                  que se liberen con release() o se descarten con fail()
+        
+        Returns:
+            Lista de IDs de los trabajos creados
+        
+        Raises:
+            DuplicateExportError: Si alguna VM ya tiene un trabajo sin terminar
+                                  (o aparece dos veces en items)
+        """
+        job_ids = []
+        
+        with self._lock:
+            unfinished = {
+                self._vm_key(job): job['id']
+                for job in list(self._pending) + list(self._active.values())
+            }
+            duplicates = []
+            for item in items:
+                key = self._vm_key(item)
+                if key in unfinished:
+                    duplicates.append((item['vm_name'], key[0], unfinished[key]))
+                unfinished.setdefault(key, None)
+            
+            if duplicates:
+                raise DuplicateExportError(duplicates)
+            
+            for item in items:
+                job = dict(item)
+                job['id'] = uuid.uuid4().hex
+                job['status'] = 'powering_off' if hold else 'pending'
+                job['held'] = hold
+                job['scheduling'] = "En espera: apagando la VM" if hold else None
+                job['progress'] = 0
+                job['submitted_at'] = datetime.now().isoformat()
+                job['trace_id'] = uuid.uuid4().hex
+                job['spans'] = []
+                job['vcenter'] = job.get('vcenter') or UNKNOWN_PLACEMENT
+                job['host'] = job.get('host') or UNKNOWN_PLACEMENT
+                job['datastores'] = list(job.get('datastores') or [])
+                self._pending.append(job)
+                job_ids.append(job['id'])
+                self._persist(job)
+                self._emit('job_queued', job)
+            
+            self._ensure_workers()
+            self._wakeup.notify_all()
+        
+        return job_ids
+    
+    def update(self, job_id, **fields):
+        """
+        Actualizar campos de un trabajo activo
+        
+        Args:
+            job_id: ID del trabajo
+            **fields: Campos a modificar
+        """
+        with self._lock:
+            job = self._active.get(job_id)
+            if job is None:
+                return
+            
+            # Un trabajo cancelado no vuelve a otro estado mientras se detiene
+            if job['status'] == 'cancelled':
+                fields.pop('status', None)
+                fields.pop('error', None)
+            
+            status_changed = 'status' in fields and fields['status'] != job.get('status')
+            job.update(fields)
+            
+            if status_changed or set(fields) - {'progress', 'message'}:
+                self._persist(job)
+                self._emit('job_updated', job)
+                return
+            
+            # Solo progreso: como mucho un evento por intervalo
+            now = time.monotonic()
+            if now - self._last_progress_event.get(job_id, 0) >= PROGRESS_EVENT_INTERVAL:
+                self._last_progress_event[job_id] = now
+                self._persist(job)
+                self._emit('job_progress', {
+                    'id': job_id,
+                    'progress': job.get('progress'),
+                    'message': job.get('message')
+                })
+    
+    def _find_pending(self, job_id):
+        """Buscar un trabajo en la cola (con el lock tomado)"""
+        for job in self._pending:
+            if job['id'] == job_id:
+                return job
+        return None
+    
+    def release(self, job_id, **fields):
+        """
+        Liberar un trabajo retenido para que pueda arrancar
+        
+        Args:
+            job_id: ID del trabajo
+            **fields: Campos a añadir al trabajo (ej: spans del apagado)
+        """
+        with self._lock:
+            job = self._find_pending(job_id)
+            if job is None or not job['held']:
+                return
+            
+            job.update(fields)
+            job['held'] = False
+            job['status'] = 'pending'
+            job['scheduling'] = None
+            self._persist(job)
+            self._emit('job_updated', job)
+            self._wakeup.notify_all()
+    
+    def fail(self, job_id, error, **fields):
+        """
+        Descartar un trabajo retenido que no puede ejecutarse
+        
+        Args:
+            job_id: ID del trabajo
+            error: Motivo del fallo
+            **fields: Campos a añadir al trabajo (ej: spans del apagado)
+        """
+        with self._lock:
+            job = self._find_pending(job_id)
+            if job is None:
+                return
+            
+            job.update(fields)
+            self._pending.remove(job)
+            job['held'] = False
+            job['status'] = 'failed'
+            job['error'] = error
+            job['finished_at'] = datetime.now().isoformat()
+            self._history.append(job)
+            self._persist(job)
+            self._emit('job_finished', job)
+    
+    def recover(self):
+        """
+        Recuperar del JobStore los trabajos que no terminaron (al arrancar)
+        
+        Los que estaban en cola o en curso vuelven a la cola retenidos con
+        estado 'interrupted' hasta que su vCenter se conecte de nuevo (las
+        credenciales no se guardan); al reanudarse, la exportación continúa
+        desde el journal de su directorio de descarga. Los que ya tenían un
+        estado final pero no llegaron a cerrarse pasan al historial.
+        
+        Returns:
+            int: Número de trabajos devueltos a la cola
+        """
+        if not self._store:
+            return 0
+        
+        recovered = 0
+        
+        with self._lock:
+            for job in self._store.unfinished():
+                if job['status'] in FINISHED_STATUSES:
+                    job['finished_at'] = datetime.now().isoformat()
+                    self._history.append(job)
+                    self._persist(job)
+                    continue
+                
+                job['status'] = INTERRUPTED_STATUS
+                job['held'] = True
+                job['scheduling'] = f"En espera: reconexión al vCenter {job['vcenter']}"
+                job['message'] = 'Interrumpido por un reinicio'
+                job.pop('started_at', None)
+                self._pending.append(job)
+                self._persist(job)
+                self._emit('job_queued', job)
+                recovered += 1
+        
+        if recovered:
+            logger.info(f"{recovered} trabajos interrumpidos recuperados; se reanudarán al reconectar su vCenter")
+        return recovered
+    
+    def resume_recovered(self, vcenter):
+        """
+        Reactivar los trabajos interrumpidos de un vCenter recién conectado
+        
+        Los que no piden apagar la VM se liberan; los de poweroff_before siguen
+        retenidos en estado 'powering_off' hasta que el llamador los libere con
+        release() o los descarte con fail().
+        
+        Args:
+            vcenter: Host del vCenter
+        
+        Returns:
+            Lista de copias de los trabajos reactivados
+        """
+        resumed = []
+        
+        with self._lock:
+            for job in self._pending:
+                if job['status'] != INTERRUPTED_STATUS or job['vcenter'] != vcenter:
+                    continue
+                
+                if job.get('poweroff_before'):
+                    job['status'] = 'powering_off'
+                    job['scheduling'] = "En espera: apagando la VM"
+                else:
+                    job['held'] = False
+                    job['status'] = 'pending'
+                    job['scheduling'] = None
+                
+                job['message'] = 'Reanudando tras un reinicio'
+                self._persist(job)
+                self._emit('job_updated', job)
+                resumed.append(dict(job))
+            
+            if resumed:
+                self._ensure_workers()
+                self._wakeup.notify_all()
+        
+        return resumed
+    
+    def clear_pending(self):
+        """
+        Vaciar la cola de trabajos pendientes
+        
+        Returns:
+            int: Número de trabajos descartados
+        """
+        with self._lock:
+            job_ids = [job['id'] for job in self._pending]
+            self._forget(job_ids)
+            self._emit('queue_cleared', {'ids': job_ids})
+            self._pending.clear()
+            return len(job_ids)
+    
+    def _mark_cancelled(self, job):
+        """
+        Marcar un trabajo activo como cancelado (con el lock tomado)
+        
+        Returns:
+            CancelToken del trabajo, que el llamador activa fuera del lock
+        """
+        job['status'] = 'cancelled'
+        job['message'] = 'Cancelando...'
+        self._persist(job)
+        self._emit('job_updated', job)
+        return self._cancel_tokens.get(job['id'])
+    
+    def cancel(self, job_id):
+        """
+        Cancelar un trabajo pendiente o en curso
+        
+        Un trabajo en cola sale de ella y pasa al historial como cancelado. En
+        uno activo se activa su CancelToken: la exportación cierra sus
+        descargas, aborta el lease y borra los archivos parciales, y el worker
+        queda libre en cuanto vuelve.
+        
+        Args:
+            job_id: ID del trabajo
+        
+        Returns:
+            bool: False si el trabajo no existe o ya había terminado
+        """
+        with self._lock:
+            job = self._find_pending(job_id)
+            if job is not None:
+                self._pending.remove(job)
+                job['held'] = False
+                job['status'] = 'cancelled'
+                job['scheduling'] = None
+                job['finished_at'] = datetime.now().isoformat()
+                self._history.append(job)
+                self._persist(job)
+                self._emit('job_finished', job)
+                return True
+            
+            job = self._active.get(job_id)
+            if job is None:
+                return False
+            
+            token = self._mark_cancelled(job)
+        
+        # Los callbacks de cancelación hacen llamadas de red: fuera del lock
+        if token:
+            token.cancel()
+        return True
+    
+    def cancel_all(self):
+        """Vaciar la cola y cancelar los trabajos activos"""
+        with self._lock:
+            job_ids = [job['id'] for job in self._pending]
+            self._forget(job_ids)
+            self._emit('queue_cleared', {'ids': job_ids})
+            self._pending.clear()
+            tokens = [self._mark_cancelled(job) for job in self._active.values()]
+        
+        for token in tokens:
+            if token:
+                token.cancel()
+    
+    def cancel_vcenter(self, vcenter, timeout=None):
+        """
+        Quitar de la cola y cancelar los trabajos de un vCenter, y esperar a
+        que los workers lo suelten (antes de cerrar su conexión)
+        
+        Args:
+            vcenter: Host del vCenter
+            timeout: Segundos máximos de espera (None = sin límite)
+        
+        Returns:
+            bool: True si ya no queda ningún trabajo activo de ese vCenter
+        """
+        with self._lock:
+            dropped = [job for job in self._pending if job['vcenter'] == vcenter]
+            job_ids = [job['id'] for job in dropped]
+            if job_ids:
+                self._forget(job_ids)
+                self._emit('queue_cleared', {'ids': job_ids})
+                for job in dropped:
+                    self._pending.remove(job)
+            tokens = [
+                self._mark_cancelled(job) for job in self._active.values()
+                if job['vcenter'] == vcenter and job['status'] != 'cancelled'
+            ]
+        
+        for token in tokens:
+            if token:
+                token.cancel()
+        
+        # Los workers avisan por _wakeup al terminar cada trabajo
+        with self._wakeup:
+            return self._wakeup.wait_for(
+                lambda: not any(job['vcenter'] == vcenter for job in self._active.values()),
+                timeout
+            )
+    
+    def snapshot(self, history_limit=10):
+        """
+        Obtener una copia del estado de la cola
+        
+        Args:
+            history_limit: Número de entradas recientes del historial
+        
+        Returns:
+            Dict con active, queue, history, workers y scheduling
+        """
+        # Con JobStore el historial es una consulta acotada, fuera del lock
+        history = None
+        if self._store:
+            self.flush()
+            history = self._store.history(history_limit)
+        
+        with self._lock:
+            if history is None:
+                history = copy.deepcopy(list(self._history)[-history_limit:]) if history_limit else []
+            
+            return {
+                'active': copy.deepcopy(list(self._active.values())),
+                'queue': copy.deepcopy(list(self._pending)),
+                'history': history,
+                'workers': self.max_workers,
+                'scheduling': {
+                    'limits': {
+                        'max_workers': self.max_workers,
+                        'max_per_host': self.max_per_host,
+                        'max_per_datastore': self.max_per_datastore,
+                        'max_per_vcenter': self.max_per_vcenter
+                    },
+                    'vcenter_load': dict(self._vcenter_load),
+                    'host_load': dict(self._host_load),
+                    'datastore_load': dict(self._datastore_load),
+                    'decisions': list(self._decisions)
+                }
+            }
+    
+    def get(self, job_id):
+        """
+        Buscar un trabajo por ID en la cola, los activos y el historial
+        
+        Returns:
+            Copia del trabajo o None si no existe
+        """
+        with self._lock:
+            job = self._find_pending(job_id) or self._active.get(job_id)
+            if job is None:
+                job = next((j for j in self._history if j['id'] == job_id), None)
+            if job is not None:
+                return copy.deepcopy(job)
+        
+        if not self._store:
+            return None
+        
+        self.flush()
+        return self._store.get(job_id)
+    
+    def query(self, status=None, vm_name=None, since=None, until=None, limit=100):
+        """
+        Buscar trabajos por estado, VM y fecha de envío
+        
+        Sin JobStore solo se busca en la cola, los activos y el historial en
+        memoria.
+        
+        Args:
+            status: Estado exacto
+            vm_name: Nombre de la VM
+            since: Fecha ISO mínima de envío
+            until: Fecha ISO máxima de envío
+            limit: Máximo de resultados
+        
+        Returns:
+            Lista de trabajos, del más reciente al más antiguo
+        """
+        if self._store:
+            self.flush()
+            return self._store.query(status, vm_name, since, until, limit)
+        
+        with self._lock:
+            jobs = list(self._pending) + list(self._active.values()) + list(self._history)
+            jobs = [
+                job for job in jobs
+                if (not status or job['status'] == status)
+                and (not vm_name or job['vm_name'] == vm_name)
+                and (not since or job['submitted_at'] >= since)
+                and (not until or job['submitted_at'] <= until)
+            ]
+            jobs.sort(key=lambda job: job['submitted_at'], reverse=True)
+            return copy.deepcopy(jobs[:max(1, int(limit))])
+    
+    def _placement(self, job):
+        """
+        Claves de carga de un trabajo
+        
+        Returns:
+            Tupla (vCenter o None, host o None, lista de datastores); host y
+            datastores van calificados con el vCenter si se conoce
+        """
+        vcenter = job['vcenter'] if job['vcenter'] != UNKNOWN_PLACEMENT else None
+        
+        def qualify(name):
+            return f"{vcenter}/{name}" if vcenter else name
+        
+        host = qualify(job['host']) if job['host'] != UNKNOWN_PLACEMENT else None
+        datastores = [qualify(ds) for ds in job['datastores'] if ds != UNKNOWN_PLACEMENT]
+        
+        return vcenter, host, datastores
+    
+    def _blocked_reason(self, job):
+        """
+        Motivo por el que un trabajo no puede arrancar todavía (con el lock tomado)
+        
+        Returns:
+            str con el motivo o None si el trabajo es elegible
+        """
+        vcenter, host, datastores = self._placement(job)
+        
+        if self.max_per_vcenter and vcenter:
+            load = self._vcenter_load.get(vcenter, 0)
+            if load >= self.max_per_vcenter:
+                return f"vCenter {vcenter} al límite ({load}/{self.max_per_vcenter})"
+        
+        if self.max_per_host and host:
+            load = self._host_load.get(host, 0)
+            if load >= self.max_per_host:
+                return f"host {job['host']} al límite ({load}/{self.max_per_host})"
+        
+        if self.max_per_datastore:
+            for datastore in datastores:
+                load = self._datastore_load.get(datastore, 0)
+                if load >= self.max_per_datastore:
+                    return f"datastore {datastore} al límite ({load}/{self.max_per_datastore})"
+        
+        return None
+    
+    def _load_key(self, job):
+        """Carga actual del vCenter, host y datastores de un trabajo, para ordenar candidatos"""
+        vcenter, host, datastores = self._placement(job)
+        
+        vcenter_load = self._vcenter_load.get(vcenter, 0) if vcenter else 0
+        host_load = self._host_load.get(host, 0) if host else 0
+        datastore_load = max([self._datastore_load.get(ds, 0) for ds in datastores] or [0])
+        
+        return vcenter_load, host_load, datastore_load
+    
+    def _next_job(self):
+        """
+        Elegir el siguiente trabajo pendiente (con el lock tomado)
+        
+        Recorre la cola en orden FIFO descartando los trabajos retenidos y los
+        bloqueados por los límites de vCenter/host/datastore y, de los elegibles,
+        toma el de menor carga de vCenter (luego de host y de datastore); a
+        igual carga gana el más antiguo.
+        
+        Returns:
+            Trabajo extraído de la cola o None si ninguno puede arrancar
+        """
+        best = None
+        best_key = None
+        
+        for index, job in enumerate(self._pending):
+            if job['held']:
+                continue
+            
+            reason = self._blocked_reason(job)
+            job['scheduling'] = f"En espera: {reason}" if reason else None
+            if reason:
+                continue
+            
+            key = self._load_key(job) + (index,)
+            if best_key is None or key < best_key:
+                best, best_key = job, key
+        
+        if best is None:
+            return None
+        
+        self._pending.remove(best)
+        
+        vcenter_load, host_load, datastore_load, queue_position = best_key
+        best['scheduling'] = (
+            f"Asignado: vCenter {best['vcenter']} con {vcenter_load} activas, "
+            f"host {best['host']} con {host_load}, "
+            f"datastore más cargado con {datastore_load}"
+        )
+        self._decisions.append({
+            'at': datetime.now().isoformat(),
+            'job_id': best['id'],
+            'vm_name': best['vm_name'],
+            'vcenter': best['vcenter'],
+            'host': best['host'],
+            'datastores': list(best['datastores']),
+            'vcenter_load': vcenter_load,
+            'host_load': host_load,
+            'datastore_load': datastore_load,
+            'queue_position': queue_position,
+            'waiting': len(self._pending)
+        })
+        
+        return best
+    
+    def _load_counters(self, job):
+        """Pares (contador de carga, clave) que ocupa un trabajo"""
+        vcenter, host, datastores = self._placement(job)
+        
+        counters = [(self._vcenter_load, vcenter), (self._host_load, host)]
+        counters += [(self._datastore_load, ds) for ds in datastores]
+        return [(load, key) for load, key in counters if key]
+    
+    def _acquire_placement(self, job):
+        """Contabilizar un trabajo en la carga de su vCenter, host y datastores"""
+        for load, key in self._load_counters(job):
+            load[key] = load.get(key, 0) + 1
+    
+    def _release_placement(self, job):
+        """Descontar un trabajo terminado de la carga de su vCenter, host y datastores"""
+        for load, key in self._load_counters(job):
+            if key in load:
+                load[key] -= 1
+                if load[key] <= 0:
+                    del load[key]
+    
+    def _worker_loop(self):
+        """Bucle de un worker: toma trabajos elegibles de la cola"""
+        while True:
+            with self._lock:
+                job = self._next_job()
+                while job is None:
+                    self._wakeup.wait()
+                    job = self._next_job()
+                
+                self._acquire_placement(job)
+                job['status'] = 'processing'
+                job['started_at'] = datetime.now().isoformat()
+                self._active[job['id']] = job
+                cancel_token = self._cancel_tokens[job['id']] = CancelToken()
+                job_view = dict(job)
+                self._persist(job)
+                self._emit('job_started', {'job': job, 'decision': self._decisions[-1]})
+            
+            def update(_job_id=job['id'], **fields):
+                self.update(_job_id, **fields)
+            
+            try:
+                self._run_job(job_view, update, cancel_token)
+            except Exception as e:
+                logger.error(f"Error procesando descarga de {job_view['vm_name']}: {str(e)}")
+                update(status='failed', error=str(e))
+            finally:
+                with self._lock:
+                    self._active.pop(job['id'], None)
+                    self._cancel_tokens.pop(job['id'], None)
+                    self._release_placement(job)
+                    self._last_progress_event.pop(job['id'], None)
+                    job['finished_at'] = datetime.now().isoformat()
+                    if job['status'] == 'cancelled':
+                        job['message'] = 'Exportación cancelada'
+                    self._history.append(job)
+                    self._persist(job)
+                    self._emit('job_finished', job)
+                    # Un vCenter/host/datastore liberado puede desbloquear trabajos en espera
+                    self._wakeup.notify_all()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Federation - Varias conexiones a vCenter tratadas como un solo inventario
+Mantiene un VMwareService por vCenter, consulta sus inventarios en paralelo
+(con timeout para que un vCenter lento no retrase al resto) y presenta una
+lista de VMs unificada en la que cada VM indica su vCenter
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from inventory import build_inventory_view
+
+logger = logging.getLogger(__name__)
+
+# Segundos máximos de espera por el inventario de cada vCenter
+DEFAULT_INVENTORY_TIMEOUT = 30
+
+# Segundos máximos de espera a que los trabajos de un vCenter lo suelten al desconectarlo
+DEFAULT_DRAIN_TIMEOUT = 60
+
+
+class AmbiguousVCenterError(Exception):
+    """Una VM pedida sin vCenter existe en varios vCenters"""
+
+    def __init__(self, name, vcenters):
+        self.name = name
+        self.vcenters = vcenters
+        super().__init__(
+            f"La VM '{name}' existe en varios vCenters ({', '.join(vcenters)}); "
+            f"indica el vCenter"
+        )
+
+
+class VCenterFederation:
+    """Conexiones activas a vCenter indexadas por host (thread-safe)"""
+
+    def __init__(self, inventory_timeout=DEFAULT_INVENTORY_TIMEOUT, drain=None,
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        """
+        Args:
+            inventory_timeout: Segundos máximos de espera por cada inventario
+            drain: Callable(host, timeout) que cancela los trabajos de un vCenter
+                   y espera a que los workers lo suelten; devuelve False si
+                   alguno sigue activo al vencer el timeout (opcional)
+            drain_timeout: Segundos máximos de espera de drain
+        """
+        self.inventory_timeout = inventory_timeout
+        self.drain = drain
+        self.drain_timeout = drain_timeout
+        self._lock = threading.Lock()
+        self._services = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._services)
+
+    def add(self, service):
+        """
+        Añadir una conexión ya establecida
+
+        Si ya hay una conexión al mismo vCenter se conserva (los trabajos en
+        curso la están usando) y se desconecta la nueva.
+
+        Args:
+            service: VMwareService conectado
+
+        Returns:
+            VMwareService en uso para ese vCenter
+        """
+        with self._lock:
+            current = self._services.setdefault(service.host, service)
+
+        if current is not service:
+            logger.info(f"vCenter {service.host} ya conectado, se conserva la conexión existente")
+            service.disconnect()
+        return current
+
+    def _release(self, host, service):
+        """Cancelar los trabajos de un vCenter ya quitado y desconectarlo cuando lo suelten"""
+        if self.drain:
+            try:
+                if not self.drain(host, self.drain_timeout):
+                    logger.warning(
+                        f"vCenter {host}: trabajos aún activos tras {self.drain_timeout}s, "
+                        f"se desconecta igualmente"
+                    )
+            except Exception as e:
+                logger.error(f"vCenter {host}: error cancelando sus trabajos: {str(e)}")
+
+        service.disconnect()
+
+    def remove(self, host):
+        """
+        Quitar un vCenter, cancelar sus trabajos y desconectarlo
+
+        Args:
+            host: Host del vCenter
+
+        Returns:
+            bool: True si estaba conectado
+        """
+        with self._lock:
+            service = self._services.pop(host, None)
+
+        if service is None:
+            return False
+
+        self._release(host, service)
+        return True
+
+    def clear(self):
+        """Quitar todos los vCenters, cancelar sus trabajos y desconectarlos"""
+        with self._lock:
+            services = list(self._services.items())
+            self._services.clear()
+
+        if not services:
+            return
+
+        # Cancelar y esperar en paralelo: el tiempo total es el del vCenter más lento
+        executor = ThreadPoolExecutor(max_workers=len(services), thread_name_prefix='vcenter')
+        wait([executor.submit(self._release, host, service) for host, service in services])
+        executor.shutdown()
+
+    def get(self, host):
+        """
+        Obtener la conexión a un vCenter
+
+        Returns:
+            VMwareService o None si no está conectado
+        """
+        with self._lock:
+            return self._services.get(host)
+
+    def hosts(self):
+        """Hosts de los vCenters conectados, en orden de conexión"""
+        with self._lock:
+            return list(self._services)
+
+    def _map(self, method_name, timeout=None):
+        """
+        Llamar a un método de cada VMwareService en paralelo
+
+        Args:
+            method_name: Nombre del método (sin argumentos)
+            timeout: Segundos máximos de espera (None = sin límite)
+
+        Returns:
+            Tupla (dict host -> resultado, dict host -> error)
+        """
+        with self._lock:
+            services = list(self._services.items())
+
+        if not services:
+            return {}, {}
+
+        executor = ThreadPoolExecutor(max_workers=len(services), thread_name_prefix='vcenter')
+        futures = {
+            host: executor.submit(getattr(service, method_name))
+            for host, service in services
+        }
+        wait(futures.values(), timeout=timeout)
+        # No esperar a los vCenters que no han respondido: su resultado se descarta
+        executor.shutdown(wait=False)
+
+        results = {}
+        errors = {}
+        for host, future in futures.items():
+            if not future.done():
+                errors[host] = f'Sin respuesta en {timeout}s'
+                logger.warning(f"vCenter {host}: sin respuesta en {timeout}s, se omite")
+                continue
+
+            try:
+                results[host] = future.result()
+            except Exception as e:
+                errors[host] = str(e)
+                logger.error(f"vCenter {host}: {str(e)}")
+
+        return results, errors
+
+    def get_vm_list(self):
+        """
+        Obtener la lista unificada de VMs de todos los vCenters
+
+        Returns:
+            Tupla (lista de VMs con el campo 'vcenter', dict host -> error de
+            los vCenters que fallaron o no respondieron a tiempo)
+        """
+        results, errors = self._map('get_vm_list', self.inventory_timeout)
+
+        # Copias etiquetadas: las listas de cada caché se comparten entre peticiones
+        vm_list = [
+            dict(vm_info, vcenter=host)
+            for host, vms in results.items()
+            for vm_info in vms
+        ]
+
+        return vm_list, errors
+
+    def get_inventory_view(self, filters=None):
+        """
+        Obtener VMs filtradas, opciones de filtro y facetas de todos los vCenters
+
+        Args:
+            filters: Dict con filtros opcionales (vcenter, host, cluster, power_state, folder)
+
+        Returns:
+            Dict con vms, filter_options, facets y errors (por vCenter)
+        """
+        vm_list, errors = self.get_vm_list()
+
+        view = build_inventory_view(vm_list, filters)
+        view['errors'] = errors
+        return view
+
+    def resolve_vcenter(self, vm_name, vm_list=None):
+        """
+        Averiguar el vCenter de una VM pedida solo por nombre o MoRef
+
+        Args:
+            vm_name: Nombre o MoRef de la VM
+            vm_list: Lista unificada ya obtenida (opcional)
+
+        Returns:
+            Host del vCenter o None si ninguno la tiene
+
+        Raises:
+            AmbiguousVCenterError: Si la VM existe en varios vCenters
+        """
+        hosts = self.hosts()
+        if len(hosts) == 1:
+            return hosts[0]
+
+        if vm_list is None:
+            vm_list, _ = self.get_vm_list()
+
+        vcenters = sorted({
+            vm_info['vcenter'] for vm_info in vm_list
+            if vm_name in (vm_info['name'], vm_info['moref'])
+        })
+
+        if len(vcenters) > 1:
+            raise AmbiguousVCenterError(vm_name, vcenters)
+
+        return vcenters[0] if vcenters else None
+
+    def refresh_inventory(self):
+        """
+        Recargar el inventario de todos los vCenters en paralelo
+
+        Returns:
+            Dict host -> contadores de la caché (o error)
+        """
+        results, errors = self._map('refresh_inventory')
+        results.update({host: {'error': error} for host, error in errors.items()})
+        return results
+
+    def get_stats(self):
+        """
+        Contadores de caché de inventario y pool de sesiones por vCenter
+
+        Returns:
+            Dict host -> {cache, sessions}
+        """
+        with self._lock:
+            services = list(self._services.items())
+
+        return {
+            host: {
+                'cache': service.get_inventory_stats(),
+                'sessions': service.get_session_stats()
+            }
+            for host, service in services
+        }
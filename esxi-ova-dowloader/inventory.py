@@ -0,0 +1,680 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inventory - Recuperación masiva del inventario de vCenter
+Obtiene las propiedades de VMs, hosts, clusters y folders en una sola pasada
+del PropertyCollector (RetrievePropertiesEx paginado) en lugar de leer cada
+atributo de cada VM con una llamada SOAP independiente, y mantiene una caché
+en memoria actualizada de forma incremental con WaitForUpdatesEx
+"""
+
+from pyVmomi import vim, vmodl
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PropertyCollector = vmodl.query.PropertyCollector
+
+# Objetos por página en RetrievePropertiesEx / ContinueRetrievePropertiesEx
+PROPERTY_PAGE_SIZE = 1000
+
+# TTL por defecto de la caché de inventario (segundos)
+DEFAULT_INVENTORY_TTL = 30
+
+# Opciones de filtro -> campo del dict de VM
+FACET_FIELDS = {
+    'vcenters': 'vcenter',
+    'hosts': 'host',
+    'clusters': 'cluster',
+    'folders': 'folder',
+    'power_states': 'power_state',
+}
+
+# Propiedades necesarias por tipo de objeto
+INVENTORY_PROPERTIES = {
+    vim.VirtualMachine: [
+        'name',
+        'runtime.powerState',
+        'runtime.host',
+        'parent',
+        'config.guestFullName',
+        'config.hardware',
+        'config.annotation',
+        'datastore',
+    ],
+    vim.HostSystem: ['name', 'parent'],
+    vim.ClusterComputeResource: ['name'],
+    vim.Folder: ['name'],
+    vim.Datastore: ['name'],
+}
+
+
+def build_filter_spec(view):
+    """
+    Construir FilterSpec que recorre un ContainerView con un único TraversalSpec
+    
+    Args:
+        view: ContainerView sobre el inventario
+    
+    Returns:
+        vmodl.query.PropertyCollector.FilterSpec
+    """
+    traversal = PropertyCollector.TraversalSpec(
+        name='traverseView',
+        path='view',
+        skip=False,
+        type=vim.view.ContainerView
+    )
+    
+    obj_spec = PropertyCollector.ObjectSpec(
+        obj=view,
+        skip=True,
+        selectSet=[traversal]
+    )
+    
+    prop_specs = [
+        PropertyCollector.PropertySpec(type=obj_type, pathSet=paths)
+        for obj_type, paths in INVENTORY_PROPERTIES.items()
+    ]
+    
+    return PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=prop_specs)
+
+
+def create_inventory_view(content):
+    """
+    Crear ContainerView con todos los tipos de objeto del inventario
+    
+    Args:
+        content: ServiceContent de vCenter
+    
+    Returns:
+        ContainerView (el llamador debe destruirlo)
+    """
+    return content.viewManager.CreateContainerView(
+        content.rootFolder, list(INVENTORY_PROPERTIES.keys()), True
+    )
+
+
+def retrieve_inventory(content, page_size=PROPERTY_PAGE_SIZE):
+    """
+    Obtener snapshot del inventario con RetrievePropertiesEx paginado
+    
+    Args:
+        content: ServiceContent de vCenter
+        page_size: Objetos por página
+    
+    Returns:
+        InventorySnapshot con todas las propiedades
+    """
+    view = create_inventory_view(content)
+    snapshot = InventorySnapshot()
+    
+    try:
+        collector = content.propertyCollector
+        options = PropertyCollector.RetrieveOptions(maxObjects=page_size)
+        result = collector.RetrievePropertiesEx([build_filter_spec(view)], options)
+        
+        pages = 0
+        while result:
+            pages += 1
+            for obj_content in result.objects:
+                props = {prop.name: prop.val for prop in obj_content.propSet}
+                snapshot.apply(obj_content.obj, props)
+            
+            if not result.token:
+                break
+            
+            result = collector.ContinueRetrievePropertiesEx(result.token)
+        
+        logger.info(f"Inventario obtenido: {len(snapshot)} objetos en {pages} página(s)")
+    
+    finally:
+        view.Destroy()
+    
+    return snapshot
+
+
+def matches_filters(vm_info, filters):
+    """
+    Comprobar si una VM cumple los filtros
+    
+    Args:
+        vm_info: Dict con información de la VM
+        filters: Dict con filtros opcionales (vcenter, host, cluster, power_state, folder)
+    
+    Returns:
+        bool: True si la VM cumple todos los filtros
+    """
+    if not filters:
+        return True
+    
+    for key in ('vcenter', 'host', 'cluster', 'power_state', 'folder'):
+        if key in filters and vm_info.get(key, 'N/A') != filters[key]:
+            return False
+    
+    return True
+
+
+def build_inventory_view(vm_list, filters=None):
+    """
+    Filtrar VMs y calcular opciones de filtro y facetas en una sola pasada
+    
+    Args:
+        vm_list: Lista completa de VMs
+        filters: Dict con filtros opcionales (vcenter, host, cluster, power_state, folder)
+        
+    Returns:
+        Dict con vms (filtradas), filter_options (valores únicos) y
+        facets (número de VMs por valor sobre el inventario completo)
+    """
+    facets = {option: {} for option in FACET_FIELDS}
+    vms = []
+    
+    for vm_info in vm_list:
+        for option, field in FACET_FIELDS.items():
+            value = vm_info.get(field, 'N/A')
+            if value == 'N/A' and option != 'power_states':
+                continue
+            counts = facets[option]
+            counts[value] = counts.get(value, 0) + 1
+        
+        if matches_filters(vm_info, filters):
+            vms.append(vm_info)
+    
+    filter_options = {option: sorted(counts) for option, counts in facets.items()}
+    
+    return {
+        'vms': vms,
+        'filter_options': filter_options,
+        'facets': facets
+    }
+
+
+class AmbiguousVMNameError(Exception):
+    """Varias VMs comparten el nombre buscado"""
+    
+    def __init__(self, name, morefs):
+        self.name = name
+        self.morefs = morefs
+        super().__init__(
+            f"Nombre de VM ambiguo: {name} ({len(morefs)} VMs: {', '.join(morefs)})"
+        )
+
+
+class InventorySnapshot:
+    """Copia en memoria de las propiedades del inventario indexada por MoRef"""
+    
+    def __init__(self):
+        # moId -> {'obj': referencia, 'props': {ruta: valor}}
+        self._objects = {}
+        # Nombre de VM -> set de moId (los nombres no son únicos en vCenter)
+        self._vm_names = {}
+        self._vm_list = None
+    
+    def __len__(self):
+        return len(self._objects)
+    
+    def apply(self, obj, props):
+        """
+        Añadir o actualizar las propiedades de un objeto
+        
+        Args:
+            obj: Referencia al objeto gestionado
+            props: Dict {ruta de propiedad: valor}
+        """
+        entry = self._objects.setdefault(obj._moId, {'obj': obj, 'props': {}})
+        
+        if 'name' in props and isinstance(obj, vim.VirtualMachine):
+            self._unindex_vm(obj._moId, entry['props'].get('name'))
+            self._vm_names.setdefault(props['name'], set()).add(obj._moId)
+        
+        entry['props'].update(props)
+        self._vm_list = None
+    
+    def remove(self, obj):
+        """
+        Eliminar un objeto del snapshot
+        
+        Args:
+            obj: Referencia al objeto gestionado
+        """
+        entry = self._objects.pop(obj._moId, None)
+        if entry is not None:
+            self._unindex_vm(obj._moId, entry['props'].get('name'))
+            self._vm_list = None
+    
+    def _unindex_vm(self, moid, name):
+        """Quitar un moId del índice de nombres"""
+        morefs = self._vm_names.get(name)
+        if not morefs:
+            return
+        
+        morefs.discard(moid)
+        if not morefs:
+            del self._vm_names[name]
+    
+    def get_object(self, moid):
+        """
+        Obtener la referencia a un objeto por su MoRef
+        
+        Args:
+            moid: Identificador del objeto (ej: vm-123)
+        
+        Returns:
+            Referencia al objeto gestionado o None
+        """
+        entry = self._objects.get(moid)
+        return entry['obj'] if entry else None
+    
+    def find_vm(self, name):
+        """
+        Buscar una VM por nombre en el índice
+        
+        Args:
+            name: Nombre de la VM
+        
+        Returns:
+            Referencia a la VM o None si no existe
+        
+        Raises:
+            AmbiguousVMNameError: Si varias VMs tienen ese nombre
+        """
+        morefs = self._vm_names.get(name)
+        if not morefs:
+            return None
+        
+        if len(morefs) > 1:
+            raise AmbiguousVMNameError(name, sorted(morefs))
+        
+        return self._objects[next(iter(morefs))]['obj']
+    
+    def apply_update_set(self, update_set):
+        """
+        Aplicar un UpdateSet de WaitForUpdatesEx
+        
+        Args:
+            update_set: vmodl.query.PropertyCollector.UpdateSet
+        
+        Returns:
+            int: Número de objetos modificados
+        """
+        changed = 0
+        
+        for filter_update in update_set.filterSet or []:
+            for obj_update in filter_update.objectSet or []:
+                changed += 1
+                
+                if obj_update.kind == 'leave':
+                    self.remove(obj_update.obj)
+                    continue
+                
+                props = {}
+                removed = []
+                for change in obj_update.changeSet or []:
+                    if change.op in ('remove', 'indirectRemove'):
+                        removed.append(change.name)
+                    else:
+                        props[change.name] = change.val
+                
+                self.apply(obj_update.obj, props)
+                
+                entry = self._objects[obj_update.obj._moId]
+                for name in removed:
+                    entry['props'].pop(name, None)
+        
+        return changed
+    
+    def _name_of(self, ref):
+        """Nombre de un objeto referenciado o 'N/A' si no está en el snapshot"""
+        if ref is None:
+            return 'N/A'
+        
+        entry = self._objects.get(ref._moId)
+        if not entry:
+            return 'N/A'
+        
+        return entry['props'].get('name', 'N/A')
+    
+    def _cluster_of(self, host_ref):
+        """Nombre del cluster de un host o 'N/A' si es standalone"""
+        if host_ref is None:
+            return 'N/A'
+        
+        host_entry = self._objects.get(host_ref._moId)
+        if not host_entry:
+            return 'N/A'
+        
+        parent = host_entry['props'].get('parent')
+        if isinstance(parent, vim.ClusterComputeResource):
+            return self._name_of(parent)
+        
+        return 'N/A'
+    
+    def _build_vm_info(self, moid, props):
+        """Construir el dict de una VM a partir de sus propiedades"""
+        hardware = props.get('config.hardware')
+        has_config = hardware is not None
+        host_ref = props.get('runtime.host')
+        
+        vm_info = {
+            'name': props['name'],
+            'power_state': props.get('runtime.powerState'),
+            'host': self._name_of(host_ref),
+            'folder': self._name_of(props.get('parent')),
+            'guest_os': props.get('config.guestFullName') if has_config else 'N/A',
+            'num_cpu': hardware.numCPU if has_config else 0,
+            'memory_mb': hardware.memoryMB if has_config else 0,
+            'annotation': props.get('config.annotation') or ''
+        }
+        
+        vm_info['cluster'] = self._cluster_of(host_ref)
+        vm_info['datastores'] = sorted(
+            self._name_of(ds_ref) for ds_ref in (props.get('datastore') or [])
+        )
+        
+        total_storage_gb = 0
+        if has_config and hardware.device:
+            for device in hardware.device:
+                if isinstance(device, vim.vm.device.VirtualDisk):
+                    total_storage_gb += device.capacityInBytes / (1024**3)
+        
+        vm_info['storage_gb'] = round(total_storage_gb, 2)
+        vm_info['moref'] = moid
+        
+        return vm_info
+    
+    def vm_list(self):
+        """
+        Construir la lista de VMs con metadatos (se reutiliza mientras no cambie el snapshot)
+        
+        Returns:
+            Lista de diccionarios con información de VMs
+        """
+        if self._vm_list is not None:
+            return self._vm_list
+        
+        vm_list = []
+        
+        for moid, entry in self._objects.items():
+            if not isinstance(entry['obj'], vim.VirtualMachine):
+                continue
+            
+            try:
+                vm_list.append(self._build_vm_info(moid, entry['props']))
+            except Exception as e:
+                logger.warning(f"Error procesando VM: {str(e)}")
+                continue
+        
+        self._vm_list = vm_list
+        return vm_list
+
+
+class PropertyCollectorFeed:
+    """
+    Flujo de actualizaciones del inventario basado en WaitForUpdatesEx
+    
+    Usa un PropertyCollector propio con un filtro sobre el ContainerView del
+    inventario; la primera llamada (versión vacía) devuelve el estado completo
+    y las siguientes solo los cambios desde la versión indicada.
+    """
+    
+    def __init__(self, content, page_size=PROPERTY_PAGE_SIZE):
+        """
+        Args:
+            content: ServiceContent de vCenter
+            page_size: Máximo de objetos por respuesta de WaitForUpdatesEx
+        """
+        self.content = content
+        self.page_size = page_size
+        self._collector = None
+        self._view = None
+        self._filter = None
+    
+    def _ensure_filter(self):
+        """Crear collector, ContainerView y filtro si no existen"""
+        if self._filter:
+            return
+        
+        self._collector = self.content.propertyCollector.CreatePropertyCollector()
+        self._view = create_inventory_view(self.content)
+        self._filter = self._collector.CreateFilter(
+            build_filter_spec(self._view), partialUpdates=False
+        )
+    
+    def load(self):
+        """
+        Obtener el estado completo del inventario
+        
+        Returns:
+            Tupla (InventorySnapshot, versión)
+        """
+        self.close()
+        self._ensure_filter()
+        
+        snapshot = InventorySnapshot()
+        update_sets, version = self.poll('')
+        for update_set in update_sets:
+            snapshot.apply_update_set(update_set)
+        
+        return snapshot, version
+    
+    def poll(self, version, max_wait=0):
+        """
+        Obtener los cambios desde una versión
+        
+        Args:
+            version: Versión devuelta por la llamada anterior ('' para estado completo)
+            max_wait: Segundos máximos de espera si no hay cambios
+            
+        Returns:
+            Tupla (lista de UpdateSet, nueva versión)
+        """
+        self._ensure_filter()
+        
+        options = PropertyCollector.WaitOptions(
+            maxWaitSeconds=max_wait,
+            maxObjectUpdates=self.page_size
+        )
+        
+        update_sets = []
+        while True:
+            update_set = self._collector.WaitForUpdatesEx(version, options)
+            if update_set is None:
+                break
+            
+            update_sets.append(update_set)
+            version = update_set.version
+            
+            # Respuesta truncada: quedan cambios pendientes
+            if not update_set.truncated:
+                break
+        
+        return update_sets, version
+    
+    def close(self):
+        """Destruir filtro, ContainerView y collector"""
+        for obj in (self._filter, self._view, self._collector):
+            if obj is None:
+                continue
+            try:
+                if isinstance(obj, PropertyCollector.Filter):
+                    obj.DestroyPropertyFilter()
+                elif isinstance(obj, PropertyCollector):
+                    obj.DestroyPropertyCollector()
+                else:
+                    obj.Destroy()
+            except Exception as e:
+                logger.debug(f"Error liberando objeto de inventario: {str(e)}")
+        
+        self._collector = None
+        self._view = None
+        self._filter = None
+
+
+class InventoryCache:
+    """
+    Caché en memoria del inventario con TTL y refresco incremental
+    
+    El snapshot se carga una vez y, cuando supera el TTL, se actualiza con los
+    cambios del flujo de actualizaciones en lugar de recorrer todo el inventario.
+    El flujo se crea con feed_factory, por lo que puede sustituirse por uno
+    simulado que implemente load(), poll(version) y close().
+    """
+    
+    def __init__(self, feed_factory, ttl=DEFAULT_INVENTORY_TTL):
+        """
+        Args:
+            feed_factory: Callable que devuelve un flujo de actualizaciones
+            ttl: Segundos durante los que el snapshot se considera vigente
+        """
+        self._feed_factory = feed_factory
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._feed = None
+        self._snapshot = None
+        self._version = None
+        self._synced_at = 0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'incremental_syncs': 0,
+            'full_loads': 0,
+            'objects_updated': 0
+        }
+    
+    def _load(self):
+        """Cargar el snapshot completo desde el flujo"""
+        if self._feed is None:
+            self._feed = self._feed_factory()
+        
+        start_time = time.time()
+        self._snapshot, self._version = self._feed.load()
+        self._synced_at = time.time()
+        self.stats['full_loads'] += 1
+        
+        logger.info(
+            f"Caché de inventario cargada: {len(self._snapshot)} objetos "
+            f"en {time.time() - start_time:.2f}s"
+        )
+    
+    def _sync(self):
+        """Aplicar los cambios pendientes; recarga completa si falla"""
+        try:
+            update_sets, version = self._feed.poll(self._version)
+            for update_set in update_sets:
+                self.stats['objects_updated'] += self._snapshot.apply_update_set(update_set)
+            self._version = version
+            self._synced_at = time.time()
+            self.stats['incremental_syncs'] += 1
+        except Exception as e:
+            logger.warning(f"Error en refresco incremental, recargando inventario: {str(e)}")
+            self.close()
+            self._load()
+    
+    def snapshot(self):
+        """
+        Obtener el snapshot vigente
+        
+        Returns:
+            InventorySnapshot
+        """
+        with self._lock:
+            if self._snapshot is None:
+                self.stats['misses'] += 1
+                self._load()
+            elif time.time() - self._synced_at > self.ttl:
+                self.stats['stale'] += 1
+                self._sync()
+            else:
+                self.stats['hits'] += 1
+            
+            return self._snapshot
+    
+    def find_vm(self, name):
+        """
+        Buscar una VM por nombre en el snapshot vigente
+        
+        Si no se encuentra se sincronizan los cambios pendientes y se reintenta,
+        para cubrir VMs creadas o renombradas dentro del TTL.
+        
+        Args:
+            name: Nombre de la VM
+        
+        Returns:
+            Referencia a la VM o None si no existe
+        
+        Raises:
+            AmbiguousVMNameError: Si varias VMs tienen ese nombre
+        """
+        with self._lock:
+            vm = self.snapshot().find_vm(name)
+            if vm is None:
+                self.mark_stale()
+                vm = self.snapshot().find_vm(name)
+            return vm
+    
+    def get_vm(self, moid):
+        """
+        Buscar una VM por MoRef en el snapshot vigente (con el mismo reintento
+        que find_vm para VMs creadas dentro del TTL)
+        
+        Args:
+            moid: MoRef de la VM (ej: vm-123)
+        
+        Returns:
+            Referencia a la VM o None si no existe
+        """
+        with self._lock:
+            vm = self.snapshot().get_object(moid)
+            if vm is None:
+                self.mark_stale()
+                vm = self.snapshot().get_object(moid)
+            return vm if isinstance(vm, vim.VirtualMachine) else None
+    
+    def vm_list(self):
+        """
+        Obtener la lista de VMs desde el snapshot vigente
+        
+        Returns:
+            Lista de diccionarios con información de VMs
+        """
+        with self._lock:
+            return self.snapshot().vm_list()
+    
+    def refresh(self):
+        """Forzar la recarga completa del inventario"""
+        with self._lock:
+            self.close()
+            self._load()
+    
+    def mark_stale(self):
+        """Forzar un refresco incremental en el próximo acceso"""
+        with self._lock:
+            self._synced_at = 0
+    
+    def get_stats(self):
+        """
+        Obtener contadores de la caché
+        
+        Returns:
+            Dict con contadores, antigüedad y tamaño del snapshot
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['ttl'] = self.ttl
+            stats['loaded'] = self._snapshot is not None
+            stats['objects'] = len(self._snapshot) if self._snapshot is not None else 0
+            stats['age_seconds'] = round(time.time() - self._synced_at, 1) if self._snapshot is not None else None
+            return stats
+    
+    def close(self):
+        """Liberar el flujo de actualizaciones y descartar el snapshot"""
+        with self._lock:
+            if self._feed is not None:
+                self._feed.close()
+                self._feed = None
+            self._snapshot = None
+            self._version = None
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Job Store - Persistencia de trabajos de exportación en SQLite
+Guarda cola e historial en una base de datos en modo WAL para que
+sobrevivan a un reinicio, con consultas indexadas por estado, VM y fecha
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Días de historial que se conservan por defecto (0 = sin límite)
+DEFAULT_HISTORY_DAYS = 30
+
+# Máximo de trabajos devueltos por una consulta
+MAX_QUERY_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    vm_name TEXT NOT NULL,
+    vcenter TEXT,
+    status TEXT NOT NULL,
+    submitted_at TEXT NOT NULL,
+    finished_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, submitted_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_vm_name ON jobs (vm_name, submitted_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at);
+"""
+
+
+class JobStore:
+    """
+    Almacén de trabajos en SQLite (thread-safe)
+    
+    Cada trabajo se guarda completo como JSON junto con las columnas por las
+    que se consulta. Un trabajo está terminado cuando tiene finished_at; los
+    que no lo tienen al arrancar quedaron interrumpidos.
+    """
+    
+    def __init__(self, path):
+        """
+        Args:
+            path: Ruta del archivo de base de datos
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        
+        with self._lock:
+            # WAL: las lecturas de /api/status no bloquean las escrituras de los workers
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+    
+    def save(self, job):
+        """
+        Insertar o actualizar un trabajo
+        
+        Args:
+            job: Dict del trabajo (con id, vm_name, status y submitted_at)
+        """
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO jobs (id, vm_name, vcenter, status, submitted_at, finished_at, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    status = excluded.status,
+                    finished_at = excluded.finished_at,
+                    data = excluded.data
+                """,
+                (
+                    job['id'],
+                    job['vm_name'],
+                    job.get('vcenter'),
+                    job['status'],
+                    job['submitted_at'],
+                    job.get('finished_at'),
+                    json.dumps(job, default=str)
+                )
+            )
+            self._conn.commit()
+    
+    def delete(self, job_ids):
+        """Eliminar trabajos (pendientes descartados de la cola)"""
+        if not job_ids:
+            return
+        
+        with self._lock:
+            self._conn.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in job_ids])
+            self._conn.commit()
+    
+    def _select(self, where, params, order, limit=None):
+        """Ejecutar una consulta y devolver los trabajos decodificados"""
+        sql = f"SELECT data FROM jobs WHERE {' AND '.join(where) or '1'} ORDER BY {order}"
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params = list(params) + [limit]
+        
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        
+        return [json.loads(row['data']) for row in rows]
+    
+    def unfinished(self):
+        """
+        Trabajos sin terminar (pendientes o interrumpidos), en orden de llegada
+        
+        Returns:
+            Lista de dicts de trabajos
+        """
+        return self._select(['finished_at IS NULL'], [], 'submitted_at, rowid')
+    
+    def get(self, job_id):
+        """
+        Buscar un trabajo por ID
+        
+        Returns:
+            Dict del trabajo o None si no existe
+        """
+        jobs = self._select(['id = ?'], [job_id], 'id', 1)
+        return jobs[0] if jobs else None
+    
+    def history(self, limit=10):
+        """
+        Últimos trabajos terminados
+        
+        Args:
+            limit: Número de trabajos
+        
+        Returns:
+            Lista de dicts en orden cronológico
+        """
+        jobs = self._select(['finished_at IS NOT NULL'], [], 'finished_at DESC', limit)
+        jobs.reverse()
+        return jobs
+    
+    def query(self, status=None, vm_name=None, since=None, until=None, limit=100):
+        """
+        Buscar trabajos por estado, VM y fecha de envío
+        
+        Args:
+            status: Estado exacto (ej: failed)
+            vm_name: Nombre de la VM
+            since: Fecha ISO mínima de envío
+            until: Fecha ISO máxima de envío
+            limit: Máximo de resultados (hasta MAX_QUERY_LIMIT)
+        
+        Returns:
+            Lista de dicts, del más reciente al más antiguo
+        """
+        where = []
+        params = []
+        
+        for column, value in (('status', status), ('vm_name', vm_name)):
+            if value:
+                where.append(f'{column} = ?')
+                params.append(value)
+        
+        if since:
+            where.append('submitted_at >= ?')
+            params.append(since)
+        if until:
+            where.append('submitted_at <= ?')
+            params.append(until)
+        
+        limit = max(1, min(int(limit), MAX_QUERY_LIMIT))
+        return self._select(where, params, 'submitted_at DESC', limit)
+    
+    def prune(self, days=DEFAULT_HISTORY_DAYS):
+        """
+        Borrar trabajos terminados hace más de days días
+        
+        Returns:
+            int: Número de trabajos borrados
+        """
+        if not days:
+            return 0
+        
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        
+        with self._lock:
+            cursor = self._conn.execute(
+                'DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (cutoff,)
+            )
+            self._conn.commit()
+        
+        if cursor.rowcount:
+            logger.info(f"Historial de trabajos: {cursor.rowcount} entradas de más de {days} días borradas")
+        return cursor.rowcount
+    
+    def close(self):
+        """Cerrar la base de datos"""
+        with self._lock:
+            self._conn.close()
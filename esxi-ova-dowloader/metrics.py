@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Metrics - Métricas de exportación en formato de texto de Prometheus
+Contadores, gauges e histogramas mínimos (sin dependencias) para /metrics:
+bytes descargados, duración de cada fase de la exportación (espera del
+lease, apagado, descarga, finalización) y llamadas SOAP a vCenter
+"""
+
+import logging
+import threading
+import time
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Content-Type del formato de texto de Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Buckets (segundos) de las fases de una exportación: de segundos a horas
+PHASE_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+
+# Buckets (segundos) de las llamadas SOAP
+SOAP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    """Escapar el valor de una etiqueta"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    """Formatear etiquetas como {a="1",b="2"} (vacío si no hay)"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    """Formatear un valor numérico"""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_metric(name, metric_type, help_text, samples):
+    """
+    Formatear una métrica en el formato de texto de Prometheus
+
+    Args:
+        name: Nombre de la métrica
+        metric_type: counter, gauge o histogram
+        help_text: Descripción
+        samples: Lista de tuplas (sufijo, etiquetas [(nombre, valor)], valor)
+
+    Returns:
+        Lista de líneas
+    """
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+    for suffix, labels, value in samples:
+        lines.append(f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+    return lines
+
+
+class _Metric:
+    """Base de las métricas con etiquetas (thread-safe)"""
+
+    metric_type = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        """Valores de las etiquetas en el orden declarado"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: etiquetas {sorted(labels)}, se esperaban {list(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def remove(self, **labels):
+        """Quitar una serie (ej: trabajo terminado)"""
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def _samples(self):
+        """Tuplas (sufijo, etiquetas, valor) de todas las series"""
+        with self._lock:
+            return [
+                ('', list(zip(self.labelnames, key)), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+    def render(self):
+        """Líneas de texto de la métrica"""
+        return format_metric(self.name, self.metric_type, self.help, self._samples())
+
+
+class Counter(_Metric):
+    """Contador monótono"""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Valor que sube y baja"""
+
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Histograma con buckets acumulados, suma y número de observaciones"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=PHASE_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items())
+
+        samples = []
+        for key, (counts, total, count) in items:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', labels + [('le', _format_value(float(bound)))], cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas y colectores
+
+    Los colectores son callables que devuelven, en cada petición a
+    /metrics, métricas calculadas al vuelo (cola, workers...) como
+    tuplas (nombre, tipo, ayuda, [(etiquetas dict, valor)]).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        """Registrar una métrica y devolverla"""
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Registrar un colector de métricas calculadas al vuelo"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """
+        Exposición completa en formato de texto de Prometheus
+
+        Returns:
+            str terminado en salto de línea
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        for collector in collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                logger.warning(f"Error en colector de métricas: {str(e)}")
+                continue
+
+            for name, metric_type, help_text, series in collected:
+                samples = [('', sorted(labels.items()), value) for labels, value in series]
+                lines.extend(format_metric(name, metric_type, help_text, samples))
+
+        return '\n'.join(lines) + '\n'
+
+
+# Registro por defecto de la aplicación
+REGISTRY = MetricsRegistry()
+
+EXPORT_BYTES = REGISTRY.register(Counter(
+    'ova_export_bytes_total',
+    'Bytes descargados de los hosts ESXi (sin contar los reanudados)',
+    ['host']
+))
+
+EXPORT_PHASE_SECONDS = REGISTRY.register(Histogram(
+    'ova_export_phase_seconds',
+    'Duración de cada fase de una exportación: queue_wait, poweroff, lease_wait, download, finalize y total',
+    ['phase'],
+    PHASE_BUCKETS
+))
+
+EXPORTS_TOTAL = REGISTRY.register(Counter(
+    'ova_exports_total',
+    'Exportaciones terminadas por estado final',
+    ['status']
+))
+
+SOAP_CALLS = REGISTRY.register(Counter(
+    'vcenter_soap_calls_total',
+    'Llamadas SOAP a vCenter por método (kind=property para lecturas de propiedades)',
+    ['vcenter', 'method', 'kind']
+))
+
+SOAP_ERRORS = REGISTRY.register(Counter(
+    'vcenter_soap_errors_total',
+    'Llamadas SOAP a vCenter que terminaron en excepción',
+    ['vcenter', 'method', 'kind']
+))
+
+SOAP_SECONDS = REGISTRY.register(Histogram(
+    'vcenter_soap_call_seconds',
+    'Latencia de las llamadas SOAP a vCenter',
+    ['vcenter', 'method', 'kind'],
+    SOAP_BUCKETS
+))
+
+
+def observe_phase(phase, seconds):
+    """Registrar la duración de una fase de exportación"""
+    EXPORT_PHASE_SECONDS.observe(max(0.0, seconds), phase=phase)
+
+
+def instrument_stub(stub, vcenter):
+    """
+    Medir las llamadas SOAP de un stub de pyVmomi
+
+    Envuelve InvokeMethod (métodos de objetos gestionados) e InvokeAccessor
+    (lecturas de propiedades) de la instancia; el re-login del
+    VimSessionOrientedStub queda dentro de la llamada medida.
+
+    Args:
+        stub: Stub de pyVmomi (VimSessionOrientedStub o SoapStubAdapter)
+        vcenter: Host del vCenter (etiqueta)
+
+    Returns:
+        El mismo stub
+    """
+    def timed(call, kind):
+        @wraps(call)
+        def wrapper(mo, info, *args):
+            labels = {'vcenter': vcenter, 'method': getattr(info, 'name', 'unknown'), 'kind': kind}
+            started = time.monotonic()
+            try:
+                return call(mo, info, *args)
+            except Exception:
+                SOAP_ERRORS.inc(**labels)
+                raise
+            finally:
+                SOAP_CALLS.inc(**labels)
+                SOAP_SECONDS.observe(time.monotonic() - started, **labels)
+        return wrapper
+
+    stub.InvokeMethod = timed(stub.InvokeMethod, 'method')
+    stub.InvokeAccessor = timed(stub.InvokeAccessor, 'property')
+    return stub
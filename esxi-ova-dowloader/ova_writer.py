@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OVA Writer - Escritura del OVA en streaming
+Calcula de antemano la disposición del tar a partir de los tamaños conocidos
+de los archivos, escribe las cabeceras y permite que cada descarga escriba
+directamente en la posición de su miembro dentro del archivo final
+"""
+
+import logging
+import os
+import tarfile
+import time
+from file_regions import preallocate_file
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = tarfile.BLOCKSIZE  # 512 bytes
+
+
+def _padded(size):
+    """Tamaño redondeado al siguiente múltiplo de bloque tar"""
+    remainder = size % BLOCK_SIZE
+    return size if remainder == 0 else size + BLOCK_SIZE - remainder
+
+
+def tar_header(name, size, mtime):
+    """
+    Cabecera tar de un miembro
+    
+    Args:
+        name: Nombre del miembro
+        size: Tamaño en bytes
+        mtime: Fecha de modificación (epoch)
+    
+    Returns:
+        bytes con la cabecera (uno o más bloques)
+    """
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, 'surrogateescape')
+
+
+class StreamingOvaWriter:
+    """
+    Archivo OVA (tar) con disposición fija calculada antes de descargar
+    
+    Los miembros se colocan en el orden indicado (el descriptor OVF debe ir
+    primero). El archivo se reserva con su tamaño final y las zonas de
+    relleno quedan a cero, por lo que basta con escribir las cabeceras y los
+    datos de cada miembro en su desplazamiento.
+    """
+    
+    def __init__(self, path, members, mtime=None):
+        """
+        Args:
+            path: Ruta del archivo OVA en construcción
+            members: Lista de tuplas (nombre, tamaño) en orden de archivo
+            mtime: Fecha de modificación de los miembros (por defecto ahora)
+        """
+        self.path = path
+        self.members = [(name, size) for name, size in members]
+        mtime = int(mtime if mtime is not None else time.time())
+        
+        self._headers = []
+        self._offsets = {}
+        offset = 0
+        
+        for name, size in self.members:
+            header = tar_header(name, size, mtime)
+            
+            self._headers.append((offset, header))
+            self._offsets[name] = offset + len(header)
+            offset += len(header) + _padded(size)
+        
+        # Fin de archivo: dos bloques a cero
+        self.total_size = offset + 2 * BLOCK_SIZE
+    
+    def layout(self):
+        """
+        Obtener la disposición del archivo para compararla entre intentos
+        
+        Returns:
+            Lista de [nombre, tamaño, desplazamiento de datos]
+        """
+        return [[name, size, self._offsets[name]] for name, size in self.members]
+    
+    def member_offset(self, name):
+        """
+        Desplazamiento de los datos de un miembro dentro del OVA
+        
+        Args:
+            name: Nombre del miembro
+        
+        Returns:
+            int: Posición del primer byte de datos
+        """
+        return self._offsets[name]
+    
+    def create(self, reuse=False):
+        """
+        Reservar el archivo y escribir las cabeceras tar
+        
+        Args:
+            reuse: Conservar los datos de un archivo existente con la misma disposición
+        """
+        if not (reuse and os.path.exists(self.path)):
+            preallocate_file(self.path, self.total_size)
+        
+        with open(self.path, 'r+b') as f:
+            f.truncate(self.total_size)
+            for offset, header in self._headers:
+                f.seek(offset)
+                f.write(header)
+        
+        logger.info(
+            f"OVA reservado: {os.path.basename(self.path)} "
+            f"({self.total_size / (1024*1024):.2f} MB, {len(self.members)} miembros)"
+        )
+    
+    def write_member(self, name, data):
+        """
+        Escribir el contenido completo de un miembro pequeño (descriptor, manifiesto)
+        
+        Args:
+            name: Nombre del miembro
+            data: bytes con el contenido (debe coincidir con el tamaño declarado)
+        """
+        size = dict(self.members)[name]
+        if len(data) != size:
+            raise ValueError(f"Tamaño de {name} distinto del declarado: {len(data)}/{size}")
+        
+        with open(self.path, 'r+b') as f:
+            f.seek(self._offsets[name])
+            f.write(data)
+
+
+class TarStreamWriter:
+    """
+    OVA (tar) escrito de forma secuencial sobre un destino con write()
+    
+    Para destinos que no admiten escritura posicional (stream comprimido):
+    cada miembro se escribe completo, cabecera y datos, antes del siguiente.
+    """
+    
+    def __init__(self, sink, mtime=None):
+        """
+        Args:
+            sink: Objeto con write() (ej: ParallelCompressedWriter)
+            mtime: Fecha de modificación de los miembros (por defecto ahora)
+        """
+        self.sink = sink
+        self.mtime = int(mtime if mtime is not None else time.time())
+        self._remaining = 0
+        self._padding = 0
+    
+    def begin_member(self, name, size):
+        """Escribir la cabecera de un miembro cuyo contenido sigue con write()"""
+        if self._remaining:
+            raise ValueError(f"Miembro anterior incompleto: faltan {self._remaining} bytes")
+        
+        self.sink.write(tar_header(name, size, self.mtime))
+        self._remaining = size
+        self._padding = _padded(size) - size
+    
+    def write(self, data):
+        """Escribir datos del miembro en curso"""
+        if len(data) > self._remaining:
+            raise IOError(f"Datos de más para el miembro: {len(data)}/{self._remaining} bytes")
+        
+        self.sink.write(data)
+        self._remaining -= len(data)
+    
+    def end_member(self):
+        """Cerrar el miembro en curso con el relleno hasta bloque tar"""
+        if self._remaining:
+            raise IOError(f"Miembro incompleto: faltan {self._remaining} bytes")
+        
+        if self._padding:
+            self.sink.write(bytes(self._padding))
+            self._padding = 0
+    
+    def add_member(self, name, data):
+        """Escribir un miembro completo en memoria (descriptor, manifiesto)"""
+        self.begin_member(name, len(data))
+        self.write(data)
+        self.end_member()
+    
+    def finish(self):
+        """Escribir el fin de archivo: dos bloques a cero"""
+        self.sink.write(bytes(2 * BLOCK_SIZE))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Property Waiter - Espera de cambios de propiedades con WaitForUpdatesEx
+Bloquea hasta que las propiedades vigiladas (estado de tareas, leases NFC o
+estado de energía de VMs) cambian en vCenter, en lugar de releerlas en un
+bucle con time.sleep: una sola llamada larga por lote de objetos y sin
+latencia añadida entre el cambio y su detección
+"""
+
+import logging
+import time
+from pyVmomi import vim, vmodl
+
+logger = logging.getLogger(__name__)
+
+PropertyCollector = vmodl.query.PropertyCollector
+
+# Estados finales de tareas y leases
+TASK_DONE_STATES = (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+LEASE_DONE_STATES = (vim.HttpNfcLease.State.ready, vim.HttpNfcLease.State.error)
+
+
+def build_watch_spec(watches):
+    """
+    Construir el FilterSpec para un conjunto de vigilancias
+    
+    Args:
+        watches: Lista de tuplas (objeto, propiedad, condición)
+    
+    Returns:
+        PropertyCollector.FilterSpec con un ObjectSpec por objeto y un
+        PropertySpec por tipo
+    """
+    paths_by_type = {}
+    for obj, path, _ in watches:
+        paths_by_type.setdefault(type(obj), set()).add(path)
+    
+    return PropertyCollector.FilterSpec(
+        objectSet=[PropertyCollector.ObjectSpec(obj=obj, skip=False) for obj, _, _ in watches],
+        propSet=[
+            PropertyCollector.PropertySpec(type=obj_type, pathSet=sorted(paths))
+            for obj_type, paths in paths_by_type.items()
+        ]
+    )
+
+
+class PropertyWaiter:
+    """
+    Espera compartida sobre propiedades de objetos de vCenter
+    
+    Cada llamada a wait() usa un PropertyCollector propio (creado con
+    CreatePropertyCollector y destruido al terminar) con un único filtro
+    sobre todos los objetos vigilados, de modo que varios hilos pueden
+    esperar a la vez sin interferir y un mismo lote de tareas, leases y VMs
+    se resuelve con una sola llamada bloqueante.
+    """
+    
+    def __init__(self, content):
+        """
+        Args:
+            content: ServiceContent de vCenter
+        """
+        self.content = content
+    
+    def wait(self, watches, timeout, on_done=None):
+        """
+        Esperar a que cada objeto cumpla la condición sobre su propiedad
+        
+        Args:
+            watches: Lista de tuplas (objeto, propiedad, condición(valor) -> bool)
+            timeout: Segundos máximos de espera
+            on_done: Callable(objeto, valor) invocado en cuanto un objeto cumple
+                     su condición; puede devolver objetos que ya no hace falta
+                     esperar (ej: la VM cuya tarea de apagado ha fallado)
+        
+        Returns:
+            Tupla (dict MoRef -> valor de los objetos que cumplieron la condición,
+            lista de objetos pendientes al vencer el timeout)
+        """
+        pending = {obj._moId: (obj, path, condition) for obj, path, condition in watches}
+        done = {}
+        
+        if not pending:
+            return done, []
+        
+        collector = self.content.propertyCollector.CreatePropertyCollector()
+        try:
+            collector.CreateFilter(build_watch_spec(list(pending.values())), partialUpdates=False)
+            
+            version = ''
+            deadline = time.monotonic() + timeout
+            
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                
+                # La primera llamada devuelve el estado actual; las siguientes, cambios
+                update_set = collector.WaitForUpdatesEx(
+                    version,
+                    PropertyCollector.WaitOptions(maxWaitSeconds=max(1, int(remaining)))
+                )
+                if update_set is None:
+                    continue
+                
+                version = update_set.version
+                for filter_update in update_set.filterSet:
+                    for object_update in filter_update.objectSet:
+                        moid = object_update.obj._moId
+                        for change in object_update.changeSet:
+                            entry = pending.get(moid)
+                            if entry is None or change.name != entry[1]:
+                                continue
+                            
+                            if entry[2](change.val):
+                                del pending[moid]
+                                done[moid] = change.val
+                                if on_done:
+                                    for dropped in on_done(entry[0], change.val) or ():
+                                        pending.pop(dropped._moId, None)
+        finally:
+            try:
+                collector.DestroyPropertyCollector()
+            except Exception as e:
+                logger.debug(f"Error liberando PropertyCollector: {str(e)}")
+        
+        return done, [obj for obj, _, _ in pending.values()]
+    
+    def wait_one(self, obj, path, condition, timeout):
+        """
+        Esperar a un único objeto
+        
+        Returns:
+            Valor de la propiedad si se cumplió la condición o None si venció el timeout
+        """
+        done, _ = self.wait([(obj, path, condition)], timeout)
+        return done.get(obj._moId)
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Session Pool - Pool de sesiones de vCenter con re-login automático
+Cada hilo que trabaja contra vCenter (exportaciones, apagados) toma su
+propia sesión SOAP en lugar de compartir una sola, las sesiones caducadas
+se renuevan de forma transparente al recibir NotAuthenticated y un hilo de
+fondo las mantiene vivas con llamadas baratas durante las exportaciones largas
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pyVim.connect import SmartStubAdapter, VimSessionOrientedStub
+from pyVmomi import SoapStubAdapter, vim
+from metrics import instrument_stub
+
+logger = logging.getLogger(__name__)
+
+# Sesiones de trabajo simultáneas como máximo (además de la principal)
+DEFAULT_POOL_SIZE = 4
+
+# Segundos de inactividad tras los que se refresca una sesión (vCenter
+# caduca las sesiones inactivas a los 30 minutos por defecto)
+DEFAULT_KEEPALIVE_INTERVAL = 600
+
+# Reintentos del stub ante errores de comunicación o de sesión
+SESSION_RETRY_COUNT = 3
+
+
+class PooledSession:
+    """
+    Sesión de vCenter con re-login automático
+    
+    Usa un VimSessionOrientedStub: si una llamada devuelve NotAuthenticated
+    (sesión caducada) vuelve a autenticarse y repite la llamada.
+    """
+    
+    def __init__(self, stub, name):
+        """
+        Args:
+            stub: VimSessionOrientedStub de la sesión
+            name: Nombre para logs y estadísticas
+        """
+        self.stub = stub
+        self.name = name
+        self.si = vim.ServiceInstance('ServiceInstance', stub)
+        self.content = self.si.RetrieveContent()
+        self.logins = 0
+        self.keepalives = 0
+        self.last_used = time.monotonic()
+    
+    @property
+    def cookie(self):
+        """Cookie de sesión SOAP vigente (cambia en cada re-login)"""
+        return self.stub.soapStub.cookie
+    
+    def bind(self, obj):
+        """
+        Obtener la referencia a un objeto gestionado ligada a esta sesión
+        
+        Los objetos de pyVmomi invocan sus métodos por el stub con el que se
+        obtuvieron; los del inventario en caché pertenecen a la sesión
+        principal y se re-ligan antes de usarlos en otro hilo.
+        
+        Args:
+            obj: Objeto gestionado (VirtualMachine, Task...)
+        
+        Returns:
+            Objeto del mismo tipo y MoRef sobre el stub de esta sesión
+        """
+        if obj is None or obj._stub is self.stub:
+            return obj
+        return type(obj)(obj._moId, self.stub)
+    
+    def ping(self):
+        """Llamada barata que renueva la inactividad de la sesión"""
+        self.si.CurrentTime()
+        self.keepalives += 1
+        self.last_used = time.monotonic()
+    
+    def logout(self):
+        """Cerrar la sesión en vCenter y sus conexiones"""
+        try:
+            if self.stub.state == VimSessionOrientedStub.STATE_AUTHENTICATED:
+                self.content.sessionManager.Logout()
+        except Exception as e:
+            logger.debug(f"Error cerrando sesión {self.name}: {str(e)}")
+        finally:
+            self.stub.DropConnections()
+
+
+class SessionPool:
+    """
+    Pool de sesiones de vCenter (thread-safe)
+    
+    La sesión principal se crea al abrir el pool (validando las credenciales)
+    y la usan las descargas NFC (cookie). Las sesiones de trabajo se crean
+    bajo demanda, hasta size, y cada hilo usa la suya mientras la tiene
+    reservada; session() es reentrante dentro de un mismo hilo. Las sesiones
+    dedicadas (ej: la del inventario) no cuentan para size y no se reservan:
+    su único usuario las serializa.
+    """
+    
+    def __init__(self, host, username, password, ssl_context=None, port=443,
+                 size=DEFAULT_POOL_SIZE, keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL,
+                 on_login=None):
+        """
+        Args:
+            host: Hostname o IP del vCenter
+            username: Usuario
+            password: Contraseña
+            ssl_context: Contexto SSL de las conexiones SOAP
+            port: Puerto HTTPS
+            size: Sesiones de trabajo como máximo
+            keepalive_interval: Segundos de inactividad antes de refrescar una
+                                sesión (0 = sin keep-alive)
+            on_login: Callable(sesión) invocado tras cada login o re-login
+        """
+        self.host = host
+        self.username = username
+        self.password = password
+        self.ssl_context = ssl_context
+        self.port = port
+        self.size = max(1, int(size))
+        self.keepalive_interval = keepalive_interval
+        self.on_login = on_login
+        self.primary = None
+        self._version = None
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = []
+        self._sessions = []
+        self._dedicated = {}
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._keepalive_thread = None
+    
+    def _create_session(self, name):
+        """Crear una sesión nueva; el login se hace al obtener su ServiceContent"""
+        if self._version is None:
+            # Negociar la versión de la API una sola vez
+            soap_stub = SmartStubAdapter(host=self.host, port=self.port, sslContext=self.ssl_context)
+            self._version = soap_stub.version
+        else:
+            soap_stub = SoapStubAdapter(
+                host=self.host, port=self.port, version=self._version, sslContext=self.ssl_context
+            )
+        
+        login = VimSessionOrientedStub.makeUserLoginMethod(self.username, self.password)
+        session = None
+        
+        def login_method(stub):
+            login(stub)
+            if session is not None:
+                session.logins += 1
+                logger.info(f"Sesión de vCenter {name} renovada")
+                if self.on_login:
+                    self.on_login(session)
+        
+        stub = VimSessionOrientedStub(soap_stub, login_method, retryCount=SESSION_RETRY_COUNT)
+        # Contar y medir las llamadas SOAP de la sesión (/metrics)
+        instrument_stub(stub, self.host)
+        session = PooledSession(stub, name)
+        session.logins = 1
+        if self.on_login:
+            self.on_login(session)
+        
+        return session
+    
+    def open(self):
+        """
+        Crear la sesión principal y arrancar el keep-alive
+        
+        Returns:
+            PooledSession principal
+        
+        Raises:
+            vim.fault.InvalidLogin: Si las credenciales no son válidas
+        """
+        self.primary = self._create_session('principal')
+        
+        if self.keepalive_interval:
+            self._keepalive_thread = threading.Thread(
+                target=self._keepalive_loop, name='vcenter-keepalive', daemon=True
+            )
+            self._keepalive_thread.start()
+        
+        return self.primary
+    
+    def dedicated(self, name):
+        """
+        Sesión propia de un consumidor de larga duración (se crea la primera vez)
+        
+        El inventario la usa para sus RetrievePropertiesEx y WaitForUpdatesEx,
+        que así no se encolan detrás de las llamadas de las exportaciones.
+        
+        Args:
+            name: Nombre de la sesión (uno por consumidor)
+        
+        Returns:
+            PooledSession
+        """
+        with self._lock:
+            session = self._dedicated.get(name)
+        if session is not None:
+            return session
+        
+        session = self._create_session(name)
+        with self._lock:
+            # Otro hilo pudo crearla a la vez: se conserva la primera
+            current = self._dedicated.setdefault(name, session)
+        if current is not session:
+            session.logout()
+        return current
+    
+    def current(self):
+        """Sesión reservada por el hilo actual o None"""
+        return getattr(self._local, 'session', None)
+    
+    def acquire(self):
+        """
+        Reservar una sesión de trabajo para el hilo actual
+        
+        Espera si todas las sesiones están ocupadas y ya hay size creadas.
+        
+        Returns:
+            PooledSession
+        """
+        session = self.current()
+        if session is not None:
+            self._local.depth += 1
+            return session
+        
+        with self._lock:
+            while not self._idle and len(self._sessions) >= self.size:
+                self._available.wait()
+            
+            if self._idle:
+                session = self._idle.pop()
+            else:
+                # Reservar el hueco antes de crear la sesión fuera del lock
+                self._sessions.append(None)
+        
+        if session is None:
+            try:
+                session = self._create_session(f'trabajo-{len(self._sessions)}')
+            except Exception:
+                with self._lock:
+                    self._sessions.remove(None)
+                    self._available.notify()
+                raise
+            
+            with self._lock:
+                self._sessions[self._sessions.index(None)] = session
+        
+        self._local.session = session
+        self._local.depth = 1
+        return session
+    
+    def release(self, session):
+        """Devolver la sesión del hilo actual al pool"""
+        if self.current() is not session:
+            return
+        
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        
+        self._local.session = None
+        session.last_used = time.monotonic()
+        
+        with self._lock:
+            if session in self._sessions:
+                self._idle.append(session)
+                self._available.notify()
+    
+    @contextmanager
+    def session(self):
+        """
+        Usar una sesión de trabajo durante un bloque
+        
+        Yields:
+            PooledSession
+        """
+        session = self.acquire()
+        try:
+            yield session
+        finally:
+            self.release(session)
+    
+    def _keepalive_loop(self):
+        """Refrescar las sesiones libres que llevan keepalive_interval sin usarse"""
+        while not self._stop.wait(min(60, self.keepalive_interval)):
+            now = time.monotonic()
+            
+            with self._lock:
+                stale = [s for s in self._idle if now - s.last_used >= self.keepalive_interval]
+                for session in stale:
+                    self._idle.remove(session)
+            
+                # Principal y dedicadas no se reservan: ping directamente
+                shared = [self.primary] if self.primary else []
+                shared.extend(self._dedicated.values())
+            
+            stale.extend(s for s in shared if now - s.last_used >= self.keepalive_interval)
+            
+            for session in stale:
+                try:
+                    session.ping()
+                except Exception as e:
+                    logger.warning(f"Error en keep-alive de la sesión {session.name}: {str(e)}")
+                finally:
+                    if session not in shared:
+                        with self._lock:
+                            if session in self._sessions:
+                                self._idle.append(session)
+                                self._available.notify()
+    
+    def get_stats(self):
+        """
+        Obtener contadores del pool
+        
+        Returns:
+            Dict con tamaño, sesiones creadas, ocupadas, logins y keep-alives
+        """
+        with self._lock:
+            sessions = [s for s in self._sessions if s is not None]
+            sessions.extend(self._dedicated.values())
+            if self.primary:
+                sessions.append(self.primary)
+            
+            return {
+                'size': self.size,
+                'created': len(self._sessions),
+                'dedicated': sorted(self._dedicated),
+                'idle': len(self._idle),
+                'in_use': len(self._sessions) - len(self._idle),
+                'logins': sum(s.logins for s in sessions),
+                'keepalives': sum(s.keepalives for s in sessions),
+                'keepalive_interval': self.keepalive_interval
+            }
+    
+    def close(self):
+        """Parar el keep-alive y cerrar todas las sesiones"""
+        self._stop.set()
+        
+        with self._lock:
+            sessions = [s for s in self._sessions if s is not None]
+            sessions.extend(self._dedicated.values())
+            self._sessions = []
+            self._idle = []
+            self._dedicated = {}
+            self._available.notify_all()
+        
+        if self.primary:
+            sessions.append(self.primary)
+            self.primary = None
+        
+        for session in sessions:
+            session.logout()
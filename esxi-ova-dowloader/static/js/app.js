@@ -4,14 +4,18 @@
 const app = {
     connected: false,
     vms: [],
-    selectedVms: new Set(),
+    selectedVms: new Map(),  // "vcenter/nombre" -> {vm_name, vcenter}
+    vcenters: [],
     filters: {
+        vcenter: '',
         host: '',
         cluster: '',
         power_state: '',
         folder: ''
     },
-    statusInterval: null
+    statusInterval: null,
+    eventSource: null,
+    status: null
 };
 
 // Inicialización
@@ -27,11 +31,12 @@ function initializeEventListeners() {
     document.getElementById('disconnectBtn').addEventListener('click', handleDisconnect);
     
     // Filtros
+    document.getElementById('filterVcenter').addEventListener('change', applyFilters);
     document.getElementById('filterHost').addEventListener('change', applyFilters);
     document.getElementById('filterCluster').addEventListener('change', applyFilters);
     document.getElementById('filterPowerState').addEventListener('change', applyFilters);
     document.getElementById('filterFolder').addEventListener('change', applyFilters);
-    document.getElementById('refreshBtn').addEventListener('click', loadVMs);
+    document.getElementById('refreshBtn').addEventListener('click', handleRefresh);
     
     // Selección
     document.getElementById('selectAll').addEventListener('change', handleSelectAll);
@@ -39,6 +44,8 @@ function initializeEventListeners() {
     // Exportación
     document.getElementById('exportBtn').addEventListener('click', handleExport);
     document.getElementById('cancelBtn').addEventListener('click', handleCancel);
+    document.getElementById('activeItems').addEventListener('click', handleCancelJob);
+    document.getElementById('queueItems').addEventListener('click', handleCancelJob);
 }
 
 // Conexión a vCenter
@@ -74,14 +81,11 @@ async function handleConnect(event) {
             showStatus(statusDiv, data.message, 'success');
             app.connected = true;
             
-            // Mostrar botón de desconectar
-            document.getElementById('connectBtn').style.display = 'none';
+            // Mostrar botón de desconectar; el formulario sigue activo para añadir otro vCenter
             document.getElementById('disconnectBtn').style.display = 'inline-block';
-            
-            // Deshabilitar campos del formulario
-            document.getElementById('vcenterHost').disabled = true;
-            document.getElementById('username').disabled = true;
-            document.getElementById('password').disabled = true;
+            document.getElementById('vcenterHost').value = '';
+            document.getElementById('password').value = '';
+            updateVcenterList(data.vcenters || []);
             
             // Cargar VMs
             await loadVMs();
@@ -117,13 +121,10 @@ async function handleDisconnect() {
             app.connected = false;
             app.vms = [];
             app.selectedVms.clear();
+            updateVcenterList([]);
             
             // Resetear UI
-            document.getElementById('connectBtn').style.display = 'inline-block';
             document.getElementById('disconnectBtn').style.display = 'none';
-            document.getElementById('vcenterHost').disabled = false;
-            document.getElementById('username').disabled = false;
-            document.getElementById('password').disabled = false;
             document.getElementById('password').value = '';
             
             document.getElementById('vmPanel').style.display = 'none';
@@ -141,6 +142,20 @@ async function handleDisconnect() {
     }
 }
 
+// Mostrar los vCenters conectados
+function updateVcenterList(vcenters) {
+    app.vcenters = vcenters;
+    
+    const listDiv = document.getElementById('vcenterList');
+    listDiv.style.display = vcenters.length > 0 ? 'block' : 'none';
+    listDiv.textContent = `vCenters conectados: ${vcenters.join(', ')}`;
+}
+
+// Clave de selección: los nombres de VM pueden repetirse entre vCenters
+function vmKey(vm) {
+    return `${vm.vcenter}/${vm.name}`;
+}
+
 // Cargar VMs
 async function loadVMs() {
     if (!app.connected) return;
@@ -152,6 +167,7 @@ async function loadVMs() {
     try {
         // Construir query string con filtros
         const params = new URLSearchParams();
+        if (app.filters.vcenter) params.append('vcenter', app.filters.vcenter);
         if (app.filters.host) params.append('host', app.filters.host);
         if (app.filters.cluster) params.append('cluster', app.filters.cluster);
         if (app.filters.power_state) params.append('power_state', app.filters.power_state);
@@ -162,9 +178,20 @@ async function loadVMs() {
         
         if (data.success) {
             app.vms = data.vms;
+            updateVcenterList(data.vcenters || app.vcenters);
+            
+            // vCenters que fallaron o no respondieron a tiempo
+            const failed = Object.entries(data.errors || {});
+            if (failed.length > 0) {
+                showStatus(
+                    document.getElementById('connectionStatus'),
+                    failed.map(([host, error]) => `${host}: ${error}`).join(' | '),
+                    'error'
+                );
+            }
             
             // Actualizar opciones de filtros
-            updateFilterOptions(data.filter_options);
+            updateFilterOptions(data.filter_options, data.facets || {});
             
             // Renderizar tabla
             renderVMTable();
@@ -180,15 +207,38 @@ async function loadVMs() {
     }
 }
 
+// Forzar recarga del inventario en el servidor
+async function handleRefresh() {
+    if (!app.connected) return;
+    
+    try {
+        const response = await fetch('/api/inventory/refresh', {
+            method: 'POST'
+        });
+        
+        const data = await response.json();
+        
+        if (!data.success) {
+            alert(`Error recargando inventario: ${data.error}`);
+        }
+        
+    } catch (error) {
+        console.error('Error recargando inventario:', error);
+    }
+    
+    await loadVMs();
+}
+
 // Actualizar opciones de filtros
-function updateFilterOptions(options) {
-    updateSelectOptions('filterHost', options.hosts);
-    updateSelectOptions('filterCluster', options.clusters);
-    updateSelectOptions('filterPowerState', options.power_states);
-    updateSelectOptions('filterFolder', options.folders);
+function updateFilterOptions(options, facets) {
+    updateSelectOptions('filterVcenter', options.vcenters || [], facets.vcenters);
+    updateSelectOptions('filterHost', options.hosts, facets.hosts);
+    updateSelectOptions('filterCluster', options.clusters, facets.clusters);
+    updateSelectOptions('filterPowerState', options.power_states, facets.power_states);
+    updateSelectOptions('filterFolder', options.folders, facets.folders);
 }
 
-function updateSelectOptions(selectId, values) {
+function updateSelectOptions(selectId, values, counts = {}) {
     const select = document.getElementById(selectId);
     const currentValue = select.value;
     
@@ -201,7 +251,7 @@ function updateSelectOptions(selectId, values) {
     values.forEach(value => {
         const option = document.createElement('option');
         option.value = value;
-        option.textContent = value;
+        option.textContent = counts[value] !== undefined ? `${value} (${counts[value]})` : value;
         select.appendChild(option);
     });
     
@@ -213,6 +263,7 @@ function updateSelectOptions(selectId, values) {
 
 // Aplicar filtros
 function applyFilters() {
+    app.filters.vcenter = document.getElementById('filterVcenter').value;
     app.filters.host = document.getElementById('filterHost').value;
     app.filters.cluster = document.getElementById('filterCluster').value;
     app.filters.power_state = document.getElementById('filterPowerState').value;
@@ -229,7 +280,7 @@ function renderVMTable() {
     if (app.vms.length === 0) {
         const row = tbody.insertRow();
         const cell = row.insertCell();
-        cell.colSpan = 10;
+        cell.colSpan = 11;
         cell.textContent = 'No se encontraron VMs con los filtros aplicados';
         cell.style.textAlign = 'center';
         cell.style.padding = '20px';
@@ -238,9 +289,11 @@ function renderVMTable() {
     
     app.vms.forEach(vm => {
         const row = tbody.insertRow();
+        const key = vmKey(vm);
+        row.dataset.vmKey = key;
         
         // Mantener selección si existía
-        if (app.selectedVms.has(vm.name)) {
+        if (app.selectedVms.has(key)) {
             row.classList.add('selected');
         }
         
@@ -248,8 +301,8 @@ function renderVMTable() {
         const checkCell = row.insertCell();
         const checkbox = document.createElement('input');
         checkbox.type = 'checkbox';
-        checkbox.checked = app.selectedVms.has(vm.name);
-        checkbox.addEventListener('change', () => handleVMSelection(vm.name, checkbox.checked));
+        checkbox.checked = app.selectedVms.has(key);
+        checkbox.addEventListener('change', () => handleVMSelection(vm, checkbox.checked));
         checkCell.appendChild(checkbox);
         
         // Nombre
@@ -262,6 +315,9 @@ function renderVMTable() {
         stateBadge.textContent = vm.power_state;
         stateCell.appendChild(stateBadge);
         
+        // vCenter
+        row.insertCell().textContent = vm.vcenter;
+        
         // Host
         row.insertCell().textContent = vm.host;
         
@@ -288,11 +344,13 @@ function renderVMTable() {
 }
 
 // Manejar selección de VM
-function handleVMSelection(vmName, isSelected) {
+function handleVMSelection(vm, isSelected) {
+    const key = vmKey(vm);
+    
     if (isSelected) {
-        app.selectedVms.add(vmName);
+        app.selectedVms.set(key, {vm_name: vm.name, vcenter: vm.vcenter});
     } else {
-        app.selectedVms.delete(vmName);
+        app.selectedVms.delete(key);
     }
     
     updateSelectionCount();
@@ -301,8 +359,7 @@ function handleVMSelection(vmName, isSelected) {
     const tbody = document.getElementById('vmTableBody');
     const rows = tbody.getElementsByTagName('tr');
     for (let row of rows) {
-        const cells = row.getElementsByTagName('td');
-        if (cells.length > 1 && cells[1].textContent === vmName) {
+        if (row.dataset.vmKey === key) {
             if (isSelected) {
                 row.classList.add('selected');
             } else {
@@ -318,7 +375,7 @@ function handleSelectAll(event) {
     const isChecked = event.target.checked;
     
     if (isChecked) {
-        app.vms.forEach(vm => app.selectedVms.add(vm.name));
+        app.vms.forEach(vm => app.selectedVms.set(vmKey(vm), {vm_name: vm.name, vcenter: vm.vcenter}));
     } else {
         app.selectedVms.clear();
     }
@@ -339,8 +396,10 @@ function updateSelectionCount() {
 async function handleExport() {
     if (app.selectedVms.size === 0) return;
     
-    const vmNames = Array.from(app.selectedVms);
+    const vms = Array.from(app.selectedVms.values());
+    const vmNames = vms.map(vm => app.vcenters.length > 1 ? `${vm.vm_name} (${vm.vcenter})` : vm.vm_name);
     const poweroffBefore = document.getElementById('poweroffBeforeExport').checked;
+    const compression = document.getElementById('exportCompression').value;
     
     const confirmMsg = `¿Descargar ${vmNames.length} VM(s) como OVA?\n\n` +
                        `VMs: ${vmNames.join(', ')}\n` +
@@ -359,8 +418,9 @@ async function handleExport() {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({
-                vm_names: vmNames,
-                poweroff_before_export: poweroffBefore
+                vms: vms,
+                poweroff_before_export: poweroffBefore,
+                compression: compression
             })
         });
         
@@ -391,7 +451,7 @@ async function handleExport() {
 
 // Cancelar descargas
 async function handleCancel() {
-    if (!confirm('¿Cancelar todas las descargas pendientes?')) return;
+    if (!confirm('¿Cancelar las descargas en curso y vaciar la cola?')) return;
     
     try {
         const response = await fetch('/api/cancel', {
@@ -409,10 +469,107 @@ async function handleCancel() {
     }
 }
 
-// Polling de estado de descargas
+// Cancelar un único trabajo (botón ✖ de la descarga en curso o en cola)
+async function handleCancelJob(event) {
+    const button = event.target.closest('.job-cancel');
+    if (!button) return;
+    
+    button.disabled = true;
+    
+    try {
+        const response = await fetch('/api/cancel', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({job_id: button.dataset.jobId})
+        });
+        
+        const data = await response.json();
+        
+        if (!data.success) {
+            alert(`Error: ${data.error}`);
+        }
+        
+    } catch (error) {
+        console.error('Error cancelando:', error);
+    }
+}
+
+// Botón de cancelación de un trabajo
+function cancelButton(job) {
+    if (job.status === 'cancelled') return '';
+    return `<button class="btn btn-small btn-danger job-cancel" data-job-id="${job.id}" title="Cancelar">✖</button>`;
+}
+
+// Actualizaciones de estado: SSE (/api/events) con polling como respaldo
 function startStatusPolling() {
-    stopStatusPolling(); // Detener cualquier polling previo
+    stopStatusPolling(); // Detener cualquier polling o stream previo
+    
+    if (!window.EventSource) {
+        startIntervalPolling();
+        return;
+    }
     
+    const source = new EventSource('/api/events');
+    app.eventSource = source;
+    
+    source.addEventListener('snapshot', event => {
+        app.status = JSON.parse(event.data);
+        updateDownloadStatus(app.status);
+    });
+    
+    ['job_queued', 'job_started', 'job_updated', 'job_progress', 'job_finished', 'queue_cleared'].forEach(type => {
+        source.addEventListener(type, event => {
+            if (!app.status) return;
+            applyStatusEvent(app.status, type, JSON.parse(event.data));
+            updateDownloadStatus(app.status);
+        });
+    });
+    
+    source.onerror = () => {
+        // Si el stream se cierra definitivamente, volver al polling
+        if (source.readyState === EventSource.CLOSED) {
+            console.warn('Stream de eventos cerrado, usando polling');
+            app.eventSource = null;
+            startIntervalPolling();
+        }
+    };
+}
+
+// Aplicar un delta del stream SSE al estado local
+function applyStatusEvent(status, type, data) {
+    const byId = id => job => job.id === id;
+    
+    if (type === 'job_queued') {
+        status.queue.push(data);
+    } else if (type === 'job_started') {
+        status.queue = status.queue.filter(job => job.id !== data.job.id);
+        status.active.push(data.job);
+    } else if (type === 'job_updated') {
+        // También trabajos en cola (liberados tras apagar la VM)
+        [status.active, status.queue].forEach(list => {
+            const index = list.findIndex(byId(data.id));
+            if (index >= 0) list[index] = data;
+        });
+    } else if (type === 'job_progress') {
+        const job = status.active.find(byId(data.id));
+        if (job) {
+            job.progress = data.progress;
+            job.message = data.message;
+        }
+    } else if (type === 'job_finished') {
+        status.active = status.active.filter(job => job.id !== data.id);
+        status.queue = status.queue.filter(job => job.id !== data.id);
+        status.history.push(data);
+        status.history = status.history.slice(-10);
+    } else if (type === 'queue_cleared') {
+        status.queue = status.queue.filter(job => !data.ids.includes(job.id));
+    }
+    
+    status.queue_size = status.queue.length;
+    status.current_download = status.active[0] || null;
+}
+
+function startIntervalPolling() {
     app.statusInterval = setInterval(async () => {
         try {
             const response = await fetch('/api/status');
@@ -429,10 +586,17 @@ function startStatusPolling() {
 }
 
 function stopStatusPolling() {
+    if (app.eventSource) {
+        app.eventSource.close();
+        app.eventSource = null;
+    }
+    
     if (app.statusInterval) {
         clearInterval(app.statusInterval);
         app.statusInterval = null;
     }
+    
+    app.status = null;
 }
 
 // Actualizar UI con estado de descargas
@@ -441,19 +605,36 @@ function updateDownloadStatus(status) {
     const queueDiv = document.getElementById('queueList');
     const historyDiv = document.getElementById('historyList');
     
-    // Descarga actual
-    if (status.current_download) {
+    // Descargas en curso (una por worker)
+    const active = status.active || (status.current_download ? [status.current_download] : []);
+    
+    if (active.length > 0) {
         currentDiv.style.display = 'block';
+        document.getElementById('activeCount').textContent = active.length;
         
-        const download = status.current_download;
-        document.getElementById('currentVmName').textContent = download.vm_name;
-        document.getElementById('currentStatus').textContent = download.status;
-        document.getElementById('currentStatus').className = `download-status ${download.status}`;
+        const activeItems = document.getElementById('activeItems');
+        activeItems.innerHTML = '';
         
-        const progress = download.progress || 0;
-        document.getElementById('currentProgress').style.width = `${progress}%`;
-        document.getElementById('currentProgressText').textContent = `${progress}%`;
-        document.getElementById('currentMessage').textContent = download.message || '';
+        active.forEach(download => {
+            const progress = download.progress || 0;
+            const div = document.createElement('div');
+            div.className = 'download-item current';
+            div.innerHTML = `
+                <div class="download-info">
+                    <span class="vm-name">${download.vm_name}</span>
+                    <span>
+                        <span class="download-status ${download.status}">${download.status}</span>
+                        ${cancelButton(download)}
+                    </span>
+                </div>
+                <div class="progress-bar">
+                    <div class="progress-fill" style="width: ${progress}%"></div>
+                </div>
+                <div class="progress-text">${progress}%</div>
+                <div class="download-message">${download.message || ''}</div>
+            `;
+            activeItems.appendChild(div);
+        });
         
     } else {
         currentDiv.style.display = 'none';
@@ -473,8 +654,12 @@ function updateDownloadStatus(status) {
             div.innerHTML = `
                 <div class="download-info">
                     <span class="vm-name">${item.vm_name}</span>
-                    <span class="download-status ${item.status}">${item.status}</span>
+                    <span>
+                        <span class="download-status ${item.status}">${item.status}</span>
+                        ${cancelButton(item)}
+                    </span>
                 </div>
+                <div class="download-message">${app.vcenters.length > 1 ? item.vcenter + ' / ' : ''}${item.host || ''}${item.scheduling ? ' - ' + item.scheduling : ''}</div>
             `;
             queueItems.appendChild(div);
         });
@@ -497,6 +682,10 @@ function updateDownloadStatus(status) {
             let details = '';
             if (item.status === 'completed' && item.file_path) {
                 details = `<div class="download-message">✅ ${item.file_path}</div>`;
+                if (item.compression) {
+                    details += `<div class="download-message">🗜️ ${item.compression.codec}: ` +
+                               `ratio ${item.compression.ratio}x, ${item.compression.throughput_mb_s} MB/s</div>`;
+                }
             } else if (item.status === 'failed' && item.error) {
                 details = `<div class="download-message">❌ ${item.error}</div>`;
             }
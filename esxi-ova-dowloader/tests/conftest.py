@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Configuración común de los tests: los módulos de la aplicación están en la raíz"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def webapp(tmp_path, monkeypatch):
+    """Módulo app con un planificador en memoria (sin config.json ni JobStore)"""
+    monkeypatch.chdir(tmp_path)
+    import app as webapp
+    from event_bus import EventBus
+    from export_queue import ExportScheduler
+    
+    monkeypatch.setitem(webapp.app_state, 'event_bus', EventBus())
+    monkeypatch.setitem(
+        webapp.app_state, 'scheduler',
+        ExportScheduler(lambda job, update, cancel_token: None, on_event=webapp._on_scheduler_event)
+    )
+    return webapp
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Tests de cancelación de exportaciones (CancelToken, límite de ancho de banda y cola)"""
+
+import threading
+import time
+
+import pytest
+
+from bandwidth import BandwidthLimiter
+from cancellation import CancelToken, ExportCancelled
+from export_queue import ExportScheduler
+from vmware_service import ExportProgress
+
+CHUNK = 1024 * 1024
+
+
+class FakeLease:
+    """Lease sin vCenter: solo recibe el progreso"""
+    
+    def HttpNfcLeaseProgress(self, percent):
+        pass
+
+
+def test_cancel_runs_callbacks_once():
+    token = CancelToken()
+    calls = []
+    token.on_cancel(lambda: calls.append('a'))
+    handle = token.on_cancel(lambda: calls.append('b'))
+    token.remove(handle)
+    
+    assert token.cancel('motivo')
+    assert not token.cancel('otra vez')
+    assert calls == ['a']
+    
+    # Registrado después de cancelar: se ejecuta en el acto
+    token.on_cancel(lambda: calls.append('c'))
+    assert calls == ['a', 'c']
+    
+    with pytest.raises(ExportCancelled, match='motivo'):
+        token.check()
+
+
+def test_cancel_wakes_throttled_stream():
+    limiter = BandwidthLimiter(per_job_mbps=1)
+    token = CancelToken()
+    
+    with limiter.job('job', token) as bandwidth:
+        # El primer chunk deja deuda: el segundo tendría que esperar ~1 s
+        bandwidth.throttle(CHUNK)
+        threading.Timer(0.1, token.cancel).start()
+        
+        started = time.monotonic()
+        with pytest.raises(ExportCancelled):
+            bandwidth.throttle(CHUNK)
+    
+    assert time.monotonic() - started < 0.2
+
+
+def test_cancel_releases_slot_of_throttled_transfer():
+    """Un trabajo esperando al límite de ancho de banda libera su worker en menos de 1 s"""
+    limiter = BandwidthLimiter(per_job_mbps=1)
+    transferring = threading.Event()
+    finished = threading.Event()
+    
+    def run_job(job, update, cancel_token):
+        with limiter.job(job['id'], cancel_token) as bandwidth:
+            progress = ExportProgress(FakeLease(), 100 * CHUNK, bandwidth=bandwidth)
+            while True:
+                progress.received(CHUNK, 'esx01')
+                transferring.set()
+    
+    def on_event(event_type, data):
+        if event_type == 'job_finished':
+            finished.set()
+    
+    scheduler = ExportScheduler(run_job, max_workers=1, on_event=on_event)
+    job_id = scheduler.submit([{'vm_name': 'vm1', 'download_dir': '.', 'poweroff_before': False}])[0]
+    
+    assert transferring.wait(5)
+    # Dar tiempo a que el stream quede dormido esperando saldo
+    time.sleep(0.3)
+    
+    started = time.monotonic()
+    assert scheduler.cancel(job_id)
+    assert finished.wait(1)
+    elapsed = time.monotonic() - started
+    
+    state = scheduler.snapshot()
+    assert elapsed < 1
+    assert state['active'] == []
+    assert state['history'][-1]['status'] == 'cancelled'
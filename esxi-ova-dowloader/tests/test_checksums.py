@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Tests de los digests incrementales y el manifiesto OVF"""
+
+import hashlib
+import tarfile
+
+import pytest
+
+from checksums import (
+    FileDigest, build_manifest, digest_algorithms, digest_bytes, manifest_size
+)
+from ova_writer import StreamingOvaWriter
+
+DISK = bytes(range(256)) * 4096  # 1 MB
+
+
+def test_digest_algorithms():
+    assert digest_algorithms('sha256') == ['sha256']
+    assert digest_algorithms('sha1') == ['sha256', 'sha1']
+    assert digest_algorithms('none') == []
+    with pytest.raises(ValueError):
+        digest_algorithms('md5')
+
+
+def test_inline_updates_and_read_back_give_the_full_digest(tmp_path):
+    path = tmp_path / 'ova'
+    base_offset = 512
+    path.write_bytes(bytes(base_offset) + DISK)
+    
+    # La primera mitad llega en línea; la segunda la escribió otro rango y se lee del disco
+    digest = FileDigest(['sha256', 'sha1'])
+    digest.update(memoryview(DISK)[:300000])
+    digest.catch_up(str(path), base_offset, len(DISK))
+    
+    assert digest.position == len(DISK)
+    assert digest.read_back == len(DISK) - 300000
+    assert digest.hexdigests() == {
+        'sha256': hashlib.sha256(DISK).hexdigest(),
+        'sha1': hashlib.sha1(DISK).hexdigest()
+    }
+
+
+def test_catch_up_fails_on_short_file(tmp_path):
+    path = tmp_path / 'ova'
+    path.write_bytes(DISK[:1000])
+    
+    with pytest.raises(IOError, match='Fin de archivo inesperado'):
+        FileDigest(['sha256']).catch_up(str(path), 0, 2000)
+
+
+@pytest.mark.parametrize('algorithm', ['sha256', 'sha1'])
+def test_manifest_matches_ova_members(tmp_path, algorithm):
+    descriptor = b'<Envelope/>\n'
+    names = ['vm1.ovf', 'vm1-disk1.vmdk']
+    algorithms = digest_algorithms(algorithm)
+    
+    disk_digest = FileDigest(algorithms)
+    disk_digest.update(DISK)
+    manifest = build_manifest(algorithm, [
+        ('vm1.ovf', digest_bytes(descriptor, algorithms)),
+        ('vm1-disk1.vmdk', disk_digest.hexdigests())
+    ])
+    
+    # El hueco del manifiesto se reserva antes de conocer los digests
+    assert len(manifest) == manifest_size(algorithm, names)
+    
+    path = str(tmp_path / 'vm1.ova')
+    writer = StreamingOvaWriter(path, [
+        ('vm1.ovf', len(descriptor)), ('vm1-disk1.vmdk', len(DISK)), ('vm1.mf', len(manifest))
+    ])
+    writer.create()
+    writer.write_member('vm1.ovf', descriptor)
+    writer.write_member('vm1-disk1.vmdk', DISK)
+    writer.write_member('vm1.mf', manifest)
+    
+    label = algorithm.upper()
+    with tarfile.open(path) as tar:
+        assert tar.getnames() == names + ['vm1.mf']
+        lines = tar.extractfile('vm1.mf').read().decode('utf-8').splitlines()
+        expected = [
+            f"{label}({name})= {hashlib.new(algorithm, tar.extractfile(name).read()).hexdigest()}"
+            for name in names
+        ]
+    
+    assert lines == expected
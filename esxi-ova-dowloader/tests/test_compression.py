@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Tests de la compresión en paralelo del OVA"""
+
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+
+from compression import ParallelCompressedWriter, normalize_codec
+from ova_writer import TarStreamWriter
+
+# Datos compresibles pero no triviales, de varios bloques
+DATA = b''.join(f'bloque {i:06d} '.encode() * 40 for i in range(5000))
+
+
+def decompress(codec, payload):
+    if codec == 'gzip':
+        return gzip.decompress(payload)
+    import zstandard
+    # Frames concatenados: leer en streaming hasta el final
+    return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(payload), read_across_frames=True).read()
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'zstd'])
+def test_round_trip_in_original_order(tmp_path, codec):
+    if codec == 'zstd':
+        pytest.importorskip('zstandard')
+    path = str(tmp_path / f'vm1.ova.{codec}')
+    
+    writer = ParallelCompressedWriter(path, codec, threads=4, block_size=64 * 1024)
+    # Escrituras de tamaños irregulares que cruzan bloques
+    for start in range(0, len(DATA), 50000):
+        writer.write(memoryview(DATA)[start:start + 50000])
+    writer.close()
+    
+    with open(path, 'rb') as f:
+        payload = f.read()
+    assert decompress(codec, payload) == DATA
+    
+    stats = writer.stats()
+    assert stats['input_bytes'] == len(DATA)
+    assert stats['output_bytes'] == len(payload) == os.path.getsize(path)
+    assert stats['ratio'] > 1
+
+
+def test_compressed_tar_stream_is_a_valid_ova(tmp_path):
+    path = str(tmp_path / 'vm1.ova.gz')
+    writer = ParallelCompressedWriter(path, 'gzip', threads=2, block_size=64 * 1024)
+    stream = TarStreamWriter(writer)
+    stream.add_member('vm1.ovf', b'<Envelope/>\n')
+    stream.add_member('vm1-disk1.vmdk', DATA)
+    stream.finish()
+    writer.close()
+    
+    with tarfile.open(path, 'r:gz') as tar:
+        assert tar.getnames() == ['vm1.ovf', 'vm1-disk1.vmdk']
+        assert tar.extractfile('vm1-disk1.vmdk').read() == DATA
+
+
+def test_normalize_codec():
+    assert normalize_codec(None) is None
+    assert normalize_codec('none') is None
+    assert normalize_codec('gzip') == 'gzip'
+    with pytest.raises(ValueError):
+        normalize_codec('bzip2')
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Tests del stream SSE de /api/events"""
+
+import pytest
+
+from event_bus import EventBus, format_sse
+
+
+def item(vm_name):
+    return {'vm_name': vm_name, 'vcenter': 'vc1', 'download_dir': '.', 'poweroff_before': False}
+
+
+def parse(chunk):
+    """Bloque SSE -> dict campo -> valor"""
+    return dict(line.split(': ', 1) for line in chunk.decode('utf-8').strip().split('\n'))
+
+
+def test_format_sse():
+    assert format_sse('job_queued', {'id': 'a'}, 7) == 'id: 7\nevent: job_queued\ndata: {"id": "a"}\n\n'
+
+
+def test_stream_sends_snapshot_then_deltas(webapp):
+    response = webapp.app.test_client().get('/api/events', buffered=False)
+    chunks = iter(response.response)
+    
+    assert response.mimetype == 'text/event-stream'
+    assert parse(next(chunks))['event'] == 'snapshot'
+    
+    job_id = webapp.app_state['scheduler'].submit([item('vm1')], hold=True)[0]
+    webapp.app_state['scheduler'].fail(job_id, 'sin energía')
+    
+    queued, finished = parse(next(chunks)), parse(next(chunks))
+    assert (queued['event'], finished['event']) == ('job_queued', 'job_finished')
+    assert int(finished['id']) == int(queued['id']) + 1
+    assert f'"id": "{job_id}"' in finished['data']
+    
+    response.close()
+    assert webapp.app_state['event_bus'].subscriber_count() == 0
+
+
+def test_overflowed_client_gets_a_new_snapshot_right_away(webapp, monkeypatch):
+    monkeypatch.setitem(webapp.app_state, 'event_bus', EventBus(subscriber_queue_size=2))
+    response = webapp.app.test_client().get('/api/events', buffered=False)
+    chunks = iter(response.response)
+    assert parse(next(chunks))['event'] == 'snapshot'
+    
+    # Más deltas de los que caben en la cola del cliente
+    webapp.app_state['scheduler'].submit([item('vm1'), item('vm2'), item('vm3')], hold=True)
+    
+    snapshot = parse(next(chunks))
+    assert snapshot['event'] == 'snapshot'
+    assert snapshot['data'].count('"vm_name"') == 3
+    response.close()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Tests del planificador de exportaciones (ExportScheduler)"""
+
+import threading
+import time
+
+import pytest
+
+from export_queue import ExportScheduler, DuplicateExportError
+
+
+def item(vm_name, vcenter='vc1', moref=None):
+    return {
+        'vm_name': vm_name,
+        'vcenter': vcenter,
+        'moref': moref,
+        'download_dir': '.',
+        'poweroff_before': False
+    }
+
+
+@pytest.fixture
+def blocked_scheduler():
+    """Planificador cuyo trabajo en curso espera hasta que se libera el evento"""
+    release = threading.Event()
+    started = threading.Event()
+    
+    def run_job(job, update, cancel_token):
+        started.set()
+        release.wait(5)
+        update(status='completed')
+    
+    scheduler = ExportScheduler(run_job, max_workers=1)
+    yield scheduler, started, release
+    release.set()
+
+
+def test_refuses_second_job_for_pending_or_active_vm(blocked_scheduler):
+    scheduler, started, release = blocked_scheduler
+    active_id = scheduler.submit([item('vm1', moref='vm-1')])[0]
+    assert started.wait(5)
+    pending_id = scheduler.submit([item('vm2', moref='vm-2')])[0]
+    
+    with pytest.raises(DuplicateExportError) as excinfo:
+        scheduler.submit([item('vm3', moref='vm-3'), item('vm1', moref='vm-1'), item('vm2', moref='vm-2')])
+    
+    assert [job_id for _, _, job_id in excinfo.value.duplicates] == [active_id, pending_id]
+    # Nada de la petición rechazada llega a la cola
+    assert [job['vm_name'] for job in scheduler.snapshot()['queue']] == ['vm2']
+
+
+def test_refuses_vm_repeated_in_same_request():
+    scheduler = ExportScheduler(lambda job, update, cancel_token: None)
+    
+    with pytest.raises(DuplicateExportError):
+        scheduler.submit([item('vm1', moref='vm-1'), item('vm1', moref='vm-1')], hold=True)
+
+
+def test_same_name_on_other_vcenter_or_moref_is_allowed():
+    scheduler = ExportScheduler(lambda job, update, cancel_token: None)
+    
+    job_ids = scheduler.submit([
+        item('web', 'vc1', 'vm-1'),
+        item('web', 'vc2', 'vm-1'),
+        item('web', 'vc1', 'vm-7')
+    ], hold=True)
+    
+    assert len(job_ids) == 3
+
+
+def test_vm_can_be_exported_again_once_finished(blocked_scheduler):
+    scheduler, started, release = blocked_scheduler
+    finished = threading.Event()
+    
+    def on_event(event_type, data):
+        if event_type == 'job_finished':
+            finished.set()
+    
+    scheduler._on_event = on_event
+    
+    scheduler.submit([item('vm1', moref='vm-1')])
+    assert started.wait(5)
+    release.set()
+    assert finished.wait(5)
+    
+    assert scheduler.submit([item('vm1', moref='vm-1')])
+
+
+def test_cancel_vcenter_waits_for_its_workers_and_keeps_other_jobs():
+    started = threading.Event()
+    
+    def run_job(job, update, cancel_token):
+        cancelled = threading.Event()
+        cancel_token.on_cancel(cancelled.set)
+        started.set()
+        cancelled.wait(5)
+    
+    scheduler = ExportScheduler(run_job, max_workers=1)
+    scheduler.submit([item('vm1', 'vc1', 'vm-1')])
+    assert started.wait(5)
+    scheduler.submit([item('vm2', 'vc1', 'vm-2'), item('vm3', 'vc2', 'vm-3')], hold=True)
+    
+    started_at = time.monotonic()
+    assert scheduler.cancel_vcenter('vc1', timeout=5)
+    assert time.monotonic() - started_at < 4
+    
+    snapshot = scheduler.snapshot()
+    assert snapshot['active'] == []
+    assert [job['vm_name'] for job in snapshot['queue']] == ['vm3']
+    assert [job['status'] for job in snapshot['history']] == ['cancelled']
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Tests de la caché de inventario (InventoryCache) con un flujo de actualizaciones simulado"""
+
+import pytest
+from pyVmomi import vim, vmodl
+
+import inventory
+from inventory import InventoryCache, InventorySnapshot, AmbiguousVMNameError
+
+PropertyCollector = vmodl.query.PropertyCollector
+
+
+def vm_update(kind, moid, **props):
+    """ObjectUpdate de una VM con propiedades (nombres con '_' en lugar de '.')"""
+    return PropertyCollector.ObjectUpdate(
+        kind=kind,
+        obj=vim.VirtualMachine(moid),
+        changeSet=[
+            PropertyCollector.Change(name=name.replace('_', '.'), op='assign', val=value)
+            for name, value in props.items()
+        ]
+    )
+
+
+def update_set(version, *object_updates):
+    """UpdateSet de WaitForUpdatesEx con un único filtro"""
+    return PropertyCollector.UpdateSet(
+        version=version,
+        filterSet=[PropertyCollector.FilterUpdate(objectSet=list(object_updates))]
+    )
+
+
+class FakeFeed:
+    """Flujo simulado: load() devuelve el estado inicial y poll() los cambios encolados"""
+    
+    def __init__(self, initial):
+        self.initial = initial
+        self.pending = []
+        self.loads = 0
+        self.polls = []
+        self.closed = 0
+    
+    def push(self, *object_updates):
+        self.pending.append(update_set(str(len(self.pending) + 2), *object_updates))
+    
+    def load(self):
+        self.loads += 1
+        snapshot = InventorySnapshot()
+        snapshot.apply_update_set(update_set('1', *self.initial))
+        return snapshot, '1'
+    
+    def poll(self, version, max_wait=0):
+        self.polls.append(version)
+        update_sets, self.pending = self.pending, []
+        return update_sets, update_sets[-1].version if update_sets else version
+    
+    def close(self):
+        self.closed += 1
+
+
+class Clock:
+    """Reloj manual para controlar el TTL"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(inventory.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def feed():
+    return FakeFeed([
+        vm_update('enter', 'vm-1', name='web01', runtime_powerState='poweredOn'),
+        vm_update('enter', 'vm-2', name='db01', runtime_powerState='poweredOff')
+    ])
+
+
+def vm_states(cache):
+    return {vm['name']: vm['power_state'] for vm in cache.vm_list()}
+
+
+def test_initial_sync_loads_full_state(clock, feed):
+    cache = InventoryCache(lambda: feed, ttl=30)
+    
+    assert vm_states(cache) == {'web01': 'poweredOn', 'db01': 'poweredOff'}
+    assert cache.find_vm('db01')._moId == 'vm-2'
+    assert feed.loads == 1
+    assert feed.polls == []
+    
+    stats = cache.get_stats()
+    assert stats['full_loads'] == 1
+    assert stats['objects'] == 2
+
+
+def test_incremental_modify_enter_leave(clock, feed):
+    cache = InventoryCache(lambda: feed, ttl=30)
+    cache.vm_list()
+    
+    feed.push(
+        vm_update('modify', 'vm-1', runtime_powerState='poweredOff'),
+        vm_update('enter', 'vm-3', name='app01', runtime_powerState='poweredOn'),
+        PropertyCollector.ObjectUpdate(kind='leave', obj=vim.VirtualMachine('vm-2'))
+    )
+    clock.now += 31
+    
+    assert vm_states(cache) == {'web01': 'poweredOff', 'app01': 'poweredOn'}
+    assert cache.find_vm('app01')._moId == 'vm-3'
+    assert feed.loads == 1
+    assert feed.polls == ['1']
+    assert cache.get_stats()['objects_updated'] == 3
+
+
+def test_rename_updates_name_index(clock, feed):
+    cache = InventoryCache(lambda: feed, ttl=30)
+    cache.vm_list()
+    
+    feed.push(vm_update('modify', 'vm-1', name='web01-old'))
+    clock.now += 31
+    cache.snapshot()
+    
+    assert cache.snapshot().find_vm('web01') is None
+    assert cache.find_vm('web01-old')._moId == 'vm-1'
+
+
+def test_ttl_expiry_triggers_incremental_sync(clock, feed):
+    cache = InventoryCache(lambda: feed, ttl=30)
+    cache.vm_list()
+    
+    # Dentro del TTL se sirve el snapshot sin consultar el flujo
+    feed.push(vm_update('modify', 'vm-1', runtime_powerState='poweredOff'))
+    clock.now += 29
+    assert vm_states(cache)['web01'] == 'poweredOn'
+    assert feed.polls == []
+    
+    clock.now += 2
+    assert vm_states(cache)['web01'] == 'poweredOff'
+    assert feed.polls == ['1']
+    
+    stats = cache.get_stats()
+    assert stats['stale'] == 1
+    assert stats['incremental_syncs'] == 1
+    assert stats['full_loads'] == 1
+
+
+def test_find_vm_miss_forces_resync(clock, feed):
+    cache = InventoryCache(lambda: feed, ttl=30)
+    cache.vm_list()
+    
+    # VM creada dentro del TTL: el fallo de búsqueda sincroniza y reintenta
+    feed.push(vm_update('enter', 'vm-3', name='new01', runtime_powerState='poweredOff'))
+    clock.now += 1
+    
+    assert cache.find_vm('new01')._moId == 'vm-3'
+    assert feed.polls == ['1']
+    assert cache.find_vm('missing') is None
+    assert feed.polls == ['1', '2']
+    assert feed.loads == 1
+
+
+def test_get_vm_by_moref_survives_rename_and_name_reuse(clock, feed):
+    cache = InventoryCache(lambda: feed, ttl=30)
+    cache.vm_list()
+    
+    # Otra VM toma el nombre de vm-1 tras renombrarla
+    feed.push(
+        vm_update('modify', 'vm-1', name='web01-old'),
+        vm_update('enter', 'vm-3', name='web01', runtime_powerState='poweredOff')
+    )
+    clock.now += 1
+    
+    # VM nueva dentro del TTL: el fallo de búsqueda sincroniza y reintenta
+    assert cache.get_vm('vm-3')._moId == 'vm-3'
+    assert feed.polls == ['1']
+    assert cache.get_vm('vm-1')._moId == 'vm-1'
+    assert cache.find_vm('web01')._moId == 'vm-3'
+    assert cache.get_vm('vm-404') is None
+
+
+def test_failed_poll_falls_back_to_full_load(clock, feed):
+    cache = InventoryCache(lambda: feed, ttl=30)
+    cache.vm_list()
+    
+    def broken_poll(version, max_wait=0):
+        raise RuntimeError('versión no válida')
+    
+    feed.poll = broken_poll
+    clock.now += 31
+    
+    assert vm_states(cache) == {'web01': 'poweredOn', 'db01': 'poweredOff'}
+    assert feed.loads == 2
+    assert feed.closed == 1
+
+
+def test_duplicate_names_are_ambiguous(clock, feed):
+    feed.initial.append(vm_update('enter', 'vm-9', name='web01'))
+    cache = InventoryCache(lambda: feed, ttl=30)
+    
+    with pytest.raises(AmbiguousVMNameError) as excinfo:
+        cache.find_vm('web01')
+    
+    assert excinfo.value.morefs == ['vm-1', 'vm-9']
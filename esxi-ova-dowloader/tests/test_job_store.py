@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Tests de la persistencia de trabajos (JobStore) desde el planificador"""
+
+import threading
+
+from export_queue import ExportScheduler
+from job_store import JobStore
+
+
+def item(vm_name, vcenter='vc1'):
+    return {
+        'vm_name': vm_name,
+        'vcenter': vcenter,
+        'moref': None,
+        'download_dir': '.',
+        'poweroff_before': False
+    }
+
+
+class SlowStore(JobStore):
+    """JobStore cuyas escrituras esperan a que se libere un evento"""
+    
+    def __init__(self, path):
+        super().__init__(path)
+        self.release = threading.Event()
+        self.saved = []
+    
+    def save(self, job):
+        self.release.wait(5)
+        self.saved.append((job['id'], job['status']))
+        super().save(job)
+
+
+def test_writes_happen_outside_the_lock_and_in_order(tmp_path):
+    store = SlowStore(str(tmp_path / 'jobs.db'))
+    scheduler = ExportScheduler(lambda job, update, cancel_token: None, store=store)
+    
+    # Con el JobStore bloqueado el planificador sigue respondiendo
+    job_id = scheduler.submit([item('vm1')], hold=True)[0]
+    scheduler.fail(job_id, 'sin energía')
+    assert scheduler.get(job_id)['status'] == 'failed'
+    assert not scheduler.flush(timeout=0.1)
+    
+    store.release.set()
+    assert scheduler.flush(timeout=5)
+    assert store.saved == [(job_id, 'powering_off'), (job_id, 'failed')]
+    assert scheduler.get(job_id)['error'] == 'sin energía'
+
+
+def test_restart_recovers_unfinished_jobs_until_their_vcenter_reconnects(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    release = threading.Event()
+    started = threading.Event()
+    
+    def blocked_job(job, update, cancel_token):
+        started.set()
+        release.wait(5)
+    
+    before = ExportScheduler(blocked_job, store=JobStore(path))
+    running_id = before.submit([item('vm1', 'vc1')])[0]
+    assert started.wait(5)
+    held_id = before.submit([item('vm2', 'vc2')], hold=True)[0]
+    assert before.flush(timeout=5)
+    
+    # Reinicio: otro planificador sobre la misma base de datos
+    ran = []
+    finished = threading.Event()
+    
+    def resumed_job(job, update, cancel_token):
+        ran.append(job['id'])
+        update(status='completed')
+    
+    def on_event(event_type, data):
+        if event_type == 'job_finished':
+            finished.set()
+    
+    after = ExportScheduler(resumed_job, store=JobStore(path), on_event=on_event)
+    assert after.recover() == 2
+    
+    queue = after.snapshot()['queue']
+    assert [job['id'] for job in queue] == [running_id, held_id]
+    assert {job['status'] for job in queue} == {'interrupted'}
+    assert all(job['held'] and 'started_at' not in job for job in queue)
+    
+    # Solo se reanudan los trabajos del vCenter que se conecta
+    assert [job['id'] for job in after.resume_recovered('vc1')] == [running_id]
+    assert finished.wait(5)
+    assert ran == [running_id]
+    assert after.get(running_id)['status'] == 'completed'
+    assert after.get(held_id)['status'] == 'interrupted'
+    assert [job['id'] for job in after.query(status='interrupted')] == [held_id]
+    release.set()
+
+
+def test_recover_closes_jobs_that_had_already_finished(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    store.save({
+        'id': 'job-1', 'vm_name': 'vm1', 'vcenter': 'vc1', 'status': 'completed',
+        'submitted_at': '2026-01-01T00:00:00'
+    })
+    
+    scheduler = ExportScheduler(lambda job, update, cancel_token: None, store=store)
+    assert scheduler.recover() == 0
+    
+    history = scheduler.snapshot()['history']
+    assert [job['id'] for job in history] == ['job-1']
+    assert history[0]['finished_at']
+    assert store.unfinished() == []
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Tests de las métricas de Prometheus (/metrics)"""
+
+import pytest
+
+import metrics
+from metrics import Counter, Gauge, Histogram, MetricsRegistry, instrument_stub
+
+
+def sample(text, line_prefix):
+    """Valor de la primera línea que empieza por line_prefix"""
+    for line in text.splitlines():
+        if line.startswith(line_prefix + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+def test_counter_gauge_and_label_escaping():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter('exports_total', 'Exportaciones', ['status']))
+    gauge = registry.register(Gauge('queue_depth', 'Cola'))
+    
+    counter.inc(status='completed')
+    counter.inc(2, status='completed')
+    counter.inc(status='fa"il\ned')
+    gauge.set(4)
+    
+    text = registry.render()
+    assert '# TYPE exports_total counter' in text
+    assert 'exports_total{status="completed"} 3' in text
+    assert 'exports_total{status="fa\\"il\\ned"} 1' in text
+    assert 'queue_depth 4' in text
+    
+    with pytest.raises(ValueError):
+        counter.inc(vm='vm1')
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('phase_seconds', 'Fases', ['phase'], buckets=(1, 10))
+    for value in (0.5, 5, 5, 50):
+        histogram.observe(value, phase='download')
+    
+    text = '\n'.join(histogram.render())
+    assert sample(text, 'phase_seconds_bucket{phase="download",le="1"}') == 1
+    assert sample(text, 'phase_seconds_bucket{phase="download",le="10"}') == 3
+    assert sample(text, 'phase_seconds_bucket{phase="download",le="+Inf"}') == 4
+    assert sample(text, 'phase_seconds_sum{phase="download"}') == 60.5
+    assert sample(text, 'phase_seconds_count{phase="download"}') == 4
+
+
+def test_failing_collector_does_not_break_the_exposition():
+    registry = MetricsRegistry()
+    registry.add_collector(lambda: 1 / 0)
+    registry.add_collector(lambda: [('workers', 'gauge', 'Workers', [({}, 2)])])
+    
+    assert 'workers 2' in registry.render()
+
+
+def test_instrument_stub_counts_calls_and_errors():
+    class FakeStub:
+        def InvokeMethod(self, mo, info, *args):
+            if info.name == 'PowerOffVM_Task':
+                raise RuntimeError('InvalidPowerState')
+            return 'task-1'
+        
+        def InvokeAccessor(self, mo, info):
+            return 'poweredOn'
+    
+    class Info:
+        def __init__(self, name):
+            self.name = name
+    
+    def calls(method, kind, metric='vcenter_soap_calls_total'):
+        labels = f'{{vcenter="vc-test",method="{method}",kind="{kind}"}}'
+        return sample(metrics.REGISTRY.render(), metric + labels) or 0
+    
+    stub = instrument_stub(FakeStub(), 'vc-test')
+    before = calls('PowerOffVM_Task', 'method'), calls('PowerOffVM_Task', 'method', 'vcenter_soap_errors_total')
+    
+    assert stub.InvokeMethod(None, Info('ExportVm')) == 'task-1'
+    assert stub.InvokeAccessor(None, Info('runtime')) == 'poweredOn'
+    with pytest.raises(RuntimeError):
+        stub.InvokeMethod(None, Info('PowerOffVM_Task'))
+    
+    assert calls('ExportVm', 'method') >= 1
+    assert calls('runtime', 'property') >= 1
+    assert calls('PowerOffVM_Task', 'method') == before[0] + 1
+    assert calls('PowerOffVM_Task', 'method', 'vcenter_soap_errors_total') == before[1] + 1
+
+
+def test_metrics_endpoint_reports_finished_jobs_and_queue(webapp):
+    scheduler = webapp.app_state['scheduler']
+    client = webapp.app.test_client()
+    
+    def failed_total():
+        return sample(client.get('/metrics').get_data(as_text=True), 'ova_exports_total{status="failed"}') or 0
+    
+    before = failed_total()
+    job_id = scheduler.submit([
+        {'vm_name': 'vm1', 'vcenter': 'vc1', 'download_dir': '.', 'poweroff_before': True}
+    ], hold=True)[0]
+    scheduler.submit([
+        {'vm_name': 'vm2', 'vcenter': 'vc1', 'download_dir': '.', 'poweroff_before': True}
+    ], hold=True)
+    scheduler.fail(job_id, 'sin energía')
+    
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+    assert response.content_type == metrics.CONTENT_TYPE
+    assert sample(text, 'ova_queue_depth') == 1
+    assert sample(text, 'ova_active_exports') == 0
+    assert failed_total() == before + 1
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Tests de la escritura del OVA en streaming (disposición tar)"""
+
+import io
+import os
+import tarfile
+
+import pytest
+
+from ova_writer import StreamingOvaWriter, TarStreamWriter
+
+MTIME = 1700000000
+
+MEMBERS = [
+    ('vm1.ovf', b'<Envelope/>\n'),
+    ('vm1-disk1.vmdk', bytes(range(256)) * 5),
+    ('vm1-disk2.vmdk', b'x' * 512),
+    ('vm1.mf', b'SHA256(vm1.ovf)= 00\n')
+]
+
+
+def read_tar(source):
+    with tarfile.open(**source) as tar:
+        return [(member.name, tar.extractfile(member).read()) for member in tar.getmembers()]
+
+
+def test_members_written_out_of_order_land_in_declared_order(tmp_path):
+    path = str(tmp_path / 'vm1.ova')
+    writer = StreamingOvaWriter(path, [(name, len(data)) for name, data in MEMBERS], mtime=MTIME)
+    writer.create()
+    
+    # Los discos se escriben en su desplazamiento (en paralelo y en cualquier orden)
+    for name, data in reversed(MEMBERS[1:3]):
+        with open(path, 'r+b') as f:
+            f.seek(writer.member_offset(name))
+            f.write(data)
+    writer.write_member('vm1.mf', MEMBERS[3][1])
+    writer.write_member('vm1.ovf', MEMBERS[0][1])
+    
+    assert os.path.getsize(path) == writer.total_size
+    assert read_tar({'name': path}) == MEMBERS
+
+
+def test_reuse_keeps_data_of_same_layout(tmp_path):
+    path = str(tmp_path / 'vm1.ova')
+    members = [(name, len(data)) for name, data in MEMBERS]
+    writer = StreamingOvaWriter(path, members, mtime=MTIME)
+    writer.create()
+    for name, data in MEMBERS:
+        writer.write_member(name, data)
+    
+    # Reanudación: misma disposición, las cabeceras se reescriben y los datos se conservan
+    resumed = StreamingOvaWriter(path, members, mtime=MTIME)
+    assert resumed.layout() == writer.layout()
+    resumed.create(reuse=True)
+    
+    assert read_tar({'name': path}) == MEMBERS
+
+
+def test_sequential_writer_matches_positional_layout(tmp_path):
+    path = str(tmp_path / 'vm1.ova')
+    writer = StreamingOvaWriter(path, [(name, len(data)) for name, data in MEMBERS], mtime=MTIME)
+    writer.create()
+    for name, data in MEMBERS:
+        writer.write_member(name, data)
+    
+    sink = io.BytesIO()
+    stream = TarStreamWriter(sink, mtime=MTIME)
+    for name, data in MEMBERS:
+        stream.begin_member(name, len(data))
+        # El contenido llega en trozos, como desde la red
+        for start in range(0, len(data), 100):
+            stream.write(data[start:start + 100])
+        stream.end_member()
+    stream.finish()
+    
+    with open(path, 'rb') as f:
+        assert sink.getvalue() == f.read()
+    sink.seek(0)
+    assert read_tar({'fileobj': sink}) == MEMBERS
+
+
+def test_sequential_writer_rejects_incomplete_member():
+    stream = TarStreamWriter(io.BytesIO(), mtime=MTIME)
+    stream.begin_member('vm1-disk1.vmdk', 10)
+    stream.write(b'12345')
+    
+    with pytest.raises(IOError, match='faltan 5 bytes'):
+        stream.end_member()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Tests del apagado por lotes (poweroff_vms) con VMs, tareas y esperas simuladas"""
+
+import contextlib
+import itertools
+
+import pytest
+from pyVmomi import vim
+
+from vmware_service import VMwareService
+
+_ids = itertools.count(1)
+
+
+class FakeError:
+    def __init__(self, message):
+        self.localizedMessage = message
+
+
+class FakeTask:
+    """PowerOffVM_Task terminada con éxito o con error"""
+    
+    def __init__(self, error=None):
+        self._moId = f'task-{next(_ids)}'
+        self.state = vim.TaskInfo.State.error if error else vim.TaskInfo.State.success
+        self.info = type('TaskInfo', (), {'error': FakeError(error) if error else None})()
+
+
+class FakeVM:
+    """VM encendida: con Tools se apaga (o no) al pedirlo; forzarla crea una tarea"""
+    
+    def __init__(self, name, tools=True, obeys_shutdown=True, task_error=None):
+        self._moId = f'vm-{next(_ids)}'
+        self.name = name
+        self.tools = tools
+        self.obeys_shutdown = obeys_shutdown
+        self.task_error = task_error
+        self.off = False
+        self.forced = 0
+        self.runtime = type('Runtime', (), {'powerState': 'poweredOn'})()
+    
+    def ShutdownGuest(self):
+        if not self.tools:
+            raise Exception('ToolsUnavailable')
+        self.off = self.obeys_shutdown
+    
+    def PowerOffVM_Task(self):
+        self.forced += 1
+        self.off = self.task_error is None
+        return FakeTask(self.task_error)
+
+
+class FakeWaiter:
+    """Entrega primero el fin de las tareas y después los cambios de energía"""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def wait(self, watches, timeout, on_done=None):
+        self.calls.append([obj._moId for obj, _, _ in watches])
+        pending = {obj._moId: (obj, condition) for obj, _, condition in watches}
+        done = {}
+        
+        ordered = sorted(pending.values(), key=lambda entry: not isinstance(entry[0], FakeTask))
+        for obj, condition in ordered:
+            if obj._moId not in pending:
+                continue
+            
+            value = obj.state if isinstance(obj, FakeTask) else ('poweredOff' if obj.off else 'poweredOn')
+            if not condition(value):
+                continue
+            
+            del pending[obj._moId]
+            done[obj._moId] = value
+            for dropped in on_done(obj, value) or ():
+                pending.pop(dropped._moId, None)
+        
+        return done, [obj for obj, _ in pending.values()]
+
+
+@pytest.fixture
+def service():
+    service = VMwareService('vcenter.local', 'user', 'secret')
+    service.waiter = FakeWaiter()
+    service._waiter = lambda: service.waiter
+    service.pool = type('Pool', (), {'session': lambda self: contextlib.nullcontext()})()
+    return service
+
+
+def poweroff(service, *vms):
+    by_name = {vm.name: vm for vm in vms}
+    service.find_vm = by_name.get
+    released = []
+    results = service.poweroff_vms(list(by_name), on_powered_off=released.append)
+    return results, released
+
+
+def test_failed_forced_poweroff_reports_task_error(service):
+    vm = FakeVM('legacy', tools=False, task_error='Permiso denegado: VirtualMachine.Interact.PowerOff')
+    
+    results, released = poweroff(service, vm)
+    
+    assert results['legacy']['success'] is False
+    assert 'Permiso denegado: VirtualMachine.Interact.PowerOff' in results['legacy']['error']
+    assert released == []
+    # El fallo de la tarea corta la espera: no se pasa a la fase de forzado
+    assert len(service.waiter.calls) == 1
+    assert vm.forced == 1
+
+
+def test_forced_after_soft_timeout_reports_task_error(service):
+    stuck = FakeVM('stuck', obeys_shutdown=False, task_error='La VM está bloqueada por otra tarea')
+    good = FakeVM('good')
+    
+    results, released = poweroff(service, stuck, good)
+    
+    assert results['good']['success'] is True
+    assert results['stuck']['success'] is False
+    assert 'bloqueada por otra tarea' in results['stuck']['error']
+    assert released == ['good']
+    assert stuck.forced == 1
+    # Segunda espera: la VM rezagada y su tarea de apagado
+    assert len(service.waiter.calls) == 2
+    assert len(service.waiter.calls[1]) == 2
+
+
+def test_successful_forced_poweroff(service):
+    vm = FakeVM('legacy', tools=False)
+    
+    results, released = poweroff(service, vm)
+    
+    assert results['legacy']['success'] is True
+    assert released == ['legacy']
+    assert vm.forced == 1
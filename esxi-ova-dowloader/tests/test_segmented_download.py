@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Tests de la descarga segmentada (HTTP Range) contra un servidor HTTP local"""
+
+import os
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from export_journal import ExportJournal
+from vmware_service import VMwareService, ExportProgress
+
+SIZE = 3 * 1024 * 1024 + 123
+DATA = random.Random(6).randbytes(SIZE)
+
+
+class FakeLease:
+    """Lease sin vCenter: solo recibe el progreso"""
+    
+    def HttpNfcLeaseProgress(self, percent):
+        pass
+
+
+class DiskHandler(BaseHTTPRequestHandler):
+    """Sirve DATA respetando Range solo si el servidor lo admite"""
+    
+    def do_GET(self):
+        server = self.server
+        header = self.headers.get('Range')
+        server.requests.append(header)
+        
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', header or '')
+        if server.ranges and match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else SIZE - 1
+            body = DATA[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{SIZE}')
+        else:
+            body = DATA
+            self.send_response(200)
+        
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DiskHandler)
+    server.ranges = True
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def service():
+    service = VMwareService('vcenter.local', 'user', 'secret', segments_per_file=4, segment_min_size=1)
+    yield service
+    if service.transport:
+        service.transport.close()
+
+
+def url_of(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/disk-0.vmdk'
+
+
+def download(service, server, local_path, journal):
+    progress = ExportProgress(FakeLease(), SIZE)
+    service._download_file(url_of(server), str(local_path), SIZE, progress,
+                           journal=journal, file_name='disk-0.vmdk')
+    return progress
+
+
+def range_requests(server):
+    """Rangos pedidos para descargar (sin la sonda de un byte)"""
+    return sorted(r for r in server.requests if r and r != 'bytes=0-0')
+
+
+def test_multi_segment_download_matches_source(tmp_path, server, service):
+    local_path = tmp_path / 'disk-0.vmdk'
+    journal = ExportJournal()
+    
+    progress = download(service, server, local_path, journal)
+    
+    assert local_path.read_bytes() == DATA
+    assert len(range_requests(server)) == 4
+    assert progress.downloaded_bytes == SIZE
+    assert journal.is_complete('disk-0.vmdk')
+    assert journal.done_bytes('disk-0.vmdk') == SIZE
+
+
+def test_falls_back_to_single_stream_when_range_ignored(tmp_path, server, service):
+    server.ranges = False
+    local_path = tmp_path / 'disk-0.vmdk'
+    journal = ExportJournal()
+    
+    download(service, server, local_path, journal)
+    
+    assert local_path.read_bytes() == DATA
+    # La sonda recibe 200 y la descarga se hace con una única petición completa
+    assert server.requests == ['bytes=0-0', None]
+    assert len(journal.files['disk-0.vmdk']['ranges']) == 1
+
+
+def test_resumes_from_journaled_partial_segments(tmp_path, server, service):
+    local_path = tmp_path / 'disk-0.vmdk'
+    journal_path = tmp_path / 'journal.json'
+    
+    # Exportación anterior interrumpida: parte de los dos primeros rangos en disco
+    previous = ExportJournal(str(journal_path))
+    ranges = previous.plan_file('disk-0.vmdk', str(local_path), SIZE, 4)
+    done = {0: 100000, 1: 4096}
+    with open(local_path, 'wb') as f:
+        f.truncate(SIZE)
+        for index, nbytes in done.items():
+            start = ranges[index][0]
+            f.seek(start)
+            f.write(DATA[start:start + nbytes])
+            previous.advance('disk-0.vmdk', index, nbytes)
+    previous.flush()
+    
+    journal = ExportJournal(str(journal_path))
+    progress = download(service, server, local_path, journal)
+    
+    assert local_path.read_bytes() == DATA
+    expected = sorted(
+        f'bytes={start + done.get(index, 0)}-{end}'
+        for index, (start, end, _) in enumerate(ranges)
+    )
+    assert range_requests(server) == expected
+    assert progress.downloaded_bytes == SIZE
+    assert journal.is_complete('disk-0.vmdk')
+    assert os.path.exists(journal_path)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Tests de las trazas por fase de las exportaciones"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+
+def finished_job(trace):
+    return {
+        'id': 'job-1',
+        'vm_name': 'vm1',
+        'vcenter': 'vc1',
+        'status': 'completed',
+        'trace_id': trace.trace_id,
+        'spans': trace.spans()
+    }
+
+
+def test_otlp_file_writer_writes_in_background(tmp_path):
+    trace = tracing.Trace()
+    with tracing.activate(trace, 'export'):
+        with tracing.span('download', bytes=10):
+            pass
+    
+    writer = tracing.OtlpFileWriter(str(tmp_path / 'traces'))
+    writer.submit(finished_job(trace))
+    writer.flush()
+    
+    payload = json.loads((tmp_path / 'traces' / 'job-1.json').read_text(encoding='utf-8'))
+    spans = payload['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert [span['name'] for span in spans] == ['download', 'export']
+
+
+def test_spans_nest_and_record_errors():
+    trace = tracing.Trace()
+    
+    with tracing.activate(trace, 'export', vm_name='vm1') as root:
+        with tracing.span('lease_wait'):
+            pass
+        try:
+            with tracing.span('download', bytes=0) as download:
+                download.set_attribute('bytes', 1024)
+                raise IOError('conexión cerrada')
+        except IOError:
+            pass
+    
+    spans = {span['name']: span for span in trace.spans()}
+    assert spans['lease_wait']['parent_id'] == root.span_id
+    assert spans['download']['parent_id'] == root.span_id
+    assert spans['download']['status'] == 'error'
+    assert spans['download']['attributes'] == {'bytes': 1024, 'error': 'conexión cerrada'}
+    assert spans['export']['parent_id'] is None
+    assert spans['export']['status'] == 'ok'
+
+
+def test_span_without_trace_is_a_noop():
+    with tracing.span('download') as span:
+        span.set_attribute('bytes', 1)
+    
+    assert span is tracing.NOOP_SPAN
+    assert tracing.start_span('poweroff') is tracing.NOOP_SPAN
+
+
+def test_propagate_keeps_parent_in_worker_threads():
+    trace = tracing.Trace()
+    
+    def download(name):
+        with tracing.span('download_file', file=name):
+            pass
+    
+    with tracing.activate(trace, 'export') as root:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(tracing.propagate(download), ['disk1', 'disk2']))
+    
+    children = [span for span in trace.spans() if span['name'] == 'download_file']
+    assert sorted(span['attributes']['file'] for span in children) == ['disk1', 'disk2']
+    assert {span['parent_id'] for span in children} == {root.span_id}
+
+
+def test_filter_by_attribute_keeps_descendants_and_detaches_root():
+    trace = tracing.Trace()
+    
+    with tracing.activate(trace, 'poweroff_batch'):
+        for vm_name in ('vm1', 'vm2'):
+            with tracing.span('poweroff', vm_name=vm_name):
+                with tracing.span('shutdown_guest'):
+                    pass
+    
+    spans = trace.spans(vm_name='vm1')
+    assert [span['name'] for span in spans] == ['shutdown_guest', 'poweroff']
+    assert spans[1]['parent_id'] is None
+    assert spans[0]['parent_id'] == spans[1]['span_id']
+
+
+def test_on_change_receives_every_finished_span():
+    seen = []
+    trace = tracing.Trace(on_change=lambda spans: seen.append([span['name'] for span in spans]))
+    trace.add_span('queued', 1000, 2000, position=1)
+    
+    with tracing.activate(trace, 'export'):
+        pass
+    
+    assert seen == [['queued'], ['queued', 'export']]
+
+
+def test_otlp_payload():
+    trace = tracing.Trace()
+    trace.add_span('queued', 1000, 3000, position=2, resumed=True, ratio=1.5)
+    
+    payload = tracing.to_otlp(trace.trace_id, trace.spans(), {'vm.name': 'vm1'})
+    resource = payload['resourceSpans'][0]
+    otlp_span = resource['scopeSpans'][0]['spans'][0]
+    
+    assert {'key': 'service.name', 'value': {'stringValue': tracing.SERVICE_NAME}} in resource['resource']['attributes']
+    assert otlp_span['traceId'] == trace.trace_id and len(trace.trace_id) == 32
+    assert len(otlp_span['spanId']) == 16
+    assert otlp_span['parentSpanId'] == ''
+    assert (otlp_span['startTimeUnixNano'], otlp_span['endTimeUnixNano']) == ('1000', '3000')
+    assert otlp_span['attributes'] == [
+        {'key': 'position', 'value': {'intValue': '2'}},
+        {'key': 'resumed', 'value': {'boolValue': True}},
+        {'key': 'ratio', 'value': {'doubleValue': 1.5}}
+    ]
+    assert otlp_span['status'] == {'code': 1}
+
+
+def test_job_trace_endpoint(webapp):
+    scheduler = webapp.app_state['scheduler']
+    job_id = scheduler.submit([
+        {'vm_name': 'vm1', 'vcenter': 'vc1', 'download_dir': '.', 'poweroff_before': True}
+    ], hold=True)[0]
+    
+    trace = tracing.Trace(scheduler.get(job_id)['trace_id'])
+    with tracing.activate(trace, 'poweroff_batch'):
+        with tracing.span('poweroff', vm_name='vm1'):
+            pass
+    scheduler.fail(job_id, 'sin energía', spans=trace.spans(vm_name='vm1'))
+    
+    client = webapp.app.test_client()
+    payload = client.get(f'/api/jobs/{job_id}/trace').get_json()
+    spans = payload['resourceSpans'][0]['scopeSpans'][0]['spans']
+    
+    assert [span['name'] for span in spans] == ['poweroff']
+    assert spans[0]['traceId'] == trace.trace_id
+    assert client.get('/api/jobs/missing/trace').status_code == 404
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tracing - Spans de tiempo por fase de cada exportación
+Registra spans anidados (apagado, espera del lease, descarga de cada
+archivo, tar, limpieza...) en la traza del trabajo para saber en qué fase
+se fue el tiempo, y los exporta en el formato JSON de OTLP (OpenTelemetry)
+para cargarlos en herramientas locales
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Nombre del servicio en las trazas exportadas
+SERVICE_NAME = 'esxi-ova-downloader'
+
+# Span activo del contexto actual (se hereda en los hilos lanzados con propagate)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def _span_id():
+    """ID de span de 8 bytes en hexadecimal (formato OTLP)"""
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    """Intervalo de tiempo con nombre, padre y atributos"""
+    
+    def __init__(self, trace, name, parent_id=None, attributes=None, start_ns=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = _span_id()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.status = 'ok'
+    
+    def set_attribute(self, key, value):
+        """Añadir o cambiar un atributo"""
+        self.attributes[key] = value
+    
+    def record_error(self, error):
+        """Marcar el span como fallido (se guarda al cerrarlo)"""
+        self.status = 'error'
+        self.attributes['error'] = str(error)
+    
+    def end(self, status=None):
+        """Cerrar el span (solo la primera vez cuenta)"""
+        if self.end_ns is not None:
+            return
+        if status:
+            self.status = status
+        self.end_ns = time.time_ns()
+        self.trace._finish(self)
+    
+    def to_dict(self):
+        """Representación JSON guardada en el trabajo"""
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration': round((end_ns - self.start_ns) / 1e9, 3),
+            'status': self.status,
+            'attributes': self.attributes
+        }
+
+
+class _NoopSpan:
+    """Span sin traza activa: las llamadas no hacen nada"""
+    
+    span_id = None
+    
+    def set_attribute(self, key, value):
+        pass
+    
+    def record_error(self, error):
+        pass
+    
+    def end(self, status=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """
+    Traza de un trabajo (thread-safe)
+    
+    Guarda los spans terminados como dicts (los de trazas anteriores, como
+    el apagado de la VM, pueden añadirse ya cerrados) y avisa a on_change
+    cada vez que se cierra uno.
+    """
+    
+    def __init__(self, trace_id=None, spans=None, on_change=None):
+        """
+        Args:
+            trace_id: ID de traza de 16 bytes en hexadecimal (se genera si falta)
+            spans: Spans ya terminados (dicts de Span.to_dict)
+            on_change: Callable(lista de spans) invocado al cerrar cada span
+        """
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._spans = list(spans or [])
+    
+    def start_span(self, name, parent=None, **attributes):
+        """
+        Abrir un span que se cierra explícitamente con end()
+        
+        Args:
+            name: Nombre de la fase
+            parent: Span padre (por defecto el activo en el contexto si es de esta traza)
+            **attributes: Atributos del span
+        """
+        if parent is None:
+            current = _current_span.get()
+            parent = current if current is not None and current.trace is self else None
+        return Span(self, name, parent.span_id if parent else None, attributes)
+    
+    def _finish(self, span):
+        """Guardar un span cerrado y notificarlo"""
+        with self._lock:
+            self._spans.append(span.to_dict())
+            spans = list(self._spans)
+        
+        if self.on_change:
+            try:
+                self.on_change(spans)
+            except Exception as e:
+                logger.debug(f"Error notificando span {span.name}: {str(e)}")
+    
+    def add_span(self, name, start_ns, end_ns, **attributes):
+        """Añadir un span ya terminado (ej: tiempo en cola)"""
+        span = Span(self, name, attributes=attributes, start_ns=start_ns)
+        span.end_ns = end_ns
+        self._finish(span)
+    
+    def add_spans(self, spans):
+        """Añadir spans terminados de otra traza"""
+        with self._lock:
+            self._spans.extend(spans)
+    
+    def spans(self, **attributes):
+        """
+        Spans terminados, opcionalmente filtrados por atributos
+        
+        Con filtro se devuelven también sus descendientes, y el span raíz
+        del resultado pierde el padre que queda fuera.
+        """
+        with self._lock:
+            spans = [dict(span) for span in self._spans]
+        
+        if not attributes:
+            return spans
+        
+        selected = {
+            span['span_id'] for span in spans
+            if all(span['attributes'].get(k) == v for k, v in attributes.items())
+        }
+        # Añadir descendientes hasta que no cambie el conjunto
+        while True:
+            children = {
+                span['span_id'] for span in spans
+                if span['parent_id'] in selected and span['span_id'] not in selected
+            }
+            if not children:
+                break
+            selected |= children
+        
+        result = [span for span in spans if span['span_id'] in selected]
+        for span in result:
+            if span['parent_id'] not in selected:
+                span['parent_id'] = None
+        return result
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Medir un bloque como span hijo del span activo
+    
+    Sin traza activa no se registra nada (para usar el mismo código fuera
+    de un trabajo). Una excepción marca el span con status 'error'.
+    
+    Yields:
+        Span (o un span nulo sin traza activa)
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    
+    child = parent.trace.start_span(name, parent=parent, **attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def start_span(name, **attributes):
+    """
+    Abrir un span hijo del activo sin hacerlo activo (para fases que se
+    solapan, como el apagado de varias VMs a la vez); se cierra con end()
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return parent.trace.start_span(name, parent=parent, **attributes)
+
+
+@contextmanager
+def activate(trace, name, **attributes):
+    """
+    Abrir el span raíz de una traza y hacerlo activo en este contexto
+    
+    Yields:
+        Span raíz
+    """
+    root = Span(trace, name, attributes=attributes)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        root.end()
+
+
+def propagate(func):
+    """
+    Envolver un callable para que herede el span activo al ejecutarse en
+    otro hilo (ThreadPoolExecutor no copia el contexto)
+    """
+    context = contextvars.copy_context()
+    
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    
+    return wrapper
+
+
+def _otlp_value(value):
+    """Valor de atributo en formato OTLP/JSON"""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(trace_id, spans, resource_attributes=None):
+    """
+    Convertir los spans de un trabajo al formato JSON de OTLP
+    
+    El resultado es un ExportTraceServiceRequest que aceptan los receptores
+    OTLP/HTTP (POST /v1/traces) y las herramientas que leen su JSON.
+    
+    Args:
+        trace_id: ID de traza del trabajo
+        spans: Lista de dicts de Span.to_dict
+        resource_attributes: Atributos del recurso (ej: VM, vCenter)
+    
+    Returns:
+        Dict serializable a JSON
+    """
+    attributes = {'service.name': SERVICE_NAME}
+    attributes.update(resource_attributes or {})
+    
+    return {
+        'resourceSpans': [{
+            'resource': {
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in attributes.items()]
+            },
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [
+                    {
+                        'traceId': trace_id,
+                        'spanId': span['span_id'],
+                        'parentSpanId': span['parent_id'] or '',
+                        'name': span['name'],
+                        'kind': 1,  # SPAN_KIND_INTERNAL
+                        'startTimeUnixNano': str(span['start_ns']),
+                        'endTimeUnixNano': str(span['end_ns'] or span['start_ns']),
+                        'attributes': [
+                            {'key': k, 'value': _otlp_value(v)} for k, v in span['attributes'].items()
+                        ],
+                        # STATUS_CODE_OK = 1, STATUS_CODE_ERROR = 2
+                        'status': {'code': 2 if span['status'] == 'error' else 1}
+                    }
+                    for span in spans
+                ]
+            }]
+        }]
+    }
+
+
+def write_otlp_file(directory, job):
+    """
+    Guardar la traza de un trabajo terminado como <id>.json en formato OTLP
+    
+    Args:
+        directory: Directorio de destino
+        job: Dict del trabajo (con trace_id y spans)
+    
+    Returns:
+        Ruta del archivo o None si el trabajo no tiene spans
+    """
+    if not job.get('spans') or not job.get('trace_id'):
+        return None
+    
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{job['id']}.json")
+    payload = to_otlp(job['trace_id'], job['spans'], {
+        'vm.name': job['vm_name'],
+        'vcenter': job.get('vcenter'),
+        'job.id': job['id'],
+        'job.status': job['status']
+    })
+    
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+    return path
+
+
+class OtlpFileWriter:
+    """
+    Escritor de trazas en segundo plano
+    
+    Los trabajos terminados se encolan desde el planificador (con su lock
+    tomado) y un hilo propio los guarda con write_otlp_file, para no hacer
+    E/S de disco en la notificación del evento.
+    """
+    
+    def __init__(self, directory):
+        """
+        Args:
+            directory: Directorio de destino de los archivos <id>.json
+        """
+        self.directory = directory
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='otlp-writer', daemon=True)
+        self._thread.start()
+    
+    def submit(self, job):
+        """Encolar la traza de un trabajo terminado (copia que no se modificará)"""
+        self._queue.put(job)
+    
+    def flush(self):
+        """Esperar a que se hayan escrito las trazas encoladas"""
+        self._queue.join()
+    
+    def _run(self):
+        """Hilo escritor: guarda las trazas en el orden en que llegan"""
+        while True:
+            job = self._queue.get()
+            try:
+                write_otlp_file(self.directory, job)
+            except OSError as e:
+                logger.warning(f"No se pudo guardar la traza de {job['vm_name']}: {str(e)}")
+            finally:
+                self._queue.task_done()
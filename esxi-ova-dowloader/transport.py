@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Download Transport - Conexiones HTTP reutilizables para descargas NFC
+Mantiene un requests.Session con pool de conexiones keep-alive por host,
+buffer de recepción configurable y autenticación con la cookie de sesión
+de vCenter en lugar de reenviar credenciales en cada petición
+"""
+
+import logging
+import socket
+import threading
+import requests
+from http.cookies import SimpleCookie
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+logger = logging.getLogger(__name__)
+
+# Nombre de la cookie de sesión SOAP de vCenter
+SESSION_COOKIE_NAME = 'vmware_soap_session'
+
+# Tamaño por defecto de los chunks leídos de la red
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+# Buffer de recepción del socket (0 = el del sistema)
+DEFAULT_RECV_BUFFER = 4 * 1024 * 1024  # 4 MB
+
+
+def parse_session_cookie(raw_cookie):
+    """
+    Extraer el valor de vmware_soap_session de la cookie del stub de pyVmomi
+    
+    Args:
+        raw_cookie: Cabecera Set-Cookie guardada por el stub (ej: si._stub.cookie)
+    
+    Returns:
+        str con el valor de la cookie o None si no está
+    """
+    if not raw_cookie:
+        return None
+    
+    try:
+        cookie = SimpleCookie()
+        cookie.load(raw_cookie)
+        morsel = cookie.get(SESSION_COOKIE_NAME)
+        return morsel.value if morsel else None
+    except Exception as e:
+        logger.debug(f"Cookie de sesión no interpretable: {str(e)}")
+        return None
+
+
+def abort_response(response):
+    """
+    Cortar una descarga en curso desde otro hilo
+    
+    Cierra el socket con shutdown() para que la lectura bloqueada en el hilo
+    de la descarga vuelva de inmediato con error, y después cierra la
+    respuesta; la conexión se descarta en lugar de volver al pool.
+    
+    Args:
+        response: requests.Response abierta en modo stream
+    """
+    raw = response.raw
+    connection = getattr(raw, '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    
+    if sock is None:
+        # Conexión ya liberada del pool: el socket sigue en el stream de http.client
+        fp = getattr(getattr(raw, '_fp', None), 'fp', None)
+        sock = getattr(getattr(fp, 'raw', None), '_sock', None)
+    
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    try:
+        response.close()
+    except Exception as e:
+        logger.debug(f"Error cerrando respuesta abortada: {str(e)}")
+
+
+class _TunedAdapter(HTTPAdapter):
+    """HTTPAdapter que aplica opciones de socket a las conexiones del pool"""
+    
+    def __init__(self, socket_options, **kwargs):
+        self._socket_options = socket_options
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self._socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class DownloadTransport:
+    """
+    Transporte HTTP compartido por todas las descargas de un VMwareService
+    
+    El Session de requests es seguro para usar desde varios hilos mientras
+    no se modifique su configuración; cada descarga toma una conexión del
+    pool del host y la devuelve al cerrar la respuesta.
+    """
+    
+    def __init__(self, verify_ssl=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                 recv_buffer=DEFAULT_RECV_BUFFER, pool_size=10, auth=None):
+        """
+        Args:
+            verify_ssl: Verificar certificados SSL
+            chunk_size: Bytes leídos de la red por iteración
+            recv_buffer: Tamaño de SO_RCVBUF en bytes (0 = el del sistema)
+            pool_size: Conexiones keep-alive por host
+            auth: Tupla (usuario, contraseña) si no hay cookie de sesión
+        """
+        self.verify_ssl = verify_ssl
+        self.chunk_size = chunk_size
+        self.recv_buffer = recv_buffer
+        self.pool_size = pool_size
+        self.auth = auth
+        self._lock = threading.Lock()
+        
+        socket_options = list(HTTPConnection.default_socket_options)
+        if recv_buffer:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer))
+        
+        adapter = _TunedAdapter(
+            socket_options,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+        
+        self.session = requests.Session()
+        self.session.verify = verify_ssl
+        self.session.headers['User-Agent'] = 'VMware-client'
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def use_session_cookie(self, raw_cookie):
+        """
+        Autenticar las descargas con la cookie de sesión de vCenter
+        
+        Args:
+            raw_cookie: Cookie del stub de pyVmomi
+        
+        Returns:
+            bool: True si se encontró la cookie
+        """
+        value = parse_session_cookie(raw_cookie)
+        
+        with self._lock:
+            self.session.cookies.clear()
+            if value:
+                self.session.cookies.set(SESSION_COOKIE_NAME, value)
+        
+        return value is not None
+    
+    def has_session_cookie(self):
+        """Comprobar si las descargas usan la cookie de sesión"""
+        return SESSION_COOKIE_NAME in self.session.cookies
+    
+    def get(self, url, headers=None):
+        """
+        Abrir una descarga en streaming
+        
+        Args:
+            url: URL del archivo
+            headers: Cabeceras adicionales (ej: Range)
+        
+        Returns:
+            requests.Response abierta en modo stream
+        """
+        # Con cookie de sesión no se reenvían credenciales
+        auth = None if self.has_session_cookie() else self.auth
+        
+        return self.session.get(url, headers=headers, auth=auth, stream=True)
+    
+    def iter_into(self, response, buffer):
+        """
+        Leer el cuerpo de una respuesta sobre un buffer reutilizable
+        
+        Lee con readinto directamente del socket (http.client) sin crear un
+        objeto bytes por chunk. Si la respuesta viene codificada (gzip...) o
+        no expone el stream subyacente se usa iter_content.
+        
+        Args:
+            response: requests.Response abierta en modo stream
+            buffer: bytearray preasignado; su tamaño es el del chunk
+        
+        Yields:
+            memoryview sobre la parte del buffer recién leída (válida hasta
+            la siguiente iteración)
+        """
+        raw_fp = getattr(response.raw, '_fp', None)
+        encoding = response.headers.get('Content-Encoding', 'identity').lower()
+        
+        if raw_fp is None or not hasattr(raw_fp, 'readinto') or encoding != 'identity':
+            for chunk in response.iter_content(chunk_size=len(buffer)):
+                yield memoryview(chunk)
+            return
+        
+        view = memoryview(buffer)
+        while True:
+            n = raw_fp.readinto(view)
+            if not n:
+                break
+            yield view[:n]
+        
+        # http.client no avisa si la conexión se cortó antes de Content-Length
+        if raw_fp.length:
+            raise IOError(f"Conexión cerrada con {raw_fp.length} bytes pendientes")
+        
+        # Cuerpo leído entero: devolver la conexión al pool para reutilizarla
+        response.raw.release_conn()
+    
+    def close(self):
+        """Cerrar las conexiones del pool"""
+        self.session.close()
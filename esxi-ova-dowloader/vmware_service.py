@@ -5,23 +5,241 @@ VMware Service - Gestión de vCenter y VMs
 Maneja conexión, listado de VMs, apagado y exportación OVA usando HttpNfcLease
 """
 
-from pyVim.connect import SmartConnect, Disconnect
 from pyVmomi import vim, vmodl
 import ssl
+import io
 import logging
 import os
+import re
+import shutil
+import tarfile
 import time
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from datetime import datetime
 from urllib.parse import urlparse
+from export_journal import ExportJournal, JOURNAL_FILENAME
+from cancellation import CancelToken, ExportCancelled
+from file_regions import preallocate_file, FileRegionWriter
+from ova_writer import StreamingOvaWriter, TarStreamWriter
+from compression import ParallelCompressedWriter, normalize_codec, CODECS
+from transport import DownloadTransport, abort_response, DEFAULT_CHUNK_SIZE, DEFAULT_RECV_BUFFER
+from checksums import (
+    FileDigest, digest_algorithms, digest_bytes, manifest_size, build_manifest,
+    DEFAULT_MANIFEST_ALGORITHM
+)
+from session_pool import SessionPool, DEFAULT_POOL_SIZE, DEFAULT_KEEPALIVE_INTERVAL
+from property_waiter import PropertyWaiter, TASK_DONE_STATES, LEASE_DONE_STATES
+from metrics import EXPORT_BYTES, observe_phase
+import tracing
+from inventory import (
+    retrieve_inventory, matches_filters, build_inventory_view, InventoryCache,
+    PropertyCollectorFeed, DEFAULT_INVENTORY_TTL, FACET_FIELDS, AmbiguousVMNameError
+)
 
 logger = logging.getLogger(__name__)
 
+# Descargas simultáneas por defecto de los discos de un mismo lease
+DEFAULT_MAX_PARALLEL_DISKS = 4
+
+# Tamaño mínimo de archivo para usar descarga segmentada por rangos
+DEFAULT_SEGMENT_MIN_SIZE = 256 * 1024 * 1024  # 256 MB
+
+# Segundos entre keep-alives del lease (muy por debajo de su timeout de 5 minutos)
+LEASE_PROGRESS_INTERVAL = 15
+
+# Coalescencia del callback de progreso: como mucho uno por segundo salvo
+# que el porcentaje avance varios puntos de golpe
+PROGRESS_CALLBACK_INTERVAL = 1.0
+PROGRESS_CALLBACK_STEP = 5
+
+
+def path_component(value):
+    """Convertir un host, MoRef o nombre en un componente de ruta seguro"""
+    return re.sub(r'[^\w.-]', '_', str(value))
+
+
+class ExportProgress:
+    """
+    Progreso agregado de las descargas de un lease (thread-safe)
+    
+    Acumula los bytes de todos los archivos que se descargan en paralelo y
+    reporta un único porcentaje al lease (HttpNfcLeaseProgress) y al callback.
+    
+    Los reportes están limitados: el keep-alive del lease (una llamada SOAP)
+    se envía como mucho cada lease_interval segundos y el callback solo se
+    invoca si ha pasado callback_interval o el porcentaje ha avanzado
+    callback_step puntos. Por cada chunk solo se suman contadores.
+    
+    También lleva el límite de ancho de banda del trabajo, que todos los
+    streams de la exportación aplican a cada chunk leído de la red.
+    """
+    
+    def __init__(self, lease, total_bytes, progress_callback=None,
+                 lease_interval=LEASE_PROGRESS_INTERVAL,
+                 callback_interval=PROGRESS_CALLBACK_INTERVAL,
+                 callback_step=PROGRESS_CALLBACK_STEP, bandwidth=None):
+        """
+        Args:
+            lease: HttpNfcLease para actualizar progreso
+            total_bytes: Total de bytes a descargar
+            progress_callback: Función callback(progress, message)
+            lease_interval: Segundos mínimos entre HttpNfcLeaseProgress
+            callback_interval: Segundos mínimos entre callbacks
+            callback_step: Puntos porcentuales que fuerzan un callback antes de tiempo
+            bandwidth: JobBandwidth del trabajo (None = sin límite)
+        """
+        self.lease = lease
+        self.bandwidth = bandwidth
+        self.download_seconds = 0.0
+        self.total_bytes = total_bytes or 0
+        self.progress_callback = progress_callback
+        self.lease_interval = lease_interval
+        self.callback_interval = callback_interval
+        self.callback_step = callback_step
+        self.downloaded_bytes = 0
+        self.lease_updates = 0
+        self.callbacks = 0
+        self._files = {}  # nombre -> [descargado, tamaño] de archivos activos
+        self._lock = threading.Lock()
+        
+        now = time.monotonic()
+        self._last_lease_update = now
+        self._last_callback = now
+        self._last_callback_percent = 0
+    
+    def start_file(self, file_name, file_size):
+        """Registrar el inicio de la descarga de un archivo"""
+        with self._lock:
+            self._files[file_name] = [0, file_size or 0]
+    
+    def finish_file(self, file_name):
+        """Registrar el fin de la descarga de un archivo"""
+        with self._lock:
+            self._files.pop(file_name, None)
+    
+    def _percent(self, current_total):
+        """Porcentaje de descarga (0-100)"""
+        if self.total_bytes <= 0:
+            return 0
+        return min(int((current_total / self.total_bytes) * 100), 100)  # No exceder 100%
+    
+    def _message(self, file_name):
+        """Mensaje de estado de los archivos activos (con el lock tomado)"""
+        file_state = self._files.get(file_name)
+        
+        if len(self._files) > 1:
+            active_total = sum(size for _, size in self._files.values())
+            active_done = sum(done for done, _ in self._files.values())
+            return (
+                f'Descargando {len(self._files)} archivos: '
+                f'{active_done / (1024 * 1024):.1f}/{active_total / (1024 * 1024):.1f} MB'
+            )
+        
+        if file_state:
+            return (
+                f'Descargando {file_name}: '
+                f'{file_state[0] / (1024 * 1024):.1f}/{file_state[1] / (1024 * 1024):.1f} MB'
+            )
+        
+        if file_name is None:
+            return f'Descargados {self.downloaded_bytes / (1024 * 1024):.1f} MB'
+        
+        return f'Descargando {file_name}...'
+    
+    def add(self, file_name, nbytes):
+        """
+        Sumar bytes descargados de un archivo y reportar el progreso si toca
+        
+        Args:
+            file_name: Archivo al que pertenecen los bytes
+            nbytes: Bytes escritos
+        """
+        with self._lock:
+            self.downloaded_bytes += nbytes
+            
+            file_state = self._files.get(file_name)
+            if file_state:
+                file_state[0] += nbytes
+        
+        self.report(file_name)
+    
+    def received(self, nbytes, host=None):
+        """
+        Registrar bytes recién leídos de la red: métricas y límite de ancho de banda
+        
+        Args:
+            nbytes: Bytes del chunk
+            host: Host ESXi del que se descargan
+        """
+        EXPORT_BYTES.inc(nbytes, host=host or 'unknown')
+        if self.bandwidth:
+            self.bandwidth.throttle(nbytes, host)
+    
+    def report(self, file_name=None, force=False):
+        """
+        Enviar keep-alive al lease y/o callback si ha vencido su intervalo
+        
+        Args:
+            file_name: Archivo que motiva el reporte (para el mensaje)
+            force: Reportar aunque no haya vencido ningún intervalo
+        """
+        now = time.monotonic()
+        
+        with self._lock:
+            percent = self._percent(self.downloaded_bytes)
+            
+            lease_due = force or now - self._last_lease_update >= self.lease_interval
+            if lease_due:
+                self._last_lease_update = now
+                self.lease_updates += 1
+            
+            callback_due = self.progress_callback is not None and (
+                force
+                or now - self._last_callback >= self.callback_interval
+                or percent - self._last_callback_percent >= self.callback_step
+            )
+            if callback_due:
+                self._last_callback = now
+                self._last_callback_percent = percent
+                self.callbacks += 1
+                message = self._message(file_name)
+        
+        # Actualizar progreso del lease (mantiene el lease vivo)
+        if lease_due:
+            try:
+                self.lease.HttpNfcLeaseProgress(percent)
+            except:
+                pass
+        
+        # Callback de progreso
+        if callback_due:
+            if self.total_bytes > 0:
+                overall_progress = 10 + int(percent * 70 / 100)
+                overall_progress = min(overall_progress, 80)  # Max 80% durante descarga
+            else:
+                overall_progress = 10
+            
+            self.progress_callback(overall_progress, message)
+    
+    def flush(self):
+        """Reportar el estado final al lease y al callback"""
+        self.report(force=True)
+
 
 class VMwareService:
     """Servicio para interactuar con vCenter y ESXi"""
     
-    def __init__(self, host, username, password, verify_ssl=False):
+    def __init__(self, host, username, password, verify_ssl=False,
+                 inventory_ttl=DEFAULT_INVENTORY_TTL,
+                 max_parallel_disks=DEFAULT_MAX_PARALLEL_DISKS,
+                 segments_per_file=1, segment_min_size=DEFAULT_SEGMENT_MIN_SIZE,
+                 stream_ova=True, chunk_size=DEFAULT_CHUNK_SIZE,
+                 recv_buffer=DEFAULT_RECV_BUFFER, zero_copy=True, drop_page_cache=False,
+                 manifest_algorithm=DEFAULT_MANIFEST_ALGORITHM, compression_level=None,
+                 compression_threads=None, session_pool_size=DEFAULT_POOL_SIZE,
+                 session_keepalive=DEFAULT_KEEPALIVE_INTERVAL):
         """
         Inicializar servicio de VMware
         
@@ -30,13 +248,47 @@ class VMwareService:
             username: Usuario de vCenter
             password: Contraseña
             verify_ssl: Verificar certificados SSL (False por defecto)
+            inventory_ttl: Segundos de vigencia de la caché de inventario (0 = sin caché)
+            max_parallel_disks: Discos de un mismo lease descargados en paralelo
+            segments_per_file: Rangos HTTP paralelos por archivo (1 = un único stream)
+            segment_min_size: Tamaño mínimo en bytes para segmentar un archivo
+            stream_ova: Escribir las descargas directamente dentro del OVA
+            chunk_size: Bytes leídos de la red por iteración en las descargas
+            recv_buffer: Buffer de recepción del socket en bytes (0 = el del sistema)
+            zero_copy: Leer del socket sobre un buffer reutilizado (readinto)
+            drop_page_cache: Liberar de la caché de páginas lo ya escrito (posix_fadvise)
+            manifest_algorithm: Algoritmo del manifiesto .mf del OVA ('sha256', 'sha1'
+                                para herramientas antiguas o 'none' sin checksums)
+            compression_level: Nivel de compresión (None = el del codec)
+            compression_threads: Hilos de compresión (None = número de CPUs)
+            session_pool_size: Sesiones de vCenter de trabajo simultáneas
+            session_keepalive: Segundos de inactividad antes de refrescar una
+                               sesión (0 = sin keep-alive)
         """
         self.host = host
         self.username = username
         self.password = password
         self.verify_ssl = verify_ssl
-        self.si = None  # Service Instance
+        self.inventory_ttl = inventory_ttl
+        self.max_parallel_disks = max_parallel_disks
+        self.segments_per_file = segments_per_file
+        self.segment_min_size = segment_min_size
+        self.stream_ova = stream_ova
+        self.chunk_size = chunk_size
+        self.recv_buffer = recv_buffer
+        self.zero_copy = zero_copy
+        self.drop_page_cache = drop_page_cache
+        self.manifest_algorithm = manifest_algorithm
+        self.digest_algorithms = digest_algorithms(manifest_algorithm)
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
+        self.session_pool_size = session_pool_size
+        self.session_keepalive = session_keepalive
+        self.pool = None  # Pool de sesiones de vCenter
+        self.si = None  # Service Instance de la sesión principal
         self.content = None
+        self.inventory = None  # Caché de inventario
+        self.transport = None  # Pool HTTP de descargas
         
     def connect(self):
         """
@@ -51,16 +303,28 @@ class VMwareService:
             if not self.verify_ssl:
                 context = ssl._create_unverified_context()
             
-            # Conectar a vCenter
-            self.si = SmartConnect(
-                host=self.host,
-                user=self.username,
-                pwd=self.password,
-                sslContext=context
+            # Conectar a vCenter: la sesión principal valida las credenciales
+            self.pool = SessionPool(
+                self.host,
+                self.username,
+                self.password,
+                ssl_context=context,
+                size=self.session_pool_size,
+                keepalive_interval=self.session_keepalive,
+                on_login=self._on_session_login
             )
+            primary = self.pool.open()
             
-            if self.si:
-                self.content = self.si.RetrieveContent()
+            if primary:
+                self.si = primary.si
+                self.content = primary.content
+                
+                if self.inventory_ttl > 0:
+                    self.inventory = InventoryCache(
+                        lambda: PropertyCollectorFeed(self._inventory_content()),
+                        ttl=self.inventory_ttl
+                    )
+                
                 logger.info(f"Conectado a vCenter: {self.host}")
                 return True
             
@@ -68,19 +332,63 @@ class VMwareService:
             
         except Exception as e:
             logger.error(f"Error conectando a vCenter: {str(e)}")
+            if self.pool:
+                self.pool.close()
+                self.pool = None
             return False
     
+    def _on_session_login(self, session):
+        """Actualizar la cookie de las descargas cuando la sesión principal (re)inicia sesión"""
+        if self.pool is None or (self.pool.primary is not None and session is not self.pool.primary):
+            return
+        
+        # Las descargas NFC reutilizan la sesión SOAP (sin reenviar credenciales)
+        if not self._get_transport().use_session_cookie(session.cookie):
+            logger.warning("Sin cookie de sesión de vCenter: las descargas usarán autenticación básica")
+    
     def disconnect(self):
         """Desconectar de vCenter"""
         try:
-            if self.si:
-                Disconnect(self.si)
+            if self.inventory:
+                self.inventory.close()
+                self.inventory = None
+            
+            if self.transport:
+                self.transport.close()
+                self.transport = None
+            
+            if self.pool:
+                self.pool.close()
+                self.pool = None
                 self.si = None
                 self.content = None
                 logger.info("Desconectado de vCenter")
         except Exception as e:
             logger.error(f"Error desconectando: {str(e)}")
     
+    def _current_session(self):
+        """
+        Sesión de vCenter del hilo actual
+        
+        Returns:
+            La sesión de trabajo reservada por el hilo o, si no tiene, la principal
+        """
+        return self.pool.current() or self.pool.primary
+    
+    def _inventory_content(self):
+        """
+        ServiceContent de la sesión dedicada del inventario
+        
+        Las consultas de inventario (RetrievePropertiesEx, WaitForUpdatesEx)
+        van por su propia sesión del pool para no competir con las
+        exportaciones ni con las descargas NFC de la sesión principal.
+        """
+        return self.pool.dedicated('inventario').content
+    
+    def _waiter(self):
+        """PropertyWaiter sobre la sesión del hilo actual"""
+        return PropertyWaiter(self._current_session().content)
+    
     def get_obj(self, vimtype, name=None):
         """
         Obtener objeto de vCenter por tipo y nombre
@@ -93,8 +401,9 @@ class VMwareService:
             Objeto o lista de objetos
         """
         obj = None
-        container = self.content.viewManager.CreateContainerView(
-            self.content.rootFolder, vimtype, True
+        content = self._current_session().content
+        container = content.viewManager.CreateContainerView(
+            content.rootFolder, vimtype, True
         )
         
         if name:
@@ -108,6 +417,41 @@ class VMwareService:
         container.Destroy()
         return obj
     
+    def find_vm(self, vm_name, moref=None):
+        """
+        Buscar una VM por nombre o MoRef (ej: vm-123) usando el índice del inventario
+        
+        Con moref la VM se busca solo por su MoRef, de modo que un renombrado
+        o una VM nueva con el mismo nombre no cambian la VM exportada; el
+        nombre solo se usa si no se conoce el MoRef (ej: trabajos antiguos).
+        
+        Args:
+            vm_name: Nombre o MoRef de la VM
+            moref: MoRef de la VM del inventario (opcional)
+            
+        Returns:
+            VirtualMachine o None si no existe
+            
+        Raises:
+            AmbiguousVMNameError: Si varias VMs tienen ese nombre
+        """
+        if not self.inventory:
+            vm = self.get_obj([vim.VirtualMachine], vm_name)
+            return None if moref and vm is not None and vm._moId != moref else vm
+        
+        if moref:
+            vm = self.inventory.get_vm(moref)
+        else:
+            vm = self.inventory.find_vm(vm_name)
+            
+            if vm is None:
+                obj = self.inventory.snapshot().get_object(vm_name)
+                if isinstance(obj, vim.VirtualMachine):
+                    vm = obj
+        
+        # Las referencias del inventario son de su sesión dedicada
+        return self._current_session().bind(vm)
+    
     def get_vms(self, filters=None):
         """
         Obtener lista de VMs con metadatos
@@ -119,58 +463,7 @@ class VMwareService:
             Lista de diccionarios con información de VMs
         """
         try:
-            vms = self.get_obj([vim.VirtualMachine])
-            vm_list = []
-            
-            for vm in vms:
-                try:
-                    # Obtener información básica
-                    vm_info = {
-                        'name': vm.name,
-                        'power_state': vm.runtime.powerState,
-                        'host': vm.runtime.host.name if vm.runtime.host else 'N/A',
-                        'folder': vm.parent.name if vm.parent else 'N/A',
-                        'guest_os': vm.config.guestFullName if vm.config else 'N/A',
-                        'num_cpu': vm.config.hardware.numCPU if vm.config else 0,
-                        'memory_mb': vm.config.hardware.memoryMB if vm.config else 0,
-                        'annotation': vm.config.annotation if vm.config and vm.config.annotation else ''
-                    }
-                    
-                    # Obtener cluster
-                    cluster = 'N/A'
-                    if vm.runtime.host:
-                        host_obj = vm.runtime.host
-                        if hasattr(host_obj, 'parent') and host_obj.parent:
-                            if isinstance(host_obj.parent, vim.ClusterComputeResource):
-                                cluster = host_obj.parent.name
-                    
-                    vm_info['cluster'] = cluster
-                    
-                    # Obtener tamaño de disco
-                    total_storage_gb = 0
-                    if vm.config and vm.config.hardware.device:
-                        for device in vm.config.hardware.device:
-                            if isinstance(device, vim.vm.device.VirtualDisk):
-                                total_storage_gb += device.capacityInBytes / (1024**3)
-                    
-                    vm_info['storage_gb'] = round(total_storage_gb, 2)
-                    
-                    # Aplicar filtros si existen
-                    if filters:
-                        if 'host' in filters and vm_info['host'] != filters['host']:
-                            continue
-                        if 'cluster' in filters and vm_info['cluster'] != filters['cluster']:
-                            continue
-                        if 'power_state' in filters and vm_info['power_state'] != filters['power_state']:
-                            continue
-                        if 'folder' in filters and vm_info['folder'] != filters['folder']:
-                            continue
-                    
-                    vm_list.append(vm_info)
-                    
-                except Exception as e:
-                    logger.warning(f"Error procesando VM: {str(e)}")
-                    continue
+            vm_list = [vm for vm in self.get_vm_list() if matches_filters(vm, filters)]
             
             logger.info(f"Obtenidas {len(vm_list)} VMs")
             return vm_list
@@ -179,37 +472,91 @@ class VMwareService:
             logger.error(f"Error obteniendo VMs: {str(e)}")
             return []
     
-    def get_filter_options(self):
+    def get_vm_list(self):
         """
-        Obtener valores únicos para filtros
+        Obtener la lista completa de VMs desde la caché o desde vCenter
         
         Returns:
-            Dict con listas de valores únicos para cada filtro
+            Lista de diccionarios con información de VMs
         """
-        try:
-            vms = self.get_vms()
-            
-            hosts = sorted(list(set([vm['host'] for vm in vms if vm['host'] != 'N/A'])))
-            clusters = sorted(list(set([vm['cluster'] for vm in vms if vm['cluster'] != 'N/A'])))
-            folders = sorted(list(set([vm['folder'] for vm in vms if vm['folder'] != 'N/A'])))
-            power_states = sorted(list(set([vm['power_state'] for vm in vms])))
+        if self.inventory:
+            return self.inventory.vm_list()
+        
+        # Sin caché: una sola pasada del PropertyCollector para VMs, hosts, clusters y folders
+        return retrieve_inventory(self._inventory_content()).vm_list()
+    
+    def refresh_inventory(self):
+        """
+        Forzar la recarga completa de la caché de inventario
+        
+        Returns:
+            Dict con contadores de la caché
+        """
+        if self.inventory:
+            self.inventory.refresh()
+        
+        return self.get_inventory_stats()
+    
+    def get_inventory_stats(self):
+        """
+        Obtener contadores de la caché de inventario
+        
+        Returns:
+            Dict con hits, misses, staleness y antigüedad del snapshot
+        """
+        if not self.inventory:
+            return {'enabled': False}
+        
+        stats = self.inventory.get_stats()
+        stats['enabled'] = True
+        return stats
+    
+    def get_session_stats(self):
+        """
+        Obtener contadores del pool de sesiones de vCenter
+        
+        Returns:
+            Dict con sesiones creadas, ocupadas, logins y keep-alives
+        """
+        if not self.pool:
+            return {'enabled': False}
+        
+        stats = self.pool.get_stats()
+        stats['enabled'] = True
+        return stats
+    
+    def get_inventory_view(self, filters=None):
+        """
+        Obtener VMs filtradas, opciones de filtro y facetas con un solo recorrido
+        
+        Args:
+            filters: Dict con filtros opcionales (host, cluster, power_state, folder)
             
-            return {
-                'hosts': hosts,
-                'clusters': clusters,
-                'folders': folders,
-                'power_states': power_states
-            }
+        Returns:
+            Dict con vms, filter_options y facets (conteo de VMs por valor)
+        """
+        try:
+            view = build_inventory_view(self.get_vm_list(), filters)
+            logger.info(f"Obtenidas {len(view['vms'])} VMs")
+            return view
             
         except Exception as e:
-            logger.error(f"Error obteniendo opciones de filtro: {str(e)}")
+            logger.error(f"Error obteniendo vista de inventario: {str(e)}")
             return {
-                'hosts': [],
-                'clusters': [],
-                'folders': [],
-                'power_states': []
+                'vms': [],
+                'filter_options': {option: [] for option in FACET_FIELDS},
+                'facets': {option: {} for option in FACET_FIELDS}
             }
     
+    def get_filter_options(self):
+        """
+        Obtener valores únicos para filtros
+        
+        Returns:
+            Dict con listas de valores únicos para cada filtro
+        """
+        return self.get_inventory_view()['filter_options']
+    
     def poweroff_vm(self, vm_name, wait=True, timeout=120):
         """
         Apagar una VM
@@ -222,63 +569,194 @@ class VMwareService:
         Returns:
             Dict con success y mensaje
         """
+        return self.poweroff_vms([vm_name], wait=wait, timeout=timeout)[vm_name]
+    
+    def poweroff_vms(self, vm_names, wait=True, timeout=120, force_timeout=60,
+                     on_powered_off=None):
+        """
+        Apagar un lote de VMs a la vez
+        
+        Se pide el apagado suave (ShutdownGuest) de todas las VMs de golpe y se
+        espera a todas juntas con un único PropertyCollector sobre
+        runtime.powerState, sin bucles de sondeo por VM. Las VMs sin VMware
+        Tools se apagan directamente; las que no se apagan en timeout segundos
+        se fuerzan con PowerOffVM_Task y se espera otra vez por ellas.
+        
+        Args:
+            vm_names: Nombres o MoRefs de las VMs
+            wait: Esperar a que se apaguen completamente
+            timeout: Segundos de espera del apagado suave
+            force_timeout: Segundos de espera tras forzar el apagado
+            on_powered_off: Callable(nombre) invocado en cuanto cada VM está apagada
+            
+        Returns:
+            Dict nombre -> dict con success y mensaje o error
+        """
         try:
-            vm = self.get_obj([vim.VirtualMachine], vm_name)
+            # Las VMs y la espera usan una sesión de trabajo propia de este hilo
+            with self.pool.session():
+                return self._poweroff_vms(vm_names, wait, timeout, force_timeout, on_powered_off)
+        except Exception as e:
+            logger.error(f"Error apagando VMs: {str(e)}")
+            return {
+                vm_name: {'success': False, 'error': f'Error apagando VM: {str(e)}'}
+                for vm_name in vm_names
+            }
+    
+    def _poweroff_vms(self, vm_names, wait, timeout, force_timeout, on_powered_off):
+        """Apagado del lote con la sesión de vCenter del hilo ya reservada"""
+        results = {}
+        targets = {}  # moid -> (nombre, VirtualMachine)
+        tasks = {}  # moid de la tarea -> (PowerOffVM_Task en curso, VM)
+        spans = {}  # nombre -> span 'poweroff' abierto hasta que la VM se apaga
+        
+        def powered_off(name, message, measured=False):
+            results[name] = {'success': True, 'message': message}
+            if measured:
+                observe_phase('poweroff', time.monotonic() - started)
+            if name in spans:
+                spans.pop(name).end()
+            if on_powered_off:
+                on_powered_off(name)
+        
+        def force(vm):
+            """Forzar el apagado; la tarea se espera junto al estado de energía"""
+            vm_name = targets[vm._moId][0]
+            with tracing.span('force_poweroff', vm_name=vm_name):
+                task = vm.PowerOffVM_Task()
+            tasks[task._moId] = (task, vm)
+        
+        try:
+            for vm_name in dict.fromkeys(vm_names):
+                try:
+                    with tracing.span('find_vm', vm_name=vm_name):
+                        vm = self.find_vm(vm_name)
+                except AmbiguousVMNameError as e:
+                    results[vm_name] = {'success': False, 'error': str(e)}
+                    continue
+                
+                if not vm:
+                    results[vm_name] = {'success': False, 'error': f'VM no encontrada: {vm_name}'}
+                    continue
+                
+                # Verificar estado actual
+                if vm.runtime.powerState == 'poweredOff':
+                    powered_off(vm_name, f'VM ya está apagada: {vm_name}')
+                    continue
+                
+                targets[vm._moId] = (vm_name, vm)
             
-            if not vm:
-                return {
+            if not targets:
+                return results
+            
+            logger.info(f"Apagando {len(targets)} VMs")
+            started = time.monotonic()
+            
+            # Intentar apagado suave de todas a la vez (guest shutdown)
+            for vm_name, vm in targets.values():
+                spans[vm_name] = tracing.start_span('poweroff', vm_name=vm_name, method='guest')
+                try:
+                    with tracing.span('shutdown_guest', vm_name=vm_name):
+                        vm.ShutdownGuest()
+                    logger.info(f"Apagado suave iniciado para: {vm_name}")
+                except Exception:
+                    # VMware tools no disponible, apagar directamente
+                    logger.info(f"VMware Tools no disponible, apagando directamente: {vm_name}")
+                    spans[vm_name].set_attribute('method', 'hard')
+                    force(vm)
+            
+            if not wait:
+                for vm_name, _ in targets.values():
+                    results[vm_name] = {'success': True, 'message': f'Apagado iniciado: {vm_name}'}
+                    spans.pop(vm_name).end()
+                return results
+            
+            def is_off(power_state):
+                return power_state == vim.VirtualMachine.PowerState.poweredOff
+            
+            def on_done(obj, value):
+                entry = tasks.pop(obj._moId, None)
+                if entry is None:
+                    vm_name = targets[obj._moId][0]
+                    logger.info(f"VM apagada: {vm_name}")
+                    powered_off(vm_name, f'VM apagada exitosamente: {vm_name}', measured=True)
+                    return None
+                
+                vm = entry[1]
+                if value != vim.TaskInfo.State.error or targets[vm._moId][0] in results:
+                    return None
+                
+                # La tarea falló (permisos, VM bloqueada por otra tarea...): no
+                # esperar al timeout y conservar el error real de vCenter
+                vm_name = targets[vm._moId][0]
+                error = self._task_error(obj)
+                logger.error(f"Error forzando el apagado de {vm_name}: {error}")
+                results[vm_name] = {
                     'success': False,
-                    'error': f'VM no encontrada: {vm_name}'
+                    'error': f'Error forzando el apagado de {vm_name}: {error}'
                 }
+                if vm_name in spans:
+                    span = spans.pop(vm_name)
+                    span.record_error(error)
+                    span.end()
+                return [vm]
             
-            # Verificar estado actual
-            if vm.runtime.powerState == 'poweredOff':
-                return {
-                    'success': True,
-                    'message': f'VM ya está apagada: {vm_name}'
-                }
+            def watches(vms):
+                """Estado de energía de las VMs y estado de las tareas de apagado en curso"""
+                return (
+                    [(vm, 'runtime.powerState', is_off) for vm in vms]
+                    + [(task, 'info.state', lambda s: s in TASK_DONE_STATES) for task, _ in tasks.values()]
+                )
             
-            logger.info(f"Apagando VM: {vm_name}")
+            def still_on(pending):
+                return [obj for obj in pending if obj._moId in targets and targets[obj._moId][0] not in results]
             
-            # Intentar apagado suave primero (guest shutdown)
-            try:
-                vm.ShutdownGuest()
-                logger.info(f"Apagado suave iniciado para: {vm_name}")
-                
-                if wait:
-                    start_time = time.time()
-                    while time.time() - start_time < timeout:
-                        if vm.runtime.powerState == 'poweredOff':
-                            return {
-                                'success': True,
-                                'message': f'VM apagada exitosamente: {vm_name}'
-                            }
-                        time.sleep(2)
-                    
-                    # Si no se apagó, forzar
-                    logger.warning(f"Timeout en apagado suave, forzando: {vm_name}")
-                    task = vm.PowerOffVM_Task()
-                    self._wait_for_task(task)
+            _, pending = self._waiter().wait(
+                watches([vm for _, vm in targets.values()]), timeout, on_done
+            )
+            pending = still_on(pending)
+            
+            if pending:
+                # Si no se apagaron, forzar solo las rezagadas (las ya forzadas siguen con su tarea)
+                logger.warning(f"Timeout en apagado suave de {len(pending)} VMs, forzando")
+                forced = {vm._moId for _, vm in tasks.values()}
+                for vm in pending:
+                    spans[targets[vm._moId][0]].set_attribute('forced', True)
+                    if vm._moId not in forced:
+                        force(vm)
                 
-            except Exception as guest_error:
-                # VMware tools no disponible, apagar directamente
-                logger.info(f"VMware Tools no disponible, apagando directamente: {vm_name}")
-                task = vm.PowerOffVM_Task()
-                self._wait_for_task(task)
+                _, pending = self._waiter().wait(watches(pending), force_timeout, on_done)
+                pending = still_on(pending)
             
-            return {
-                'success': True,
-                'message': f'VM apagada exitosamente: {vm_name}'
-            }
+            for vm in pending:
+                vm_name = targets[vm._moId][0]
+                results[vm_name] = {
+                    'success': False,
+                    'error': f'Timeout esperando el apagado de {vm_name}'
+                }
+            
+            return results
             
         except Exception as e:
-            logger.error(f"Error apagando VM {vm_name}: {str(e)}")
-            return {
-                'success': False,
-                'error': f'Error apagando VM: {str(e)}'
-            }
+            logger.error(f"Error apagando VMs: {str(e)}")
+            for vm_name in vm_names:
+                results.setdefault(vm_name, {
+                    'success': False,
+                    'error': f'Error apagando VM: {str(e)}'
+                })
+            return results
+        
+        finally:
+            # Las VMs que no llegaron a apagarse cierran su span con error
+            for span in spans.values():
+                span.end('error')
+            
+            # El estado de energía cambió: sincronizar la caché en el próximo acceso
+            if targets and self.inventory:
+                self.inventory.mark_stale()
     
-    def export_vm_as_ova(self, vm_name, download_dir, progress_callback=None):
+    def export_vm_as_ova(self, vm_name, download_dir, progress_callback=None, compression=None,
+                         cancel_token=None, bandwidth=None, moref=None):
         """
         Exportar VM como OVA usando HttpNfcLease
         
@@ -286,17 +764,63 @@ class VMwareService:
             vm_name: Nombre de la VM
             download_dir: Directorio donde guardar el OVA
             progress_callback: Función callback(progress, message) para reportar progreso
+            compression: Codec para comprimir el OVA al vuelo ('gzip', 'zstd' o None)
+            cancel_token: CancelToken del trabajo; al cancelarlo se cierran las
+                          descargas, se aborta el lease y se borran los archivos parciales
+            bandwidth: JobBandwidth que limita el ancho de banda de las descargas (opcional)
+            moref: MoRef de la VM; si se indica se busca por él y no por nombre
             
         Returns:
-            Dict con success, file_path y mensaje
+            Dict con success, file_path, mensaje, checksums (digests por archivo
+            del OVA, calculados durante la descarga), compression (ratio y
+            throughput, solo si se comprime) y timings (segundos por fase:
+            lease_wait, download, finalize, total); cancelled=True si se canceló
         """
+        if cancel_token is None:
+            cancel_token = CancelToken()
+        
         try:
-            vm = self.get_obj([vim.VirtualMachine], vm_name)
+            # Lease, keep-alives y descriptor van por una sesión de trabajo propia
+            with self.pool.session():
+                return self._export_vm_as_ova(
+                    vm_name, download_dir, progress_callback, compression, cancel_token, bandwidth,
+                    moref
+                )
+        except ExportCancelled as e:
+            logger.info(f"Exportación de {vm_name} cancelada")
+            return {
+                'success': False,
+                'cancelled': True,
+                'error': str(e)
+            }
+        except Exception as e:
+            logger.error(f"Error exportando VM {vm_name}: {str(e)}")
+            return {
+                'success': False,
+                'error': f'Error exportando VM: {str(e)}'
+            }
+    
+    def _export_vm_as_ova(self, vm_name, download_dir, progress_callback, compression, cancel_token,
+                          bandwidth, moref):
+        """Exportación con la sesión de vCenter del hilo ya reservada"""
+        try:
+            codec = normalize_codec(compression)
+            cancel_token.check()
+            started = time.monotonic()
+            
+            try:
+                with tracing.span('find_vm', vm_name=vm_name, moref=moref or ''):
+                    vm = self.find_vm(vm_name, moref)
+            except AmbiguousVMNameError as e:
+                return {
+                    'success': False,
+                    'error': str(e)
+                }
             
             if not vm:
                 return {
                     'success': False,
-                    'error': f'VM no encontrada: {vm_name}'
+                    'error': f'VM no encontrada: {vm_name} ({moref})' if moref else f'VM no encontrada: {vm_name}'
                 }
             
             # Verificar que la VM esté apagada
@@ -312,10 +836,18 @@ class VMwareService:
                 progress_callback(5, 'Iniciando exportación...')
             
             # Crear HttpNfcLease para exportación
-            lease = vm.ExportVm()
-            
-            # Esperar a que el lease esté listo
-            state = self._wait_for_lease(lease)
+            lease_started = time.monotonic()
+            with tracing.span('lease_wait') as span:
+                lease = vm.ExportVm()
+                
+                # Cancelar aborta el lease en el acto: también despierta la espera de abajo
+                abort_handle = cancel_token.on_cancel(partial(self._abort_lease, lease))
+                
+                # Esperar a que el lease esté listo
+                state = self._wait_for_lease(lease)
+                span.set_attribute('state', str(state))
+            lease_wait = time.monotonic() - lease_started
+            cancel_token.check()
             
             if state != vim.HttpNfcLease.State.ready:
                 return {
@@ -329,11 +861,14 @@ class VMwareService:
             # Obtener información de los archivos a descargar
             lease_info = lease.info
             
-            # Crear directorio para archivos temporales
-            temp_dir = os.path.join(download_dir, f"temp_{vm_name}_{int(time.time())}")
+            # Directorio temporal estable por VM (vCenter + MoRef, los nombres se repiten):
+            # un reintento reutiliza lo ya descargado
+            temp_dir = os.path.join(
+                download_dir, f"temp_{path_component(self.host)}_{path_component(vm._moId)}"
+            )
             os.makedirs(temp_dir, exist_ok=True)
             
-            downloaded_files = []
+            journal = ExportJournal(os.path.join(temp_dir, JOURNAL_FILENAME))
             
             # Calcular total de bytes (con validación de None)
             total_bytes = 0
@@ -345,10 +880,12 @@ class VMwareService:
             if total_bytes == 0:
                 total_bytes = 1024 * 1024 * 1024  # 1GB como estimación
             
-            downloaded_bytes = 0
+            progress = ExportProgress(lease, total_bytes, progress_callback, bandwidth=bandwidth)
+            ova_path = None
             
             try:
-                # Descargar cada archivo (VMDK, OVF, etc.)
+                # Preparar la lista de archivos (VMDK, NVRAM, etc.) del lease
+                downloads = []
                 for device_url in lease_info.deviceUrl:
                     url = device_url.url
                     
@@ -361,64 +898,77 @@ class VMwareService:
                         # Extraer nombre del archivo de la URL
                         file_name = os.path.basename(urlparse(url).path)
                     
-                    local_path = os.path.join(temp_dir, file_name)
-                    
                     # Validar fileSize
                     file_size = device_url.fileSize if device_url.fileSize else 0
                     
-                    logger.info(f"Descargando: {file_name} ({file_size / (1024*1024):.2f} MB)")
-                    
-                    if progress_callback:
-                        progress_pct = 10 + int((downloaded_bytes / total_bytes) * 70) if total_bytes > 0 else 10
-                        progress_callback(
-                            progress_pct,
-                            f'Descargando {file_name}...'
-                        )
-                    
-                    # Descargar archivo
-                    self._download_file(
-                        url=url,
-                        local_path=local_path,
-                        file_size=file_size,
-                        lease=lease,
-                        total_bytes=total_bytes,
-                        downloaded_bytes=downloaded_bytes,
-                        progress_callback=progress_callback
-                    )
-                    
-                    downloaded_files.append(local_path)
-                    downloaded_bytes += file_size
+                    downloads.append({
+                        'url': url,
+                        'file_name': file_name,
+                        'device_key': device_url.key,
+                        'local_path': os.path.join(temp_dir, file_name),
+                        'file_size': file_size,
+                        'digest': FileDigest(self.digest_algorithms) if self.digest_algorithms else None
+                    })
                 
-                # Crear archivo OVA (tar de los archivos descargados)
-                if progress_callback:
-                    progress_callback(85, 'Creando archivo OVA...')
-                
-                ova_filename = f"{vm_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ova"
+                # Con el vCenter en el nombre, VMs homónimas de varios vCenters no se pisan
+                ova_filename = (
+                    f"{vm_name}_{path_component(self.host)}_"
+                    f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.ova"
+                )
+                if codec:
+                    ova_filename += CODECS[codec]['extension']
                 ova_path = os.path.join(download_dir, ova_filename)
+                compression_stats = None
+                transfer_started = time.monotonic()
                 
-                # Usar tar para crear OVA
-                import tarfile
-                with tarfile.open(ova_path, 'w') as tar:
-                    for file_path in downloaded_files:
-                        tar.add(file_path, arcname=os.path.basename(file_path))
+                # Comprimido: tar secuencial hacia el compresor. Sin comprimir y con
+                # todos los tamaños conocidos, el OVA se escribe directamente en streaming
+                if codec:
+                    logger.info(f"Exportando {vm_name} comprimido con {codec}")
+                    with tracing.span('transfer', mode='compressed', codec=codec, files=len(downloads)):
+                        checksums, compression_stats = self._export_compressed(
+                            vm, vm_name, downloads, temp_dir, ova_path, progress, journal, codec,
+                            progress_callback, cancel_token
+                        )
+                elif self.stream_ova and all(d['file_size'] for d in downloads):
+                    with tracing.span('transfer', mode='streaming', files=len(downloads)):
+                        checksums = self._export_streaming(
+                            vm, vm_name, downloads, temp_dir, ova_path, progress, journal,
+                            progress_callback, cancel_token
+                        )
+                else:
+                    logger.info(f"Exportando {vm_name} mediante archivos temporales")
+                    with tracing.span('transfer', mode='temp_files', files=len(downloads)):
+                        checksums = self._export_via_temp_files(
+                            vm, vm_name, downloads, ova_path, progress, journal,
+                            progress_callback, cancel_token
+                        )
                 
-                if progress_callback:
-                    progress_callback(95, 'Limpiando archivos temporales...')
+                # Último punto de cancelación: después el OVA ya está completo
+                cancel_token.check()
+                cancel_token.remove(abort_handle)
                 
-                # Limpiar archivos temporales
-                for file_path in downloaded_files:
+                with tracing.span('cleanup'):
+                    journal.discard()
                     try:
-                        os.remove(file_path)
+                        os.rmdir(temp_dir)
                     except:
                         pass
                 
-                try:
-                    os.rmdir(temp_dir)
-                except:
-                    pass
-                
                 # Completar el lease
-                lease.HttpNfcLeaseComplete()
+                with tracing.span('lease_complete'):
+                    lease.HttpNfcLeaseComplete()
+                
+                # Fases para /metrics: lo que no es descarga es tar/manifiesto/compresión final
+                finished = time.monotonic()
+                timings = {
+                    'lease_wait': round(lease_wait, 3),
+                    'download': round(progress.download_seconds, 3),
+                    'finalize': round(finished - transfer_started - progress.download_seconds, 3),
+                    'total': round(finished - started, 3)
+                }
+                for phase, seconds in timings.items():
+                    observe_phase(phase, seconds)
                 
                 if progress_callback:
                     progress_callback(100, 'Exportación completada')
@@ -428,21 +978,433 @@ class VMwareService:
                 return {
                     'success': True,
                     'file_path': ova_path,
-                    'message': f'VM exportada exitosamente: {ova_filename}'
+                    'message': f'VM exportada exitosamente: {ova_filename}',
+                    'checksums': checksums,
+                    'compression': compression_stats,
+                    'timings': timings
                 }
                 
             except Exception as download_error:
-                # Abortar el lease en caso de error
-                lease.HttpNfcLeaseAbort()
+                # Abortar el lease en caso de error (si se canceló ya lo abortó el token)
+                cancel_token.remove(abort_handle)
+                if not cancel_token.cancelled:
+                    self._abort_lease(lease)
+                
+                if cancel_token.cancelled:
+                    # Sin reanudación posible: fuera journal, temporales y OVA a medias
+                    with tracing.span('cleanup', cancelled=True):
+                        journal.discard()
+                        self._discard_partial_export(temp_dir, ova_path)
+                    raise ExportCancelled(cancel_token.reason) from download_error
                 raise download_error
                 
+        except ExportCancelled:
+            raise
         except Exception as e:
+            if cancel_token.cancelled:
+                raise ExportCancelled(cancel_token.reason) from e
             logger.error(f"Error exportando VM {vm_name}: {str(e)}")
             return {
                 'success': False,
                 'error': f'Error exportando VM: {str(e)}'
             }
     
+    def _abort_lease(self, lease):
+        """Abortar un lease NFC (HttpNfcLeaseAbort) ignorando si ya no está activo"""
+        try:
+            lease.HttpNfcLeaseAbort()
+        except Exception as e:
+            logger.debug(f"Error abortando lease: {str(e)}")
+    
+    def _discard_partial_export(self, temp_dir, ova_path):
+        """
+        Borrar los archivos de una exportación cancelada
+        
+        Args:
+            temp_dir: Directorio temporal de la exportación (descargas y .part)
+            ova_path: Ruta del OVA final, por si se llegó a crear a medias (o None)
+        """
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        
+        if ova_path:
+            try:
+                os.remove(ova_path)
+            except OSError:
+                pass
+    
+    def _create_ovf_descriptor(self, vm, vm_name, files):
+        """
+        Generar el descriptor OVF de la VM con OvfManager
+        
+        Args:
+            vm: VirtualMachine exportada
+            vm_name: Nombre de la VM
+            files: Lista de dicts con device_key, file_name y file_size
+            
+        Returns:
+            bytes con el descriptor o None si no se pudo generar
+        """
+        try:
+            ovf_files = [
+                vim.OvfManager.OvfFile(
+                    deviceId=f['device_key'],
+                    path=f['file_name'],
+                    size=f['file_size']
+                )
+                for f in files
+            ]
+            
+            params = vim.OvfManager.CreateDescriptorParams(name=vm_name, ovfFiles=ovf_files)
+            result = self._current_session().content.ovfManager.CreateDescriptor(obj=vm, cdp=params)
+            
+            if result.error:
+                logger.warning(f"Errores generando descriptor OVF de {vm_name}: {result.error}")
+                return None
+            
+            return result.ovfDescriptor.encode('utf-8')
+            
+        except Exception as e:
+            logger.warning(f"No se pudo generar el descriptor OVF de {vm_name}: {str(e)}")
+            return None
+    
+    def _manifest_name(self, vm_name):
+        """Nombre del manifiesto dentro del OVA o None si no hay checksums"""
+        return f'{vm_name}.mf' if self.digest_algorithms else None
+    
+    def _collect_checksums(self, vm_name, descriptor, downloads):
+        """
+        Reunir los digests del descriptor y de los archivos descargados
+        
+        Args:
+            vm_name: Nombre de la VM
+            descriptor: bytes del descriptor OVF o None
+            downloads: Lista de dicts de archivos del lease (con su FileDigest)
+        
+        Returns:
+            Lista de tuplas (nombre, dict algoritmo -> hexdigest) en orden del OVA
+        """
+        checksums = []
+        
+        if descriptor is not None:
+            checksums.append((f'{vm_name}.ovf', digest_bytes(descriptor, self.digest_algorithms)))
+        
+        for download in downloads:
+            digest = download['digest']
+            if digest.read_back:
+                logger.info(
+                    f"Checksum de {download['file_name']}: "
+                    f"{digest.read_back / (1024*1024):.2f} MB releídos del disco"
+                )
+            checksums.append((download['file_name'], digest.hexdigests()))
+        
+        return checksums
+    
+    def _export_streaming(self, vm, vm_name, downloads, temp_dir, ova_path, progress,
+                          journal, progress_callback=None, cancel_token=None):
+        """
+        Escribir el OVA en streaming: cada descarga va directa a su miembro del tar
+        
+        La disposición del tar se calcula con los tamaños del lease; el
+        descriptor OVF va primero, después el manifiesto (su tamaño se conoce
+        de antemano y se escribe al terminar las descargas) y los discos a
+        continuación. El OVA se construye como .part en el directorio temporal
+        y se renombra al final.
+        
+        Args:
+            vm: VirtualMachine exportada
+            vm_name: Nombre de la VM
+            downloads: Lista de dicts de archivos del lease (tamaños conocidos)
+            temp_dir: Directorio temporal de la exportación
+            ova_path: Ruta final del OVA
+            progress: ExportProgress compartido
+            journal: ExportJournal de la exportación
+            progress_callback: Callback para reportar progreso
+            cancel_token: CancelToken del trabajo (opcional)
+        
+        Returns:
+            Dict nombre -> digests de los archivos del OVA
+        """
+        with tracing.span('ovf_descriptor'):
+            descriptor = self._create_ovf_descriptor(vm, vm_name, downloads)
+        manifest_name = self._manifest_name(vm_name)
+        
+        members = []
+        if descriptor is not None:
+            members.append((f'{vm_name}.ovf', len(descriptor)))
+        if manifest_name:
+            listed = ([f'{vm_name}.ovf'] if descriptor is not None else [])
+            listed += [d['file_name'] for d in downloads]
+            members.append((manifest_name, manifest_size(self.manifest_algorithm, listed)))
+        members.extend((d['file_name'], d['file_size']) for d in downloads)
+        
+        part_path = os.path.join(temp_dir, f'{vm_name}.ova.part')
+        writer = StreamingOvaWriter(part_path, members)
+        
+        # Un .part previo solo se reutiliza si la disposición del tar no ha cambiado
+        writer.create(reuse=journal.use_layout(writer.layout()))
+        
+        if descriptor is not None:
+            writer.write_member(f'{vm_name}.ovf', descriptor)
+        
+        for download in downloads:
+            download['local_path'] = part_path
+            download['base_offset'] = writer.member_offset(download['file_name'])
+        
+        self._download_files_parallel(downloads, progress, journal, cancel_token)
+        
+        if progress_callback:
+            progress_callback(85, 'Finalizando archivo OVA...')
+        
+        checksums = []
+        if manifest_name:
+            with tracing.span('manifest', algorithm=self.manifest_algorithm):
+                checksums = self._collect_checksums(vm_name, descriptor, downloads)
+                writer.write_member(manifest_name, build_manifest(self.manifest_algorithm, checksums))
+        
+        os.replace(part_path, ova_path)
+        
+        return dict(checksums)
+    
+    def _export_via_temp_files(self, vm, vm_name, downloads, ova_path, progress, journal,
+                               progress_callback=None, cancel_token=None):
+        """
+        Descargar a archivos temporales y empaquetarlos después en el OVA
+        
+        Se usa cuando el lease no informa del tamaño de algún archivo y no se
+        puede calcular de antemano la disposición del tar.
+        
+        Args:
+            vm: VirtualMachine exportada
+            vm_name: Nombre de la VM
+            downloads: Lista de dicts de archivos del lease
+            ova_path: Ruta final del OVA
+            progress: ExportProgress compartido
+            journal: ExportJournal de la exportación
+            progress_callback: Callback para reportar progreso
+            cancel_token: CancelToken del trabajo (opcional)
+        
+        Returns:
+            Dict nombre -> digests de los archivos del OVA
+        """
+        self._download_files_parallel(downloads, progress, journal, cancel_token)
+        
+        downloaded_files = [d['local_path'] for d in downloads]
+        
+        # Crear archivo OVA (tar de los archivos descargados)
+        if progress_callback:
+            progress_callback(85, 'Creando archivo OVA...')
+        
+        for download in downloads:
+            download['file_size'] = os.path.getsize(download['local_path'])
+        
+        with tracing.span('ovf_descriptor'):
+            descriptor = self._create_ovf_descriptor(vm, vm_name, downloads)
+        
+        members = []
+        if descriptor is not None:
+            members.append((f'{vm_name}.ovf', descriptor))
+        
+        checksums = []
+        manifest_name = self._manifest_name(vm_name)
+        if manifest_name:
+            with tracing.span('manifest', algorithm=self.manifest_algorithm):
+                checksums = self._collect_checksums(vm_name, descriptor, downloads)
+                members.append((manifest_name, build_manifest(self.manifest_algorithm, checksums)))
+        
+        # Usar tar para crear OVA (el descriptor OVF debe ir primero y después el manifiesto)
+        tar_bytes = sum(d['file_size'] for d in downloads)
+        with tracing.span('tar', files=len(downloaded_files), bytes=tar_bytes):
+            with tarfile.open(ova_path, 'w') as tar:
+                for member_name, data in members:
+                    info = tarfile.TarInfo(member_name)
+                    info.size = len(data)
+                    info.mtime = int(time.time())
+                    tar.addfile(info, io.BytesIO(data))
+                
+                for file_path in downloaded_files:
+                    if cancel_token:
+                        cancel_token.check()
+                    tar.add(file_path, arcname=os.path.basename(file_path))
+        
+        if progress_callback:
+            progress_callback(95, 'Limpiando archivos temporales...')
+        
+        # Limpiar archivos temporales
+        with tracing.span('cleanup_temp_files', files=len(downloaded_files)):
+            for file_path in downloaded_files:
+                try:
+                    os.remove(file_path)
+                except:
+                    pass
+        
+        return dict(checksums)
+    
+    def _export_compressed(self, vm, vm_name, downloads, temp_dir, ova_path, progress,
+                           journal, codec, progress_callback=None, cancel_token=None):
+        """
+        Escribir el OVA comprimido al vuelo a partir de un stream secuencial
+        
+        El compresor necesita el tar en orden, así que los archivos se
+        descargan uno tras otro (sin rangos paralelos ni reanudación) y cada
+        chunk pasa directamente al compresor. Los archivos sin tamaño conocido
+        se descargan antes a temporal porque la cabecera tar lo necesita. El
+        manifiesto va al final del archivo, como permite OVF 2.0, porque los
+        digests no se conocen hasta haber descargado todo.
+        
+        Args:
+            vm: VirtualMachine exportada
+            vm_name: Nombre de la VM
+            downloads: Lista de dicts de archivos del lease
+            temp_dir: Directorio temporal de la exportación
+            ova_path: Ruta final del OVA comprimido
+            progress: ExportProgress compartido
+            journal: ExportJournal (solo para los archivos sin tamaño)
+            codec: 'gzip' o 'zstd'
+            progress_callback: Callback para reportar progreso
+            cancel_token: CancelToken del trabajo (opcional)
+        
+        Returns:
+            Tupla (dict nombre -> digests, métricas de compresión)
+        """
+        unsized = [d for d in downloads if not d['file_size']]
+        if unsized:
+            self._download_files_parallel(unsized, progress, journal, cancel_token)
+            for download in unsized:
+                download['file_size'] = os.path.getsize(download['local_path'])
+        
+        with tracing.span('ovf_descriptor'):
+            descriptor = self._create_ovf_descriptor(vm, vm_name, downloads)
+        manifest_name = self._manifest_name(vm_name)
+        
+        part_path = os.path.join(temp_dir, os.path.basename(ova_path) + '.part')
+        sink = ParallelCompressedWriter(
+            part_path, codec, self.compression_level, self.compression_threads
+        )
+        
+        try:
+            tar = TarStreamWriter(sink)
+            
+            if descriptor is not None:
+                tar.add_member(f'{vm_name}.ovf', descriptor)
+            
+            for download in downloads:
+                tar.begin_member(download['file_name'], download['file_size'])
+                if download in unsized:
+                    self._copy_file_into(download['local_path'], tar)
+                else:
+                    self._stream_file_into(download, tar, progress, cancel_token)
+                tar.end_member()
+            
+            checksums = []
+            if manifest_name:
+                with tracing.span('manifest', algorithm=self.manifest_algorithm):
+                    checksums = self._collect_checksums(vm_name, descriptor, downloads)
+                    tar.add_member(manifest_name, build_manifest(self.manifest_algorithm, checksums))
+            
+            if progress_callback:
+                progress_callback(85, 'Finalizando archivo OVA comprimido...')
+            
+            # Vaciar el compresor: los bloques pendientes se comprimen aquí
+            with tracing.span('compress_flush', codec=codec):
+                tar.finish()
+                sink.close()
+            
+        except Exception:
+            sink.abort()
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+        
+        os.replace(part_path, ova_path)
+        
+        for download in unsized:
+            try:
+                os.remove(download['local_path'])
+            except OSError:
+                pass
+        
+        stats = sink.stats()
+        logger.info(
+            f"Compresión {codec} de {vm_name}: ratio {stats['ratio']}, "
+            f"{stats['throughput_mb_s']} MB/s"
+        )
+        
+        return dict(checksums), stats
+    
+    def _stream_file_into(self, download, tar, progress, cancel_token=None):
+        """
+        Descargar un archivo del lease escribiéndolo en el miembro tar en curso
+        
+        Args:
+            download: Dict del archivo (url, file_name, file_size, digest)
+            tar: TarStreamWriter con el miembro ya abierto
+            progress: ExportProgress compartido
+            cancel_token: CancelToken que cierra la descarga al cancelarse (opcional)
+        """
+        file_name = download['file_name']
+        digest = download.get('digest')
+        host = urlparse(download['url']).hostname
+        transport = self._get_transport()
+        started = time.monotonic()
+        
+        progress.start_file(file_name, download['file_size'])
+        span = tracing.start_span('download_file', file_name=file_name, size=download['file_size'], host=host)
+        received = 0
+        
+        try:
+            response = self._open_stream(download['url'])
+            abort_handle = cancel_token.on_cancel(partial(abort_response, response)) if cancel_token else None
+            
+            try:
+                if self.zero_copy:
+                    chunks = transport.iter_into(response, bytearray(transport.chunk_size))
+                else:
+                    chunks = response.iter_content(chunk_size=transport.chunk_size)
+                
+                for chunk in chunks:
+                    if cancel_token:
+                        cancel_token.check()
+                    
+                    if chunk:
+                        tar.write(chunk)
+                        if digest:
+                            digest.update(chunk)
+                        received += len(chunk)
+                        progress.add(file_name, len(chunk))
+                        progress.received(len(chunk), host)
+                
+                if received != download['file_size']:
+                    raise Exception(
+                        f"Descarga incompleta de {file_name}: "
+                        f"{received}/{download['file_size']} bytes"
+                    )
+            finally:
+                if abort_handle:
+                    cancel_token.remove(abort_handle)
+                response.close()
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            span.set_attribute('bytes', received)
+            span.end()
+            progress.finish_file(file_name)
+            progress.download_seconds += time.monotonic() - started
+    
+    def _copy_file_into(self, path, tar):
+        """Copiar un archivo local ya descargado en el miembro tar en curso"""
+        buffer = bytearray(self._get_transport().chunk_size)
+        view = memoryview(buffer)
+        
+        with open(path, 'rb') as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                tar.write(view[:n])
+    
     def _wait_for_lease(self, lease, timeout=300):
         """
         Esperar a que el lease esté listo
@@ -454,95 +1416,350 @@ class VMwareService:
         Returns:
             Estado del lease
         """
-        start_time = time.time()
+        state = self._waiter().wait_one(lease, 'state', lambda s: s in LEASE_DONE_STATES, timeout)
         
-        while time.time() - start_time < timeout:
-            state = lease.state
-            
-            if state == vim.HttpNfcLease.State.ready:
-                return state
-            elif state == vim.HttpNfcLease.State.error:
-                logger.error(f"Error en lease: {lease.error}")
-                return state
-            
-            time.sleep(1)
+        if state == vim.HttpNfcLease.State.ready:
+            return state
+        elif state == vim.HttpNfcLease.State.error:
+            logger.error(f"Error en lease: {lease.error}")
+            return state
         
         logger.error("Timeout esperando lease")
         return lease.state
     
-    def _download_file(self, url, local_path, file_size, lease, total_bytes, 
-                       downloaded_bytes, progress_callback=None):
+    def _run_parallel(self, jobs, max_workers, abort_event, thread_name_prefix):
+        """
+        Ejecutar trabajos de descarga en un pool acotado
+        
+        Si un trabajo falla se activa abort_event para que los demás se detengan
+        en el siguiente chunk y se propaga el primer error.
+        
+        Args:
+            jobs: Lista de tuplas (etiqueta, callable sin argumentos)
+            max_workers: Máximo de hilos simultáneos
+            abort_event: threading.Event compartido por los trabajos
+            thread_name_prefix: Prefijo del nombre de los hilos
+        """
+        workers = max(1, min(max_workers, len(jobs)))
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix) as executor:
+            futures = {executor.submit(job): label for label, job in jobs}
+            
+            first_error = None
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    if first_error is None:
+                        first_error = e
+                        if not isinstance(e, ExportCancelled):
+                            logger.error(f"Error descargando {futures[future]}, abortando el resto: {str(e)}")
+                        abort_event.set()
+                        for pending in futures:
+                            pending.cancel()
+            
+            if first_error is not None:
+                raise first_error
+    
+    def _download_files_parallel(self, downloads, progress, journal=None, cancel_token=None):
+        """
+        Descargar los archivos de un lease en paralelo con un pool acotado
+        
+        Args:
+            downloads: Lista de dicts con url, local_path y file_size (y opcionalmente
+                       file_name y base_offset si se escribe dentro del OVA)
+            progress: ExportProgress compartido por todas las descargas
+            journal: ExportJournal donde registrar el progreso (opcional)
+            cancel_token: CancelToken del trabajo (opcional)
+        """
+        abort_event = threading.Event()
+        jobs = []
+        
+        for download in downloads:
+            file_name = download.get('file_name') or os.path.basename(download['local_path'])
+            logger.info(f"Descargando: {file_name} ({download['file_size'] / (1024*1024):.2f} MB)")
+            
+            jobs.append((file_name, partial(
+                self._download_file,
+                url=download['url'],
+                local_path=download['local_path'],
+                file_size=download['file_size'],
+                progress=progress,
+                abort_event=abort_event,
+                journal=journal,
+                file_name=download.get('file_name'),
+                base_offset=download.get('base_offset'),
+                digest=download.get('digest'),
+                cancel_token=cancel_token
+            )))
+        
+        # Cancelar detiene todos los archivos y rangos en el siguiente chunk
+        abort_handle = cancel_token.on_cancel(abort_event.set) if cancel_token else None
+        started = time.monotonic()
+        try:
+            with tracing.span('download', files=len(jobs)):
+                # Los hilos del pool heredan el span 'download' como padre de cada archivo
+                jobs = [(name, tracing.propagate(job)) for name, job in jobs]
+                self._run_parallel(jobs, self.max_parallel_disks, abort_event, 'disk')
+        finally:
+            progress.download_seconds += time.monotonic() - started
+            if abort_handle:
+                cancel_token.remove(abort_handle)
+        
+        if cancel_token:
+            cancel_token.check()
+        progress.flush()
+    
+    def _get_transport(self):
+        """
+        Obtener el transporte HTTP de descargas (se crea al primer uso)
+        
+        Returns:
+            DownloadTransport con pool dimensionado para las descargas en paralelo
+        """
+        if self.transport is None:
+            self.transport = DownloadTransport(
+                verify_ssl=self.verify_ssl,
+                chunk_size=self.chunk_size,
+                recv_buffer=self.recv_buffer,
+                pool_size=max(1, self.max_parallel_disks) * max(1, self.segments_per_file) + 1,
+                auth=(self.username, self.password)
+            )
+        
+        return self.transport
+    
+    def _open_stream(self, url, byte_range=None):
+        """
+        Abrir una descarga en streaming contra el host ESXi/vCenter
+        
+        Args:
+            url: URL del archivo
+            byte_range: Tupla (inicio, fin) inclusiva para pedir solo un rango
+                        (fin None = hasta el final)
+            
+        Returns:
+            requests.Response abierta en modo stream
+        """
+        headers = {}
+        
+        if byte_range:
+            start, end = byte_range
+            headers['Range'] = f'bytes={start}-{end if end is not None else ""}'
+        
+        # Conexión keep-alive del pool, autenticada con la cookie de sesión
+        response = self._get_transport().get(url, headers=headers)
+        
+        response.raise_for_status()
+        return response
+    
+    def _supports_range(self, url):
+        """
+        Comprobar si el servidor respeta peticiones HTTP Range para una URL
+        
+        Args:
+            url: URL del archivo
+            
+        Returns:
+            bool: True si responde 206 a un rango de un byte
+        """
+        try:
+            response = self._open_stream(url, (0, 0))
+        except Exception as e:
+            logger.debug(f"Range no soportado en {url}: {str(e)}")
+            return False
+        
+        try:
+            return response.status_code == 206
+        finally:
+            response.close()
+    
+    def _download_file(self, url, local_path, file_size, progress, abort_event=None,
+                       journal=None, file_name=None, base_offset=None, digest=None,
+                       cancel_token=None):
         """
         Descargar archivo desde URL con progreso
         
+        Los rangos a descargar salen del journal: si una exportación anterior
+        dejó el archivo a medias solo se piden los bytes que faltan mediante
+        HTTP Range. Si la descarga segmentada está habilitada, el archivo supera
+        segment_min_size y el servidor admite Range, el archivo se divide en
+        rangos que se descargan en paralelo; en otro caso se usa un único stream.
+        
+        El checksum se calcula en línea sobre el rango que empieza en el byte 0;
+        solo se leen del disco los bytes de intentos anteriores y los del resto
+        de rangos de una descarga segmentada.
+        
         Args:
             url: URL del archivo
             local_path: Ruta local donde guardar
             file_size: Tamaño del archivo
-            lease: HttpNfcLease para actualizar progreso
-            total_bytes: Total de bytes a descargar
-            downloaded_bytes: Bytes descargados hasta ahora
-            progress_callback: Callback para reportar progreso
+            progress: ExportProgress donde acumular los bytes descargados
+            abort_event: threading.Event que detiene la descarga si se activa
+            journal: ExportJournal donde registrar el progreso (opcional)
+            file_name: Nombre del archivo (por defecto el de local_path)
+            base_offset: Posición del archivo dentro de local_path si este es un
+                         contenedor ya reservado (OVA en streaming); None = archivo propio
+            digest: FileDigest donde calcular el checksum del archivo (opcional)
+            cancel_token: CancelToken que cierra los sockets de la descarga al
+                          cancelarse; se comprueba entre chunks (opcional)
         """
-        headers = {
-            'User-Agent': 'VMware-client'
-        }
+        file_name = file_name or os.path.basename(local_path)
+        file_size = file_size or 0
         
-        # Autenticación básica
-        auth = (self.username, self.password)
+        if abort_event is None:
+            abort_event = threading.Event()
         
-        # Descargar con streaming
-        response = requests.get(
-            url,
-            headers=headers,
-            auth=auth,
-            verify=self.verify_ssl,
-            stream=True
-        )
+        if journal is None:
+            journal = ExportJournal()
         
-        response.raise_for_status()
+        progress.start_file(file_name, file_size)
+        span = tracing.start_span('download_file', file_name=file_name, size=file_size,
+                                  host=urlparse(url).hostname)
+        resumed = None
+        
+        try:
+            segments = 1
+            if self.segments_per_file > 1 and file_size >= self.segment_min_size:
+                segments = self.segments_per_file
+            
+            ranges = journal.plan_file(file_name, local_path, file_size, segments)
+            
+            if journal.is_complete(file_name):
+                logger.info(f"Reutilizando {file_name} de una exportación anterior")
+                span.set_attribute('reused', True)
+                progress.add(file_name, journal.done_bytes(file_name))
+                if digest:
+                    digest.catch_up(local_path, base_offset or 0, journal.done_bytes(file_name))
+                return
+            
+            resumed = journal.done_bytes(file_name)
+            use_range = resumed > 0 or len(ranges) > 1
+            
+            if use_range and not self._supports_range(url):
+                logger.info(f"El servidor no admite Range, descargando {file_name} con un único stream")
+                ranges = journal.reset_file(file_name, local_path, file_size)
+                resumed = 0
+                use_range = False
+            
+            if resumed:
+                logger.info(f"Reanudando {file_name}: {resumed / (1024*1024):.2f} MB ya descargados")
+                progress.add(file_name, resumed)
+            elif base_offset is None:
+                preallocate_file(local_path, file_size)
+            
+            # El primer rango alimenta el checksum en línea, tras leer lo ya descargado
+            if digest:
+                digest.catch_up(local_path, base_offset or 0, ranges[0][0] + ranges[0][2])
+            
+            jobs = []
+            for index, (start, end, done) in enumerate(ranges):
+                if end is not None and start + done > end:
+                    continue
+                
+                jobs.append((f'{file_name} [{start + done}-{end}]', partial(
+                    self._download_range, url, local_path, file_name, index,
+                    start + done, end, use_range, progress, abort_event, journal,
+                    base_offset or 0, digest if index == 0 else None, cancel_token
+                )))
+            
+            span.set_attribute('resumed_bytes', resumed)
+            span.set_attribute('ranges', len(jobs))
+            
+            if len(jobs) > 1:
+                logger.info(f"Descarga segmentada de {file_name}: {len(jobs)} rangos")
+                self._run_parallel(jobs, len(jobs), abort_event, 'segment')
+            elif jobs:
+                jobs[0][1]()
+            
+            # Rangos descargados en paralelo: completar el checksum desde el disco
+            if digest:
+                digest.catch_up(local_path, base_offset or 0, file_size or journal.done_bytes(file_name))
+            
+            journal.complete_file(file_name)
+            
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            # Bytes recibidos en este intento (sin los reanudados ni reutilizados)
+            span.set_attribute('bytes', journal.done_bytes(file_name) - resumed if resumed is not None else 0)
+            span.end()
+            progress.finish_file(file_name)
+    
+    def _download_range(self, url, local_path, file_name, range_index, start, end,
+                        use_range, progress, abort_event, journal, base_offset=0, digest=None,
+                        cancel_token=None):
+        """
+        Descargar un rango de bytes y escribirlo en su posición del archivo
         
-        chunk_size = 1024 * 1024  # 1 MB
-        file_downloaded = 0
+        Args:
+            url: URL del archivo
+            local_path: Archivo local preasignado
+            file_name: Nombre del archivo en el journal
+            range_index: Índice del rango en el journal
+            start: Primer byte a descargar
+            end: Último byte (inclusivo) o None si el tamaño no se conoce
+            use_range: Pedir el rango con HTTP Range (False = archivo completo)
+            progress: ExportProgress donde acumular los bytes descargados
+            abort_event: threading.Event que detiene la descarga si se activa
+            journal: ExportJournal donde registrar el progreso
+            base_offset: Posición del archivo dentro de local_path
+            digest: FileDigest que se alimenta en línea (solo si el rango empieza
+                    justo donde termina lo ya incorporado al checksum)
+            cancel_token: CancelToken que cierra el socket al cancelarse (opcional)
+        """
+        transport = self._get_transport()
+        host = urlparse(url).hostname
+        response = self._open_stream(url, (start, end) if use_range else None)
         
-        # Asegurar que los valores no sean None
-        total_bytes = total_bytes or 0
-        downloaded_bytes = downloaded_bytes or 0
-        file_size = file_size or 0
+        # Una lectura bloqueada no vería el token: cancelar cierra el socket
+        abort_handle = cancel_token.on_cancel(partial(abort_response, response)) if cancel_token else None
         
-        with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                if chunk:
-                    f.write(chunk)
-                    file_downloaded += len(chunk)
-                    
-                    # Actualizar progreso del lease
-                    current_total = downloaded_bytes + file_downloaded
-                    if total_bytes > 0:
-                        progress_percent = int((current_total / total_bytes) * 100)
-                        progress_percent = min(progress_percent, 100)  # No exceder 100%
-                    else:
-                        progress_percent = 0
-                    
-                    try:
-                        lease.HttpNfcLeaseProgress(progress_percent)
-                    except:
-                        pass
+        if self.zero_copy:
+            # Un único buffer por rango: sin un bytes nuevo por chunk
+            chunks = transport.iter_into(response, bytearray(transport.chunk_size))
+        else:
+            chunks = response.iter_content(chunk_size=transport.chunk_size)
+        
+        try:
+            if use_range and response.status_code != 206:
+                raise Exception(f"El servidor no respetó el rango {start}-{end} de {file_name}")
+            
+            limit = end - start + 1 if end is not None else None
+            
+            with FileRegionWriter(local_path, base_offset + start, limit,
+                                  drop_cache=self.drop_page_cache) as writer:
+                for chunk in chunks:
+                    if cancel_token:
+                        cancel_token.check()
+                    if abort_event.is_set():
+                        raise Exception(f"Descarga interrumpida: {file_name}")
                     
-                    # Callback de progreso
-                    if progress_callback:
-                        if total_bytes > 0:
-                            overall_progress = 10 + int((current_total / total_bytes) * 70)
-                            overall_progress = min(overall_progress, 80)  # Max 80% durante descarga
-                        else:
-                            overall_progress = 10
-                        
-                        file_mb = file_downloaded / (1024 * 1024)
-                        total_mb = file_size / (1024 * 1024) if file_size > 0 else 0
-                        progress_callback(
-                            overall_progress,
-                            f'Descargando {os.path.basename(local_path)}: {file_mb:.1f}/{total_mb:.1f} MB'
-                        )
+                    if chunk:
+                        writer.write(chunk)
+                        if digest:
+                            digest.update(chunk)
+                        journal.advance(file_name, range_index, len(chunk))
+                        progress.add(file_name, len(chunk))
+                        progress.received(len(chunk), host)
+            
+            if end is not None and writer.written != end - start + 1:
+                raise Exception(
+                    f"Rango incompleto {start}-{end} de {file_name}: "
+                    f"{writer.written}/{end - start + 1} bytes"
+                )
+        finally:
+            if abort_handle:
+                cancel_token.remove(abort_handle)
+            response.close()
+    
+    def _task_error(self, task):
+        """Mensaje del error de una tarea fallida de vCenter"""
+        try:
+            error = task.info.error
+        except Exception as e:
+            return f'error desconocido ({str(e)})'
+        return getattr(error, 'localizedMessage', None) or getattr(error, 'msg', None) or str(error)
     
     def _wait_for_task(self, task, timeout=300):
         """
@@ -555,16 +1772,13 @@ class VMwareService:
         Returns:
             bool: True si exitoso, False en caso contrario
         """
-        start_time = time.time()
+        state = self._waiter().wait_one(task, 'info.state', lambda s: s in TASK_DONE_STATES, timeout)
         
-        while time.time() - start_time < timeout:
-            if task.info.state == vim.TaskInfo.State.success:
-                return True
-            elif task.info.state == vim.TaskInfo.State.error:
-                logger.error(f"Error en tarea: {task.info.error}")
-                return False
-            
-            time.sleep(1)
+        if state == vim.TaskInfo.State.success:
+            return True
+        elif state == vim.TaskInfo.State.error:
+            logger.error(f"Error en tarea: {task.info.error}")
+            return False
         
         logger.error("Timeout esperando tarea")
         return False